@@ -0,0 +1,252 @@
+import os
+import io
+import glob
+import gzip
+import json
+import lzma
+import time
+import threading
+
+INDEX_FILE = "index.ndjson"
+
+COMPRESSORS = {
+    "gzip": (".ndjson.gz", gzip.compress, gzip.open),
+    "xz": (".ndjson.xz", lzma.compress, lzma.open),
+}
+
+
+class SegmentArchive:
+    """Append-only archive of raw webhook bodies in compressed NDJSON segments.
+
+    Records are buffered in memory and written as one compressed gzip member
+    (or xz stream) per flush; concatenated members are still a valid file,
+    so a segment is readable up to its last flush even if the process dies.
+    Segments rotate by size and age. fsync happens every fsync_interval
+    seconds instead of per record. When a segment is closed its time range
+    is appended to index.ndjson so readers can find a window without
+    decompressing everything.
+    """
+
+    def __init__(self, directory, compression="gzip", max_segment_bytes=64 * 1024 * 1024,
+                 max_segment_age=3600, flush_interval=1.0, fsync_interval=5.0,
+                 buffer_bytes=256 * 1024):
+        if compression not in COMPRESSORS:
+            raise ValueError(f"Unsupported archive compression: {compression}")
+        self.directory = directory
+        self.suffix, self.compress, _ = COMPRESSORS[compression]
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.buffer_bytes = buffer_bytes
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.buffered = 0
+        self.fd = None
+        self.segment = None
+        self.sequence = 0
+        self.closed = False
+        self.pid = os.getpid()
+        os.makedirs(directory, exist_ok=True)
+        self.flusher = threading.Thread(target=self._flush_loop, name="archive-flush", daemon=True)
+        self.flusher.start()
+
+    def append(self, source, body, received_at=None):
+        received_at = received_at or time.time()
+        line = json.dumps({"ts": received_at, "source": source, "body": body}, ensure_ascii=False) + "\n"
+        data = line.encode("utf-8")
+        with self.lock:
+            if self.closed:
+                raise ValueError("Archive is closed")
+            if self.segment is None:
+                self._open_segment(received_at)
+            self.buffer.append(data)
+            self.buffered += len(data)
+            self.segment["records"] += 1
+            self.segment["last"] = received_at
+            if self.buffered >= self.buffer_bytes:
+                self._write_buffer()
+            self._maybe_rotate()
+
+    def flush(self, fsync=False):
+        with self.lock:
+            self._write_buffer()
+            if fsync:
+                self._fsync()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._close_segment()
+
+    def _flush_loop(self):
+        interval = min(self.flush_interval, self.fsync_interval)
+        while True:
+            time.sleep(interval)
+            with self.lock:
+                if self.closed:
+                    return
+                if self.segment is None:
+                    continue
+                now = time.monotonic()
+                if now - self.segment["flushed_at"] >= self.flush_interval:
+                    self._write_buffer()
+                if now - self.segment["synced_at"] >= self.fsync_interval:
+                    self._fsync()
+                self._maybe_rotate()
+
+    def _open_segment(self, started_at):
+        self.sequence += 1
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(started_at))
+        name = f"segment-{stamp}-{os.getpid()}-{self.sequence:04d}{self.suffix}"
+        self.fd = os.open(os.path.join(self.directory, name), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        now = time.monotonic()
+        self.segment = {
+            "segment": name,
+            "first": started_at,
+            "last": started_at,
+            "records": 0,
+            "bytes": 0,
+            "opened_at": now,
+            "flushed_at": now,
+            "synced_at": now,
+            "dirty": False,
+        }
+
+    def _write_buffer(self):
+        if not self.buffer:
+            return
+        compressed = self.compress(b"".join(self.buffer))
+        os.write(self.fd, compressed)
+        self.segment["bytes"] += len(compressed)
+        self.segment["flushed_at"] = time.monotonic()
+        self.segment["dirty"] = True
+        self.buffer = []
+        self.buffered = 0
+
+    def _fsync(self):
+        if self.segment and self.segment["dirty"]:
+            os.fsync(self.fd)
+            self.segment["dirty"] = False
+        if self.segment:
+            self.segment["synced_at"] = time.monotonic()
+
+    def _maybe_rotate(self):
+        segment = self.segment
+        if segment is None:
+            return
+        too_big = segment["bytes"] + self.buffered >= self.max_segment_bytes
+        too_old = time.monotonic() - segment["opened_at"] >= self.max_segment_age
+        if too_big or too_old:
+            self._close_segment()
+
+    def _close_segment(self):
+        if self.segment is None:
+            return
+        self._write_buffer()
+        self._fsync()
+        os.close(self.fd)
+        entry = {key: self.segment[key] for key in ("segment", "first", "last", "records", "bytes")}
+        if entry["records"]:
+            append_index(self.directory, entry)
+        else:
+            os.unlink(os.path.join(self.directory, entry["segment"]))
+        self.fd = None
+        self.segment = None
+
+
+def append_index(directory, entry):
+    # A single O_APPEND write per line keeps concurrent writers from interleaving
+    line = (json.dumps(entry) + "\n").encode("utf-8")
+    fd = os.open(os.path.join(directory, INDEX_FILE), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, line)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_index(directory):
+    path = os.path.join(directory, INDEX_FILE)
+    entries = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[entry["segment"]] = entry
+    return entries
+
+
+def segment_files(directory):
+    paths = []
+    for suffix, _, _ in COMPRESSORS.values():
+        paths.extend(glob.glob(os.path.join(directory, "segment-*" + suffix)))
+    return sorted(paths)
+
+
+def find_segments(directory, start=None, end=None):
+    """Segments that may hold records with start <= ts <= end (epoch seconds).
+
+    Segments without an index entry (still open, or left behind by a crash)
+    are always included since their time range is unknown.
+    """
+    index = read_index(directory)
+    matches = []
+    for path in segment_files(directory):
+        entry = index.get(os.path.basename(path))
+        if entry:
+            if start is not None and entry["last"] < start:
+                continue
+            if end is not None and entry["first"] > end:
+                continue
+        matches.append(path)
+    return matches
+
+
+def iter_records(path, start=None, end=None):
+    opener = open
+    for suffix, _, open_compressed in COMPRESSORS.values():
+        if path.endswith(suffix):
+            opener = open_compressed
+    with opener(path, "rb") as raw:
+        reader = io.TextIOWrapper(raw, encoding="utf-8")
+        try:
+            for line in reader:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                ts = record.get("ts")
+                if start is not None and ts is not None and ts < start:
+                    continue
+                if end is not None and ts is not None and ts > end:
+                    continue
+                yield record
+        except (EOFError, lzma.LZMAError, gzip.BadGzipFile):
+            # Tail of a segment whose writer died mid-flush
+            return
+
+
+def rebuild_index(directory):
+    # Index segments that were never closed cleanly
+    index = read_index(directory)
+    added = []
+    for path in segment_files(directory):
+        name = os.path.basename(path)
+        if name in index:
+            continue
+        first = last = None
+        records = 0
+        for record in iter_records(path):
+            ts = record.get("ts")
+            first = ts if first is None else min(first, ts)
+            last = ts if last is None else max(last, ts)
+            records += 1
+        if records:
+            entry = {"segment": name, "first": first, "last": last, "records": records,
+                     "bytes": os.path.getsize(path)}
+            append_index(directory, entry)
+            added.append(entry)
+    return added
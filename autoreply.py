@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import deque
+
+
+class KeywordAutomaton:
+    """Aho–Corasick automaton over (keyword, value, rank) entries.
+
+    best(text) scans the text once and returns the value of the matching
+    entry with the lowest rank, or None. Each state stores the best entry
+    reachable through its failure chain, so a scan is one dict lookup per
+    character plus failure transitions, independent of the number of
+    keywords.
+    """
+
+    def __init__(self, entries):
+        self.goto = [{}]
+        self.fail = [0]
+        self.best_at = [None]  # state -> (rank, value) of its best match
+        for keyword, value, rank in entries:
+            if not keyword:
+                continue
+            state = 0
+            for char in keyword:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.best_at.append(None)
+                state = next_state
+            if self.best_at[state] is None or rank < self.best_at[state][0]:
+                self.best_at[state] = (rank, value)
+        self._link()
+
+    def _link(self):
+        pending = deque(self.goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, next_state in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                inherited = self.best_at[self.fail[next_state]]
+                own = self.best_at[next_state]
+                if inherited is not None and (own is None or inherited[0] < own[0]):
+                    self.best_at[next_state] = inherited
+                pending.append(next_state)
+
+    def best(self, text):
+        goto, fail, best_at = self.goto, self.fail, self.best_at
+        state = 0
+        found = None
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            hit = best_at[state]
+            if hit is not None and (found is None or hit[0] < found[0]):
+                found = hit
+        return found[1] if found else None
+
+
+class AutoReplyEngine:
+    """Keyword rules compiled into a KeywordAutomaton and hot-reloaded.
+
+    load_rules() returns (keyword, reply, priority) tuples; version() returns
+    any value that changes whenever the rules do. The version is checked at
+    most every reload_interval seconds and the automaton is rebuilt only
+    when it differs, so matching never waits on the database.
+    """
+
+    def __init__(self, load_rules, version, reload_interval=30):
+        self.load_rules = load_rules
+        self.version = version
+        self.reload_interval = reload_interval
+        self.lock = threading.Lock()
+        self.automaton = KeywordAutomaton([])
+        self.loaded_version = None
+        self.checked_at = None
+        self.rules = 0
+        self.matches = 0
+        self.misses = 0
+
+    def reload(self, force=False):
+        current = self.version()
+        if force or current != self.loaded_version or self.checked_at is None:
+            rules = self.load_rules()
+            # Longer keywords win among equal priorities: "เลขพัสดุ" before "พัสดุ"
+            entries = [
+                (keyword.casefold(), reply, (priority, -len(keyword), index))
+                for index, (keyword, reply, priority) in enumerate(rules)
+            ]
+            automaton = KeywordAutomaton(entries)
+            with self.lock:
+                self.automaton = automaton
+                self.rules = len(entries)
+                self.loaded_version = current
+        self.checked_at = time.monotonic()
+
+    def match(self, text):
+        if self.checked_at is None or time.monotonic() - self.checked_at >= self.reload_interval:
+            self.reload()
+        reply = self.automaton.best(text.casefold())
+        with self.lock:
+            if reply is None:
+                self.misses += 1
+            else:
+                self.matches += 1
+        return reply
+
+    def metrics(self):
+        with self.lock:
+            return {"rules": self.rules, "matches": self.matches, "misses": self.misses}
@@ -0,0 +1,238 @@
+"""Benchmark cases for webhook.py, run against a single database backend.
+
+Invoked by bench/run.py in a subprocess per backend, because webhook.py
+binds its engine to DATABASE_URL at import time:
+
+    python -m bench.cases --backend sqlite --database-url sqlite:////tmp/bench.db \
+        --output /tmp/sqlite.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import logging
+import statistics
+from datetime import datetime
+from sqlalchemy import insert
+
+BENCH_SECRET = "bench-channel-secret"
+BENCH_SHOP_KEY = "bench-shop-key"
+BENCH_ADMIN_ID = "U" + "a" * 32
+
+
+def configure_environment(database_url, api_base_url):
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["LINE_CHANNEL_SECRET"] = BENCH_SECRET
+    os.environ["LINESHOP_KEY"] = BENCH_SHOP_KEY
+    os.environ["LINE_ACCESS_TOKEN"] = "bench-token"
+    os.environ["OPENAI_API_KEY"] = "bench-token"
+    os.environ["ADMIN_ID"] = BENCH_ADMIN_ID
+    os.environ["FORWARD_USER_ID"] = ""
+    os.environ["LINE_API_BASE_URL"] = api_base_url
+    os.environ["LINE_DATA_API_BASE_URL"] = api_base_url
+    os.environ["OPENAI_API_BASE_URL"] = api_base_url
+
+
+def measure(fn, operations, repeat):
+    # fn() performs `operations` units of work; report the median rate
+    rates = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        rates.append(operations / elapsed)
+    return statistics.median(rates)
+
+
+class FakeRequest:
+    def __init__(self, body, headers):
+        self.body = body
+        self.headers = headers
+
+    def get_data(self, as_text=False):
+        return self.body if as_text else self.body.encode("utf-8")
+
+
+class Cases:
+    def __init__(self, webhook, loadtest, repeat, scale):
+        self.webhook = webhook
+        self.loadtest = loadtest
+        self.repeat = repeat
+        self.scale = scale
+        self.factory = loadtest.PayloadFactory(seed=42, user_pool=1000, new_user_ratio=0.0,
+                                               admin_ratio=0.0, non_text_ratio=0.0, max_events=3)
+        self.client = webhook.app.test_client()
+
+    def reset(self):
+        # Everything the cases write, children before the orders they reference
+        wh = self.webhook
+        wh.session.rollback()
+        for model in (wh.LineMyShopOrderPayload, wh.LineMyShopOrderItem, wh.LineMyShopOrder,
+                      wh.SalesDailyStatus, wh.SalesDailySku, wh.Media, wh.Message, wh.AdminMessage,
+                      wh.ChatGPTLog, wh.UserDailyActivity, wh.UserProfile, wh.InboundEvent,
+                      wh.DeadLetterEvent):
+            wh.session.query(model).delete()
+        wh.session.commit()
+        wh.known_profiles.clear()
+        wh.activity_leaderboard.refresh()
+
+    def seed_profiles(self):
+        wh = self.webhook
+        rows = [{"user_id": u, "display_name": f"bench {i}"} for i, u in enumerate(self.factory.users)]
+        wh.session.execute(insert(wh.UserProfile), rows)
+        wh.session.commit()
+
+    def signature_verification(self):
+        body = json.dumps(self.factory.line_payload(), ensure_ascii=False)
+        req = FakeRequest(body, {"X-Line-Signature": self.loadtest.sign_line_body(body, BENCH_SECRET)})
+        shop_body = json.dumps(self.factory.myshop_payload(), ensure_ascii=False)
+        shop_req = FakeRequest(shop_body, {"x-myshop-signature":
+                                           self.loadtest.sign_myshop_body(shop_body, BENCH_SHOP_KEY)})
+        n = 20000 * self.scale
+
+        def run():
+            for _ in range(n // 2):
+                assert self.webhook.is_valid_signature(req)
+                assert self.webhook.is_valid_myshop_signature(shop_req)
+
+        return measure(run, n, self.repeat)
+
+    def payload_parsing(self):
+        bodies = [json.dumps(self.factory.line_payload(), ensure_ascii=False) for _ in range(100)]
+        n = 200 * self.scale
+
+        def run():
+            for _ in range(n):
+                for body in bodies:
+                    data = json.loads(body)
+                    for event in data["events"]:
+                        event["source"]["userId"], event["message"].get("text")
+
+        return measure(run, n * len(bodies), self.repeat)
+
+    def message_bulk_insert(self):
+        wh = self.webhook
+        n = 5000 * self.scale
+        rng = random.Random(1)
+        rows = [{"date": datetime(2025, 1, 1, rng.randint(0, 23), rng.randint(0, 59)),
+                 "text": rng.choice(self.loadtest.THAI_TEXTS),
+                 "user_id": rng.choice(self.factory.users)} for _ in range(n)]
+
+        def run():
+            wh.session.execute(insert(wh.Message), rows)
+            wh.session.commit()
+
+        rate = measure(run, n, self.repeat)
+        self.reset()
+        return rate
+
+    def user_profile_lookup(self):
+        wh = self.webhook
+        self.seed_profiles()
+        rng = random.Random(2)
+        lookups = [rng.choice(self.factory.users) for _ in range(2000 * self.scale)]
+
+        def run():
+            for user_id in lookups:
+                wh.session.query(wh.UserProfile).filter_by(user_id=user_id).first()
+            wh.session.rollback()
+
+        rate = measure(run, len(lookups), self.repeat)
+        self.reset()
+        return rate
+
+    def myshop_ingestion(self):
+        payloads = []
+        for _ in range(200 * self.scale):
+            body = json.dumps(self.factory.myshop_payload(), ensure_ascii=False)
+            payloads.append((body, self.loadtest.sign_myshop_body(body, BENCH_SHOP_KEY)))
+
+        def run():
+            for body, signature in payloads:
+                response = self.client.post("/sassy-line-myshop-webhook", data=body.encode("utf-8"),
+                                            headers={"x-myshop-signature": signature,
+                                                     "Content-Type": "application/json"})
+                assert response.status_code == 200, response.get_data(as_text=True)
+
+        rate = measure(run, len(payloads), self.repeat)
+        self.reset()
+        return rate
+
+    def webhook_end_to_end(self):
+        self.seed_profiles()
+        requests_ = []
+        events = 0
+        for _ in range(300 * self.scale):
+            payload = self.factory.line_payload()
+            events += len(payload["events"])
+            body = json.dumps(payload, ensure_ascii=False)
+            requests_.append((body, self.loadtest.sign_line_body(body, BENCH_SECRET)))
+
+        def run():
+            for body, signature in requests_:
+                response = self.client.post("/webhook", data=body.encode("utf-8"),
+                                            headers={"X-Line-Signature": signature,
+                                                     "Content-Type": "application/json"})
+                assert response.status_code == 200, response.get_data(as_text=True)
+
+        rate = measure(run, events, self.repeat)
+        self.reset()
+        return rate
+
+
+# name -> (method, unit, needs a database)
+CASES = {
+    "signature_verification": ("signature_verification", "verifications/s", False),
+    "payload_parsing": ("payload_parsing", "payloads/s", False),
+    "message_bulk_insert": ("message_bulk_insert", "rows/s", True),
+    "user_profile_lookup": ("user_profile_lookup", "lookups/s", True),
+    "myshop_ingestion": ("myshop_ingestion", "orders/s", True),
+    "webhook_end_to_end": ("webhook_end_to_end", "events/s", True),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run benchmark cases against one backend")
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--backend", required=True)
+    parser.add_argument("--micro", action="store_true", help="also run database-independent cases")
+    parser.add_argument("--only", nargs="*", help="case names to run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--output", required=True, help="write results JSON here")
+    args = parser.parse_args(argv)
+
+    import fake_apis
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server, api_url = fake_apis.serve_in_background()
+    configure_environment(args.database_url, api_url)
+
+    import loadtest
+    import webhook
+
+    webhook.Base.metadata.drop_all(webhook.engine)
+    webhook.Base.metadata.create_all(webhook.engine)
+
+    cases = Cases(webhook, loadtest, args.repeat, args.scale)
+    results = {}
+    for name, (method, unit, needs_db) in CASES.items():
+        if args.only and name not in args.only:
+            continue
+        if not needs_db and not args.micro:
+            continue
+        key = f"{args.backend}.{name}" if needs_db else f"micro.{name}"
+        value = getattr(cases, method)()
+        results[key] = {"value": value, "unit": unit, "higher_is_better": True}
+        print(f"⏱️  {key}: {value:,.1f} {unit}", file=sys.stderr)
+
+    server.shutdown()
+    with open(args.output, "w") as f:
+        json.dump(results, f)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""Benchmark order reporting scans with and without raw payloads inline.
+
+Fills line_myshop_orders (plus the compressed line_myshop_order_payloads
+side table) with --orders synthetic MyShop orders, and a copy of the same
+rows in bench_orders_wide that keeps the old inline raw_data column
+(skipped when both already hold that many rows). Then times the reporting
+aggregations over both tables:
+
+    python -m bench.orders_bench --database-url postgresql://localhost/bench --orders 1000000
+
+The database's order tables are appended to; do not point this at production.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+from sqlalchemy import MetaData, Table, Column, Text, select, func
+
+WIDE_TABLE = "bench_orders_wide"
+
+
+def wide_table(webhook):
+    # line_myshop_orders as it was before the payload split: raw_data inline, ahead of date
+    metadata = MetaData()
+    columns = []
+    for column in webhook.LineMyShopOrder.__table__.columns:
+        if column.name == "date":
+            columns.append(Column("raw_data", Text))
+        columns.append(column._copy())
+    return Table(WIDE_TABLE, metadata, *columns)
+
+
+def populate(webhook, wide, orders, seed, batch_size=5000):
+    import loadtest
+
+    wide.create(webhook.engine, checkfirst=True)
+    narrow = webhook.LineMyShopOrder.__table__
+    with webhook.engine.connect() as conn:
+        existing = min(conn.execute(select(func.count()).select_from(narrow)).scalar(),
+                       conn.execute(select(func.count()).select_from(wide)).scalar())
+    factory = loadtest.PayloadFactory(seed=seed)
+    rng = random.Random(seed)
+    start = datetime(2023, 1, 1)
+    remaining = orders - existing
+    print(f"📝 {existing} orders present, inserting {max(remaining, 0)}", file=sys.stderr)
+    inserted = 0
+    while inserted < remaining:
+        rows, wide_rows, payloads = [], [], []
+        for _ in range(min(batch_size, remaining - inserted)):
+            data = factory.myshop_payload()
+            fields = webhook.myshop_order_fields(data)
+            fields["date"] = start + timedelta(seconds=rng.randint(0, 2 * 365 * 86400))
+            rows.append(fields)
+            wide_rows.append(dict(fields, raw_data=str(data)))
+            payloads.append(data)
+        with webhook.engine.begin() as conn:
+            ids = conn.execute(webhook.insert(narrow).returning(narrow.c.id, sort_by_parameter_order=True), rows).scalars().all()
+            conn.execute(webhook.insert(webhook.LineMyShopOrderPayload), [
+                {"order_id": order_id, "event_name": row["event_name"], "event_timestamp": row["event_timestamp"],
+                 "received_at": row["date"], "payload": webhook.compress_payload(data)}
+                for order_id, row, data in zip(ids, rows, payloads)
+            ])
+            conn.execute(webhook.insert(wide), wide_rows)
+        inserted += len(rows)
+        if inserted % (batch_size * 20) == 0:
+            print(f"   {inserted}/{remaining}", file=sys.stderr)
+    if webhook.engine.dialect.name == "postgresql":
+        with webhook.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            for name in (narrow.name, WIDE_TABLE, webhook.LineMyShopOrderPayload.__tablename__):
+                conn.execute(webhook.sql_text(f"VACUUM ANALYZE {name}"))
+
+
+def table_bytes(webhook, name):
+    with webhook.engine.connect() as conn:
+        if webhook.engine.dialect.name == "postgresql":
+            return conn.execute(select(func.pg_total_relation_size(name))).scalar()
+        try:
+            return conn.execute(webhook.sql_text("SELECT sum(pgsize) FROM dbstat WHERE name = :name"), {"name": name}).scalar()
+        except Exception:
+            # SQLite built without the dbstat virtual table
+            return None
+
+
+def queries(table):
+    return {
+        "status_totals": select(table.c.order_status, func.count(), func.sum(table.c.total_price))
+            .group_by(table.c.order_status),
+        "daily_revenue": select(func.date(table.c.date), func.sum(table.c.total_price))
+            .where(table.c.order_status != "CANCELLED")
+            .group_by(func.date(table.c.date)),
+        "cod_share": select(table.c.payment_method, func.count(), func.sum(table.c.shipment_price))
+            .where(table.c.is_cod)
+            .group_by(table.c.payment_method),
+    }
+
+
+def time_queries(webhook, table, repeat):
+    results = {}
+    for label, query in queries(table).items():
+        latencies = []
+        for _ in range(repeat):
+            with webhook.engine.connect() as conn:
+                started = time.perf_counter()
+                conn.execute(query).all()
+                latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+        results[label] = {"p50_ms": statistics.median(latencies), "max_ms": latencies[-1]}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark order reporting scans")
+    parser.add_argument("--database-url", default=os.environ.get("BENCH_DATABASE_URL"))
+    parser.add_argument("--orders", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("--database-url or BENCH_DATABASE_URL is required")
+
+    os.environ["DATABASE_URL"] = args.database_url
+    import webhook
+
+    wide = wide_table(webhook)
+    populate(webhook, wide, args.orders, args.seed)
+    narrow = webhook.LineMyShopOrder.__table__
+    report = {"orders": args.orders, "backend": webhook.engine.dialect.name, "bytes": {}, "queries": {}}
+    for name in (narrow.name, WIDE_TABLE, webhook.LineMyShopOrderPayload.__tablename__):
+        report["bytes"][name] = table_bytes(webhook, name)
+    report["queries"]["narrow"] = time_queries(webhook, narrow, args.repeat)
+    report["queries"]["wide"] = time_queries(webhook, wide, args.repeat)
+    report["speedup"] = {
+        label: round(report["queries"]["wide"][label]["p50_ms"] / report["queries"]["narrow"][label]["p50_ms"], 2)
+        for label in report["queries"]["narrow"]
+    }
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
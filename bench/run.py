@@ -0,0 +1,129 @@
+"""Benchmark regression suite for the webhook hot paths.
+
+Runs bench/cases.py against SQLite (always) and PostgreSQL (when
+BENCH_POSTGRES_URL is set), writes the results as JSON and compares them
+with bench/baseline.json. Any metric that drops more than --tolerance below
+its baseline is reported as a regression and the exit status is 1.
+
+    python -m bench.run                       # run and compare
+    python -m bench.run --output results.json
+    python -m bench.run --update-baseline     # accept the current numbers
+
+BENCH_POSTGRES_URL must point at a throwaway database: the cases drop and
+recreate the webhook tables.
+"""
+import os
+import sys
+import json
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+
+def run_backend(backend, database_url, args, micro):
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        output = f.name
+    command = [sys.executable, "-m", "bench.cases", "--backend", backend,
+               "--database-url", database_url, "--repeat", str(args.repeat),
+               "--scale", str(args.scale), "--output", output]
+    if micro:
+        command.append("--micro")
+    if args.only:
+        command += ["--only"] + args.only
+    print(f"🏁 Running {backend} benchmarks", file=sys.stderr)
+    # The webhook prints every payload; keep that noise out of the report
+    subprocess.run(command, cwd=REPO_DIR, stdout=subprocess.DEVNULL, check=True)
+    with open(output) as f:
+        results = json.load(f)
+    os.unlink(output)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    report = {}
+    regressions = []
+    for key, result in sorted(results.items()):
+        base = baseline.get(key)
+        if not base:
+            report[key] = {"value": result["value"], "unit": result["unit"], "status": "new"}
+            continue
+        change = (result["value"] - base["value"]) / base["value"]
+        if not result.get("higher_is_better", True):
+            change = -change
+        status = "regression" if change < -tolerance else "ok"
+        if status == "regression":
+            regressions.append(key)
+        report[key] = {
+            "value": result["value"],
+            "baseline": base["value"],
+            "unit": result["unit"],
+            "change": change,
+            "status": status,
+        }
+    return report, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the benchmark suite and compare with the baseline")
+    parser.add_argument("--only", nargs="*", help="case names to run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed fractional slowdown before a metric counts as a regression")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", help="write the results JSON here")
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        results.update(run_backend("sqlite", f"sqlite:///{os.path.join(tmp, 'bench.db')}", args, micro=True))
+    postgres_url = os.environ.get("BENCH_POSTGRES_URL")
+    if postgres_url:
+        results.update(run_backend("postgresql", postgres_url, args, micro=False))
+    else:
+        print("⚠️ BENCH_POSTGRES_URL not set, skipping PostgreSQL benchmarks", file=sys.stderr)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+
+    report, regressions = compare(results, baseline, args.tolerance)
+    document = {
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "machine": {"python": platform.python_version(), "platform": platform.platform()},
+        "tolerance": args.tolerance,
+        "results": report,
+        "regressions": regressions,
+    }
+    output = json.dumps(document, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump({"machine": document["machine"], "updated_at": document["created_at"],
+                       "results": baseline}, f, indent=2)
+            f.write("\n")
+        print(f"💾 Baseline updated: {args.baseline}", file=sys.stderr)
+        return 0
+
+    for key in regressions:
+        item = report[key]
+        print(f"❌ {key}: {item['value']:,.1f} {item['unit']} vs baseline {item['baseline']:,.1f} "
+              f"({item['change']:+.1%})", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
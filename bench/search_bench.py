@@ -0,0 +1,121 @@
+"""Benchmark /search over a large messages table.
+
+Fills a throwaway database with --rows synthetic Thai/English messages
+(skipped when it already holds that many), then times search_messages()
+for selective and common terms, with the trigram index and with a plain
+LIKE scan for comparison:
+
+    python -m bench.search_bench --database-url postgresql://localhost/bench --rows 10000000
+
+The database's messages table is appended to; do not point this at production.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+WORDS = ["สวัสดี", "ค่ะ", "ครับ", "ราคา", "เท่าไหร่", "เลขพัสดุ", "โปรโมชั่น", "ส่งของ", "วันไหน",
+         "สั่งซื้อ", "ขอบคุณ", "มาก", "สีดำ", "ไซส์", "เปลี่ยน", "คืนเงิน", "order", "tracking", "please"]
+# Common words, a two-term query and a selective order-number fragment
+QUERIES = ["เลขพัสดุ", "โปรโมชั่น", "tracking", "ราคา สีดำ", "4242"]
+
+
+def synthetic_text(rng):
+    words = rng.choices(WORDS, k=rng.randint(2, 8))
+    if rng.random() < 0.1:
+        words.append(str(rng.randint(10000000, 99999999)))
+    return "".join(words) if rng.random() < 0.7 else " ".join(words)
+
+
+def populate(webhook, rows, seed, batch_size=10000):
+    session = webhook.session
+    existing = session.query(webhook.func.count(webhook.Message.id)).scalar()
+    session.rollback()
+    rng = random.Random(seed)
+    users = ["U%032x" % rng.getrandbits(128) for _ in range(max(rows // 200, 10))]
+    start = datetime(2023, 1, 1)
+    remaining = rows - existing
+    print(f"📝 {existing} rows present, inserting {max(remaining, 0)}", file=sys.stderr)
+    inserted = 0
+    while inserted < remaining:
+        batch = []
+        for _ in range(min(batch_size, remaining - inserted)):
+            batch.append({
+                "date": start + timedelta(seconds=rng.randint(0, 3 * 365 * 86400)),
+                "text": synthetic_text(rng),
+                "user_id": rng.choice(users),
+            })
+        session.execute(webhook.insert(webhook.Message), batch)
+        session.commit()
+        inserted += len(batch)
+        if inserted % (batch_size * 50) == 0:
+            print(f"   {inserted}/{remaining}", file=sys.stderr)
+    if webhook.engine.dialect.name == "postgresql":
+        with webhook.engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(webhook.sql_text("ANALYZE messages"))
+    return users
+
+
+def time_queries(webhook, users, repeat, rng):
+    results = {}
+    for q in QUERIES:
+        for label, kwargs in (
+            ("first_page", {}),
+            ("user_filter", {"user_id": rng.choice(users)}),
+            ("date_range", {"since": datetime(2024, 1, 1), "until": datetime(2024, 2, 1)}),
+        ):
+            latencies = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                rows, cursor = webhook.search_messages(q, limit=50, **kwargs)
+                if cursor:
+                    webhook.search_messages(q, limit=50, cursor=webhook.decode_cursor(cursor), **kwargs)
+                latencies.append((time.perf_counter() - started) * 1000 / (2 if cursor else 1))
+                webhook.session.rollback()
+            latencies.sort()
+            results[f"{q}|{label}"] = {
+                "p50_ms": statistics.median(latencies),
+                "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark message search")
+    parser.add_argument("--database-url", default=os.environ.get("BENCH_DATABASE_URL"))
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--skip-like", action="store_true", help="do not time the LIKE-scan fallback")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("--database-url or BENCH_DATABASE_URL is required")
+
+    os.environ["DATABASE_URL"] = args.database_url
+    import webhook
+
+    users = populate(webhook, args.rows, args.seed)
+    report = {"rows": args.rows, "backend": webhook.engine.dialect.name,
+              "index": webhook.SEARCH_BACKEND, "queries": {}}
+    report["queries"][webhook.SEARCH_BACKEND] = time_queries(webhook, users, args.repeat, random.Random(args.seed))
+    # On PostgreSQL the trigram index also serves ILIKE, so only FTS5 has a separate scan path
+    if not args.skip_like and webhook.SEARCH_BACKEND == "fts5":
+        indexed, webhook.SEARCH_BACKEND = webhook.SEARCH_BACKEND, "like"
+        report["queries"]["like"] = time_queries(webhook, users, max(3, args.repeat // 5), random.Random(args.seed))
+        webhook.SEARCH_BACKEND = indexed
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
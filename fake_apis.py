@@ -0,0 +1,287 @@
+"""Local stand-in for the LINE Messaging API and the OpenAI chat API.
+
+Point LINE_API_BASE_URL, LINE_DATA_API_BASE_URL and OPENAI_API_BASE_URL at
+this server to load-test or regression-test webhook.py offline:
+
+    python fake_apis.py --port 9000 --line-latency lognormal:3,0.5 \
+        --openai-latency normal:800,200 --rate-429 0.01 --rate-5xx 0.005
+
+Latency specs are "<dist>:<params>" in milliseconds: fixed:20,
+uniform:10,50, normal:40,10, lognormal:<mu>,<sigma> (of ln ms) and
+exponential:<mean>. Recorded requests are available at /__fake__/requests
+and the config can be changed at runtime via POST /__fake__/config.
+"""
+import sys
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from collections import deque
+from flask import Flask, request, jsonify, Response
+
+LATENCY_SAMPLERS = {
+    "fixed": lambda rng, p: p[0],
+    "uniform": lambda rng, p: rng.uniform(p[0], p[1]),
+    "normal": lambda rng, p: rng.gauss(p[0], p[1]),
+    "lognormal": lambda rng, p: rng.lognormvariate(p[0], p[1]),
+    "exponential": lambda rng, p: rng.expovariate(1.0 / p[0]) if p[0] > 0 else 0.0,
+}
+
+
+def parse_latency(spec):
+    if not spec:
+        return None
+    name, _, params = spec.partition(":")
+    if name not in LATENCY_SAMPLERS:
+        raise ValueError(f"Unknown latency distribution: {name}")
+    values = [float(v) for v in params.split(",") if v.strip()] or [0.0]
+    return name, values
+
+
+class FakeState:
+    def __init__(self, line_latency=None, openai_latency=None, rate_429=0.0, rate_5xx=0.0,
+                 record_limit=10000, record_file=None, content_size=256 * 1024, followers=1000, seed=None):
+        self.line_latency = parse_latency(line_latency)
+        self.openai_latency = parse_latency(openai_latency)
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.content_size = content_size
+        self.followers = followers
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recorded = deque(maxlen=record_limit)
+        self.counters = {}
+        self.record_file = open(record_file, "a") if record_file else None
+
+    def config(self):
+        return {
+            "line_latency": self.line_latency,
+            "openai_latency": self.openai_latency,
+            "rate_429": self.rate_429,
+            "rate_5xx": self.rate_5xx,
+            "content_size": self.content_size,
+            "followers": self.followers,
+        }
+
+    def update(self, changes):
+        with self.lock:
+            for key in ("line_latency", "openai_latency"):
+                if key in changes:
+                    setattr(self, key, parse_latency(changes[key]))
+            for key in ("rate_429", "rate_5xx"):
+                if key in changes:
+                    setattr(self, key, float(changes[key]))
+            for key in ("content_size", "followers"):
+                if key in changes:
+                    setattr(self, key, int(changes[key]))
+
+    def sleep_for(self, api):
+        latency = self.line_latency if api == "line" else self.openai_latency
+        if not latency:
+            return
+        name, params = latency
+        with self.lock:
+            delay_ms = LATENCY_SAMPLERS[name](self.rng, params)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000.0)
+
+    def injected_fault(self):
+        with self.lock:
+            roll = self.rng.random()
+        if roll < self.rate_429:
+            return 429
+        if roll < self.rate_429 + self.rate_5xx:
+            return 500
+        return None
+
+    def record(self, entry):
+        with self.lock:
+            self.recorded.append(entry)
+            name = entry["endpoint"]
+            self.counters[name] = self.counters.get(name, 0) + 1
+            if self.record_file:
+                self.record_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                self.record_file.flush()
+
+
+def create_app(state=None):
+    state = state or FakeState()
+    app = Flask(__name__)
+    app.config["FAKE_STATE"] = state
+
+    def simulate(api, endpoint):
+        state.sleep_for(api)
+        fault = state.injected_fault()
+        state.record({
+            "time": time.time(),
+            "endpoint": endpoint,
+            "method": request.method,
+            "path": request.path,
+            "status": fault or 200,
+            "body": request.get_json(silent=True),
+        })
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return jsonify({"message": "Authentication failed"}), 401
+        if fault == 429:
+            return jsonify({"message": "The API rate limit has been exceeded. Try again later."}), 429
+        if fault:
+            return jsonify({"message": "Internal server error (injected)"}), fault
+        return None
+
+    def sent_messages():
+        messages = (request.get_json(silent=True) or {}).get("messages", [])
+        return [{"id": str(uuid.uuid4().int >> 64), "quoteToken": uuid.uuid4().hex} for _ in messages]
+
+    @app.route("/v2/bot/message/push", methods=["POST"])
+    def push():
+        return simulate("line", "push") or jsonify({"sentMessages": sent_messages()})
+
+    @app.route("/v2/bot/message/reply", methods=["POST"])
+    def reply():
+        return simulate("line", "reply") or jsonify({"sentMessages": sent_messages()})
+
+    @app.route("/v2/bot/message/multicast", methods=["POST"])
+    def multicast():
+        return simulate("line", "multicast") or jsonify({})
+
+    @app.route("/v2/bot/profile/<user_id>", methods=["GET"])
+    def profile(user_id):
+        failed = simulate("line", "profile")
+        if failed:
+            return failed
+        return jsonify({
+            "userId": user_id,
+            "displayName": f"ลูกค้า {user_id[-6:]}",
+            "pictureUrl": f"https://profile.line-scdn.net/{user_id}",
+            "statusMessage": "Hello, LINE!",
+            "language": "th",
+        })
+
+    @app.route("/v2/bot/followers/ids", methods=["GET"])
+    def follower_ids():
+        failed = simulate("line", "follower_ids")
+        if failed:
+            return failed
+        limit = min(request.args.get("limit", 300, type=int), 1000)
+        start = int(request.args.get("start") or 0)
+        end = min(start + limit, state.followers)
+        # Stable ids so repeated backfills see the same followers
+        body = {"userIds": ["U%032x" % (i + 1) for i in range(start, end)]}
+        if end < state.followers:
+            body["next"] = str(end)
+        return jsonify(body)
+
+    @app.route("/v2/bot/message/<message_id>/content", methods=["GET"])
+    def content(message_id):
+        failed = simulate("line", "content")
+        if failed:
+            return failed
+        size = state.content_size
+        # Deterministic per message id so repeat downloads hash the same
+        block = hashlib.sha256(message_id.encode()).digest() * 2048
+
+        def generate():
+            remaining = size
+            while remaining > 0:
+                chunk = block[:remaining]
+                remaining -= len(chunk)
+                yield chunk
+
+        return Response(generate(), mimetype="image/jpeg", headers={"Content-Length": str(size)})
+
+    @app.route("/v1/chat/completions", methods=["POST"])
+    def chat_completions():
+        failed = simulate("openai", "chat_completions")
+        if failed:
+            return failed
+        payload = request.get_json(silent=True) or {}
+        prompt = next((m.get("content", "") for m in reversed(payload.get("messages", []))
+                       if m.get("role") == "user"), "")
+        answer = f"(fake) {prompt[:200]}"
+        return jsonify({
+            "id": "chatcmpl-" + uuid.uuid4().hex,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "gpt-3.5-turbo"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": answer}}],
+            "usage": {"prompt_tokens": len(prompt), "completion_tokens": len(answer),
+                      "total_tokens": len(prompt) + len(answer)},
+        })
+
+    @app.route("/__fake__/requests", methods=["GET"])
+    def recorded_requests():
+        with state.lock:
+            entries = list(state.recorded)
+            counters = dict(state.counters)
+        endpoint = request.args.get("endpoint")
+        if endpoint:
+            entries = [e for e in entries if e["endpoint"] == endpoint]
+        return jsonify({"counts": counters, "requests": entries})
+
+    @app.route("/__fake__/requests", methods=["DELETE"])
+    def clear_requests():
+        with state.lock:
+            state.recorded.clear()
+            state.counters.clear()
+        return jsonify({"status": "cleared"})
+
+    @app.route("/__fake__/config", methods=["GET", "POST"])
+    def config():
+        if request.method == "POST":
+            try:
+                state.update(request.get_json(force=True) or {})
+            except (ValueError, TypeError) as e:
+                return jsonify({"status": "error", "message": str(e)}), 400
+        return jsonify(state.config())
+
+    return app
+
+
+def serve_in_background(state=None, host="127.0.0.1", port=0):
+    from werkzeug.serving import make_server
+
+    server = make_server(host, port, create_app(state), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake LINE Messaging API / OpenAI server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--line-latency", help="e.g. lognormal:3,0.5")
+    parser.add_argument("--openai-latency", help="e.g. normal:800,200")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--content-size", type=int, default=256 * 1024,
+                        help="bytes returned by the content endpoint")
+    parser.add_argument("--followers", type=int, default=1000,
+                        help="follower count served by the followers/ids endpoint")
+    parser.add_argument("--record-limit", type=int, default=10000)
+    parser.add_argument("--record-file", help="also append every request here as NDJSON")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    state = FakeState(
+        line_latency=args.line_latency,
+        openai_latency=args.openai_latency,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        record_limit=args.record_limit,
+        record_file=args.record_file,
+        content_size=args.content_size,
+        followers=args.followers,
+        seed=args.seed,
+    )
+    print(f"🧪 Fake LINE/OpenAI APIs on http://{args.host}:{args.port}")
+    create_app(state).run(host=args.host, port=args.port, threaded=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
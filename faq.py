@@ -0,0 +1,145 @@
+import heapq
+import math
+import threading
+import time
+from array import array
+
+
+def char_ngrams(text, n=3):
+    # Thai is written without spaces, so words are approximated by character n-grams
+    text = " " + " ".join(text.casefold().split()) + " "
+    counts = {}
+    for i in range(max(len(text) - n + 1, 1)):
+        gram = text[i:i + n]
+        counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+
+class FaqIndex:
+    """Character n-gram TF-IDF index with cosine-similarity search.
+
+    Postings are parallel arrays per n-gram: document slots and sublinear
+    term frequencies. IDF is applied at query time, so adding or removing
+    an entry only touches the postings of its own n-grams; document norms
+    are recomputed after each batch of changes.
+    """
+
+    def __init__(self, n=3):
+        self.n = n
+        self.postings = {}  # gram -> (array of slots, array of tf weights)
+        self.doc_grams = {}  # slot -> grams of that entry
+        self.slots = {}  # entry id -> slot
+        self.entries = {}  # slot -> (entry id, question, answer)
+        self.norms = {}
+        self.next_slot = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def idf(self, gram):
+        postings = self.postings.get(gram)
+        df = len(postings[0]) if postings else 0
+        return math.log((1 + len(self.entries)) / (1 + df)) + 1
+
+    def _remove(self, entry_id):
+        slot = self.slots.pop(entry_id, None)
+        if slot is None:
+            return
+        for gram in self.doc_grams.pop(slot):
+            slots, weights = self.postings[gram]
+            position = slots.index(slot)
+            del slots[position]
+            del weights[position]
+            if not slots:
+                del self.postings[gram]
+        del self.entries[slot]
+        self.norms.pop(slot, None)
+
+    def _add(self, entry_id, question, answer):
+        slot = self.next_slot
+        self.next_slot += 1
+        grams = char_ngrams(question, self.n)
+        for gram, count in grams.items():
+            slots, weights = self.postings.setdefault(gram, (array("I"), array("f")))
+            slots.append(slot)
+            weights.append(1 + math.log(count))
+        self.doc_grams[slot] = tuple(grams)
+        self.slots[entry_id] = slot
+        self.entries[slot] = (entry_id, question, answer)
+
+    def _refresh_norms(self):
+        squares = dict.fromkeys(self.entries, 0.0)
+        for gram, (slots, weights) in self.postings.items():
+            idf = self.idf(gram)
+            for slot, weight in zip(slots, weights):
+                squares[slot] += (weight * idf) ** 2
+        self.norms = {slot: math.sqrt(total) for slot, total in squares.items()}
+
+    def apply(self, upserts=(), deletes=()):
+        # upserts: (entry id, question, answer) tuples; deletes: entry ids
+        for entry_id in deletes:
+            self._remove(entry_id)
+        for entry_id, question, answer in upserts:
+            self._remove(entry_id)
+            self._add(entry_id, question, answer)
+        self._refresh_norms()
+
+    def search(self, text, k=3):
+        query = {}
+        for gram, count in char_ngrams(text, self.n).items():
+            if gram in self.postings:
+                query[gram] = (1 + math.log(count)) * self.idf(gram)
+        if not query:
+            return []
+        query_norm = math.sqrt(sum(w * w for w in query.values()))
+        scores = {}
+        for gram, query_weight in query.items():
+            slots, weights = self.postings[gram]
+            factor = query_weight * self.idf(gram)
+            for slot, weight in zip(slots, weights):
+                scores[slot] = scores.get(slot, 0.0) + factor * weight
+        norms = self.norms
+        for slot, dot in scores.items():
+            scores[slot] = dot / (query_norm * norms[slot]) if norms[slot] else 0.0
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        results = []
+        for slot, score in top:
+            entry_id, question, answer = self.entries[slot]
+            results.append({"id": entry_id, "question": question, "answer": answer, "score": score})
+        return results
+
+
+class FaqRetriever:
+    """Keeps a FaqIndex in sync with the FAQ table.
+
+    list_versions() returns {entry id: version} for every enabled entry and
+    load_entries(ids) the (id, question, answer) rows for those ids. Both
+    are polled at most every reload_interval seconds; only entries whose
+    version changed are re-indexed.
+    """
+
+    def __init__(self, list_versions, load_entries, reload_interval=30, n=3):
+        self.list_versions = list_versions
+        self.load_entries = load_entries
+        self.reload_interval = reload_interval
+        self.lock = threading.Lock()
+        self.index = FaqIndex(n)
+        self.versions = {}
+        self.checked_at = None
+
+    def sync(self):
+        current = self.list_versions()
+        changed = [entry_id for entry_id, version in current.items() if self.versions.get(entry_id) != version]
+        deleted = [entry_id for entry_id in self.versions if entry_id not in current]
+        if changed or deleted:
+            upserts = self.load_entries(changed) if changed else []
+            with self.lock:
+                self.index.apply(upserts, deleted)
+            self.versions = current
+        self.checked_at = time.monotonic()
+
+    def search(self, text, k=3):
+        if self.checked_at is None or time.monotonic() - self.checked_at >= self.reload_interval:
+            self.sync()
+        with self.lock:
+            return self.index.search(text, k)
@@ -0,0 +1,5 @@
+def post_fork(server, worker):
+    # Each worker runs the job scheduler; leader election keeps every job to one runner
+    import webhook
+
+    webhook.job_scheduler.start()
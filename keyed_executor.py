@@ -0,0 +1,121 @@
+import os
+import zlib
+import queue
+import threading
+from concurrent.futures import Future, wait
+
+
+class KeyedExecutor:
+    """Runs tasks on N worker lanes, serialising tasks that share a key.
+
+    Each key hashes to a home lane, so one user's events run in submission
+    order while different users run in parallel. When a key has nothing in
+    flight and its home lane is much deeper than average, it is moved to the
+    shallowest lane instead; a key is never moved while it has pending
+    tasks, which keeps the per-key ordering intact.
+    """
+
+    def __init__(self, lanes=4, hot_factor=2.0, hot_min_depth=8, name="lane"):
+        self.lanes = max(1, lanes)
+        self.hot_factor = hot_factor
+        self.hot_min_depth = hot_min_depth
+        self.name = name
+        self.lock = threading.Lock()
+        self.queues = [queue.Queue() for _ in range(self.lanes)]
+        self.depths = [0] * self.lanes
+        self.max_depths = [0] * self.lanes
+        self.processed = [0] * self.lanes
+        self.inflight = {}  # key -> [lane, pending task count]
+        self.rebalanced = 0
+        self.threads = []
+        self.pid = None
+
+    def home_lane(self, key):
+        return zlib.crc32(key.encode("utf-8")) % self.lanes
+
+    def _is_hot(self, lane):
+        depth = self.depths[lane]
+        mean = sum(self.depths) / self.lanes
+        return depth >= self.hot_min_depth and depth > self.hot_factor * mean
+
+    def _ensure_started(self):
+        # Started lazily so forked gunicorn workers each get their own threads
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.queues = [queue.Queue() for _ in range(self.lanes)]
+        self.threads = []
+        for lane in range(self.lanes):
+            thread = threading.Thread(target=self._worker, args=(lane,),
+                                      name=f"{self.name}-{lane}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, key, fn, *args, **kwargs):
+        future = Future()
+        with self.lock:
+            self._ensure_started()
+            entry = self.inflight.get(key)
+            if entry:
+                lane = entry[0]
+                entry[1] += 1
+            else:
+                lane = self.home_lane(key)
+                if self._is_hot(lane):
+                    coolest = min(range(self.lanes), key=self.depths.__getitem__)
+                    if coolest != lane:
+                        lane = coolest
+                        self.rebalanced += 1
+                self.inflight[key] = [lane, 1]
+            self.depths[lane] += 1
+            self.max_depths[lane] = max(self.max_depths[lane], self.depths[lane])
+            self.queues[lane].put((key, future, fn, args, kwargs))
+        return future
+
+    def map_ordered(self, items, key_fn, fn):
+        # Submit every item, wait for all of them, then surface the first error
+        futures = [self.submit(key_fn(item), fn, item) for item in items]
+        wait(futures)
+        return [future.result() for future in futures]
+
+    def _worker(self, lane):
+        tasks = self.queues[lane]
+        while True:
+            item = tasks.get()
+            if item is None:
+                break
+            key, future, fn, args, kwargs = item
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self.lock:
+                    self.depths[lane] -= 1
+                    self.processed[lane] += 1
+                    entry = self.inflight[key]
+                    entry[1] -= 1
+                    if entry[1] == 0:
+                        del self.inflight[key]
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "lanes": self.lanes,
+                "depth": list(self.depths),
+                "max_depth": list(self.max_depths),
+                "processed": list(self.processed),
+                "keys_in_flight": len(self.inflight),
+                "rebalanced": self.rebalanced,
+            }
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            for tasks in self.queues:
+                tasks.put(None)
+            threads, self.threads, self.pid = self.threads, [], None
+        if wait:
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,75 @@
+import heapq
+import threading
+import time
+
+
+class Leaderboard:
+    """Top-N keys by count over a window, kept in a size-N min-heap.
+
+    load_counts() returns {key: count} for the current window; it is called
+    on start, every refresh_interval seconds and whenever window_key()
+    changes (e.g. the day rolls over). Between refreshes increments are
+    applied in memory. Counts only grow until the next refresh, so a key
+    outside the heap can only enter by beating the smallest entry.
+    """
+
+    def __init__(self, size, load_counts, refresh_interval=60, window_key=None):
+        self.size = size
+        self.load_counts = load_counts
+        self.refresh_interval = refresh_interval
+        self.window_key = window_key or (lambda: None)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.heap = []  # [count, key] entries, smallest first
+        self.members = {}  # key -> its heap entry
+        self.loaded_at = None
+        self.loaded_window = None
+
+    def _rebuild(self, counts):
+        self.counts = counts
+        top = heapq.nlargest(self.size, counts.items(), key=lambda kv: kv[1])
+        self.heap = [[count, key] for key, count in top]
+        heapq.heapify(self.heap)
+        self.members = {entry[1]: entry for entry in self.heap}
+
+    def refresh(self):
+        counts = self.load_counts()
+        with self.lock:
+            self._rebuild(counts)
+            self.loaded_at = time.monotonic()
+            self.loaded_window = self.window_key()
+
+    def maybe_refresh(self):
+        stale = (
+            self.loaded_at is None
+            or time.monotonic() - self.loaded_at >= self.refresh_interval
+            or self.window_key() != self.loaded_window
+        )
+        if stale:
+            self.refresh()
+
+    def record(self, key, amount=1):
+        with self.lock:
+            if self.loaded_at is None:
+                return  # nothing loaded yet; the first refresh will include this
+            count = self.counts.get(key, 0) + amount
+            self.counts[key] = count
+            entry = self.members.get(key)
+            if entry is not None:
+                entry[0] = count
+                heapq.heapify(self.heap)
+            elif len(self.heap) < self.size:
+                entry = [count, key]
+                heapq.heappush(self.heap, entry)
+                self.members[key] = entry
+            elif count > self.heap[0][0]:
+                entry = [count, key]
+                evicted = heapq.heapreplace(self.heap, entry)
+                del self.members[evicted[1]]
+                self.members[key] = entry
+
+    def top(self, n=None):
+        self.maybe_refresh()
+        with self.lock:
+            ranked = sorted(self.heap, key=lambda entry: (-entry[0], entry[1]))
+        return [(key, count) for count, key in ranked[:n or self.size]]
@@ -0,0 +1,360 @@
+"""Load generator for /webhook and /sassy-line-myshop-webhook.
+
+Builds realistic LINE and MyShop payloads, signs them the same way
+is_valid_signature / is_valid_myshop_signature verify them, fires them at a
+target rate and prints a JSON report (latency percentiles, error rates and
+DB rows/sec) so runs can be compared.
+
+    python loadtest.py --base-url http://localhost:8000 --rps 200 --duration 30 \
+        --concurrency 32 --output run.json
+"""
+import os
+import sys
+import json
+import hmac
+import time
+import uuid
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from sqlalchemy import create_engine, inspect, text
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LINE_CHANNEL_SECRET = os.environ.get("LINE_CHANNEL_SECRET")
+LINESHOP_KEY = os.environ.get("LINESHOP_KEY")
+ADMIN_ID = os.environ.get("ADMIN_ID")
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+TRACKED_TABLES = [
+    "messages",
+    "admin_messages",
+    "user_profiles",
+    "chatgpt_logs",
+    "line_myshop_orders",
+    "line_myshop_order_items",
+]
+
+THAI_TEXTS = [
+    "สวัสดีค่ะ",
+    "ราคาเท่าไหร่คะ",
+    "ขอเลขพัสดุหน่อยค่ะ",
+    "มีโปรโมชั่นไหมคะ",
+    "สั่งซื้อแล้วนะคะ เลขที่ออเดอร์ {order}",
+    "ของถึงแล้ว ขอบคุณมากค่ะ",
+    "ส่งต่างจังหวัดกี่วันคะ",
+    "มีไซส์ M ไหมคะ",
+    "โอนเงินแล้วค่ะ",
+    "Hello, is this still available?",
+]
+
+PRODUCTS = [
+    ("เซรั่มหน้าใส", "SKU-SERUM-30", 590.0, 0.12),
+    ("ครีมกันแดด SPF50", "SKU-SUN-50", 390.0, 0.08),
+    ("โฟมล้างหน้า", "SKU-FOAM-100", 250.0, 0.15),
+    ("ลิปทินท์", "SKU-LIP-01", 199.0, 0.02),
+    ("มาสก์หน้า (10 ชิ้น)", "SKU-MASK-10", 450.0, 0.2),
+]
+
+ORDER_STATUSES = ["CREATED", "PAID", "SHIPPED", "COMPLETED", "CANCELLED"]
+
+
+def sign_line_body(body, secret):
+    digest = hmac.new(secret.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+def sign_myshop_body(body, key):
+    return hmac.new(key.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def random_user_id(rng):
+    return "U" + "".join(rng.choice("0123456789abcdef") for _ in range(32))
+
+
+class PayloadFactory:
+    def __init__(self, seed=None, user_pool=500, new_user_ratio=0.05, admin_ratio=0.02,
+                 non_text_ratio=0.1, max_events=5, admin_id=None):
+        self.rng = random.Random(seed)
+        self.users = [random_user_id(self.rng) for _ in range(user_pool)]
+        self.new_user_ratio = new_user_ratio
+        self.admin_ratio = admin_ratio
+        self.non_text_ratio = non_text_ratio
+        self.max_events = max_events
+        self.admin_id = admin_id
+        self.lock = threading.Lock()
+
+    def _user_id(self):
+        if self.admin_id and self.rng.random() < self.admin_ratio:
+            return self.admin_id
+        if self.rng.random() < self.new_user_ratio:
+            return random_user_id(self.rng)
+        # Skewed towards a few chatty customers, like real traffic
+        return self.users[min(int(self.rng.paretovariate(1.2)) - 1, len(self.users) - 1)]
+
+    def _message(self):
+        rng = self.rng
+        if rng.random() < self.non_text_ratio:
+            kind = rng.choice(["sticker", "image", "location"])
+            if kind == "sticker":
+                return {"type": "sticker", "id": str(rng.getrandbits(60)),
+                        "packageId": "446", "stickerId": str(rng.randint(1988, 2027)),
+                        "stickerResourceType": "STATIC"}
+            if kind == "image":
+                return {"type": "image", "id": str(rng.getrandbits(60)),
+                        "contentProvider": {"type": "line"}}
+            return {"type": "location", "id": str(rng.getrandbits(60)),
+                    "title": "ที่อยู่จัดส่ง", "address": "กรุงเทพมหานคร",
+                    "latitude": 13.7563, "longitude": 100.5018}
+        body = rng.choice(THAI_TEXTS).format(order=rng.randint(10000000, 99999999))
+        return {"type": "text", "id": str(rng.getrandbits(60)),
+                "quoteToken": uuid.uuid4().hex, "text": body}
+
+    def line_payload(self):
+        with self.lock:
+            now_ms = int(time.time() * 1000)
+            events = []
+            for _ in range(self.rng.randint(1, self.max_events)):
+                events.append({
+                    "type": "message",
+                    "message": self._message(),
+                    "webhookEventId": uuid.uuid4().hex.upper(),
+                    "deliveryContext": {"isRedelivery": False},
+                    "timestamp": now_ms,
+                    "source": {"type": "user", "userId": self._user_id()},
+                    "replyToken": uuid.uuid4().hex,
+                    "mode": "active",
+                })
+            return {"destination": "U" + "0" * 32, "events": events}
+
+    def myshop_payload(self):
+        with self.lock:
+            rng = self.rng
+            items = []
+            subtotal = 0.0
+            for name, sku, price, weight in rng.sample(PRODUCTS, rng.randint(1, 3)):
+                quantity = rng.randint(1, 3)
+                subtotal += price * quantity
+                items.append({
+                    "name": name,
+                    "sku": sku,
+                    "quantity": quantity,
+                    "price": price,
+                    "discountedPrice": price,
+                    "barcode": str(rng.randint(10 ** 12, 10 ** 13 - 1)),
+                    "weight": weight,
+                    "imageURL": f"https://example.com/images/{sku}.jpg",
+                })
+            shipment_price = rng.choice([0.0, 40.0, 50.0])
+            return {
+                "orderNumber": str(rng.randint(10 ** 13, 10 ** 14 - 1)),
+                "orderStatus": rng.choice(ORDER_STATUSES),
+                "event": {"name": "ORDER_STATUS_CHANGED",
+                          "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())},
+                "paymentMethod": rng.choice(["BANK_TRANSFER", "CREDIT_CARD", "COD"]),
+                "paymentStatus": rng.choice(["PAID", "PENDING"]),
+                "shippingAddress": {"recipientName": "คุณทดสอบ",
+                                    "phoneNumber": "08" + str(rng.randint(10 ** 7, 10 ** 8 - 1)),
+                                    "address": "123 ถนนสุขุมวิท กรุงเทพฯ 10110"},
+                "shipmentDetail": {"shipmentCompanyNameTh": "ไปรษณีย์ไทย",
+                                   "trackingNumber": "TH" + str(rng.randint(10 ** 9, 10 ** 10 - 1)),
+                                   "isCod": rng.random() < 0.2},
+                "subtotalPrice": subtotal,
+                "totalPrice": subtotal + shipment_price,
+                "shipmentPrice": shipment_price,
+                "isGift": rng.random() < 0.05,
+                "orderItems": items,
+            }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarise(samples):
+    latencies = sorted(s["latency_ms"] for s in samples)
+    service = sorted(s["service_ms"] for s in samples)
+    errors = sum(1 for s in samples if s["error"])
+    status_codes = {}
+    for s in samples:
+        key = str(s["status"]) if s["status"] is not None else "exception"
+        status_codes[key] = status_codes.get(key, 0) + 1
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": errors / len(samples) if samples else 0.0,
+        "status_codes": status_codes,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "max": latencies[-1] if latencies else None,
+        },
+        "service_ms": {
+            "p50": percentile(service, 50),
+            "p95": percentile(service, 95),
+            "p99": percentile(service, 99),
+        },
+    }
+
+
+def count_rows(engine):
+    existing = set(inspect(engine).get_table_names())
+    counts = {}
+    with engine.connect() as conn:
+        for table in TRACKED_TABLES:
+            if table in existing:
+                counts[table] = conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+    return counts
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.factory = PayloadFactory(
+            seed=args.seed,
+            user_pool=args.users,
+            new_user_ratio=args.new_user_ratio,
+            admin_ratio=args.admin_ratio,
+            non_text_ratio=args.non_text_ratio,
+            max_events=args.max_events,
+            admin_id=ADMIN_ID,
+        )
+        self.local = threading.local()
+        self.samples = {"webhook": [], "myshop": []}
+        self.samples_lock = threading.Lock()
+        self.pick = random.Random(args.seed)
+
+    def _http(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def _build_request(self):
+        if self.pick.random() < self.args.myshop_ratio:
+            body = json.dumps(self.factory.myshop_payload(), ensure_ascii=False)
+            headers = {"Content-Type": "application/json",
+                       "x-myshop-signature": sign_myshop_body(body, LINESHOP_KEY)}
+            return "myshop", "/sassy-line-myshop-webhook", body, headers
+        body = json.dumps(self.factory.line_payload(), ensure_ascii=False)
+        headers = {"Content-Type": "application/json",
+                   "X-Line-Signature": sign_line_body(body, LINE_CHANNEL_SECRET)}
+        return "webhook", "/webhook", body, headers
+
+    def _send(self, scheduled_at, kind, path, body, headers):
+        started = time.perf_counter()
+        status = None
+        error = False
+        try:
+            response = self._http().post(self.args.base_url.rstrip("/") + path,
+                                         data=body.encode("utf-8"), headers=headers,
+                                         timeout=self.args.timeout)
+            status = response.status_code
+            error = status >= 400
+        except requests.RequestException:
+            error = True
+        finished = time.perf_counter()
+        sample = {
+            "status": status,
+            "error": error,
+            # Measured from the scheduled send time so a saturated server is not hidden
+            "latency_ms": (finished - scheduled_at) * 1000,
+            "service_ms": (finished - started) * 1000,
+        }
+        with self.samples_lock:
+            self.samples[kind].append(sample)
+
+    def run(self):
+        args = self.args
+        engine = create_engine(args.database_url) if args.database_url else None
+        rows_before = count_rows(engine) if engine else None
+
+        interval = 1.0 / args.rps
+        total = args.requests or int(args.rps * args.duration)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for i in range(total):
+                scheduled_at = started + i * interval
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                kind, path, body, headers = self._build_request()
+                pool.submit(self._send, scheduled_at, kind, path, body, headers)
+        elapsed = time.perf_counter() - started
+
+        report = {
+            "config": {
+                "base_url": args.base_url,
+                "target_rps": args.rps,
+                "requests": total,
+                "concurrency": args.concurrency,
+                "myshop_ratio": args.myshop_ratio,
+                "seed": args.seed,
+            },
+            "elapsed_s": elapsed,
+            "achieved_rps": total / elapsed if elapsed else None,
+            "endpoints": {kind: summarise(samples) for kind, samples in self.samples.items() if samples},
+        }
+        all_samples = self.samples["webhook"] + self.samples["myshop"]
+        report["overall"] = summarise(all_samples)
+
+        if engine:
+            rows_after = count_rows(engine)
+            delta = {t: rows_after.get(t, 0) - rows_before.get(t, 0) for t in rows_after}
+            report["db"] = {
+                "rows_inserted": delta,
+                "rows_per_sec": sum(delta.values()) / elapsed if elapsed else None,
+            }
+            engine.dispose()
+        return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the LINE / MyShop webhooks")
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--rps", type=float, default=50.0, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--requests", type=int, default=0, help="total requests (overrides --duration)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--myshop-ratio", type=float, default=0.1,
+                        help="share of requests sent to the MyShop webhook")
+    parser.add_argument("--users", type=int, default=500, help="size of the repeat user pool")
+    parser.add_argument("--new-user-ratio", type=float, default=0.05)
+    parser.add_argument("--admin-ratio", type=float, default=0.02)
+    parser.add_argument("--non-text-ratio", type=float, default=0.1)
+    parser.add_argument("--max-events", type=int, default=5, help="max events per LINE payload")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--database-url", default=DATABASE_URL,
+                        help="count inserted rows here to report rows/sec")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not LINE_CHANNEL_SECRET or (args.myshop_ratio > 0 and not LINESHOP_KEY):
+        print("❌ LINE_CHANNEL_SECRET and LINESHOP_KEY must be set to sign payloads", file=sys.stderr)
+        return 2
+    report = LoadTest(args).run()
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+import os
+import hashlib
+import tempfile
+
+
+class ContentStore:
+    """Content-addressed file store: each blob lives at <dir>/ab/cd/<sha256>.
+
+    save() streams chunks to a temporary file while hashing them, so memory
+    stays at one chunk regardless of size, then renames it into place. If
+    the blob already exists the temporary file is dropped instead, so
+    identical content is stored once.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tmp_dir = os.path.join(directory, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path_for(self, digest):
+        return os.path.join(self.directory, digest[:2], digest[2:4], digest)
+
+    def save(self, chunks, max_bytes=None):
+        # Returns (sha256 hex digest, size in bytes, True if the blob was new)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if max_bytes and size > max_bytes:
+                        raise ValueError(f"Content exceeds {max_bytes} bytes")
+                    digest.update(chunk)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            sha = digest.hexdigest()
+            target = self.path_for(sha)
+            if os.path.exists(target):
+                os.unlink(tmp_path)
+                return sha, size, False
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp_path, target)
+            return sha, size, True
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
@@ -0,0 +1,256 @@
+"""Monthly range partitions on PostgreSQL and month-by-month retention.
+
+Partitioned tables keep their ORM mapping (id is still the mapper's
+primary key); only the DDL differs: PRIMARY KEY (id, date), since
+PostgreSQL requires the partition key in every unique constraint, and
+PARTITION BY RANGE (date). Partitions are named <table>_pYYYY_MM, and a
+<table>_default partition catches rows outside them.
+
+Retention works the same on every backend: each month older than the
+cutoff is exported to <export_dir>/<table>/<table>-YYYY-MM.ndjson.gz and
+then removed, by dropping its partition where there is one or with a
+range DELETE otherwise. A month's partition is detached before it is
+exported, so no write can reach it in between. The export and the
+removal share one snapshot, so only rows that were exported are removed.
+Rows that arrive for a month after it was retired go to a new file
+(<table>-YYYY-MM.1.ndjson.gz, ...) on a later run; an export is never
+overwritten.
+"""
+import os
+import gzip
+import json
+from contextlib import contextmanager
+from datetime import datetime, date
+
+from sqlalchemy import MetaData, Table, Column, PrimaryKeyConstraint, select, func, text as sql_text
+from sqlalchemy.schema import CreateTable
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table_name, month):
+    return f"{table_name}_p{month.year:04d}_{month.month:02d}"
+
+
+def partitioned_table(table, sequence=None):
+    # Copy of table for CREATE TABLE ... PARTITION BY; sequence reuses an existing id sequence
+    metadata = MetaData()
+    columns = []
+    for column in table.columns:
+        if column.name == "id" and sequence:
+            # Built fresh: a server_default assigned after _copy() is a bare clause and never reaches the DDL
+            copy = Column(column.name, column.type, nullable=False, autoincrement=False,
+                          server_default=sql_text(f"nextval('{sequence}')"))
+        else:
+            copy = column._copy()
+            copy.primary_key = False
+            if column.name == "id":
+                copy.autoincrement = True
+        columns.append(copy)
+    return Table(
+        table.name, metadata, *columns,
+        PrimaryKeyConstraint("id", "date", name=f"{table.name}_pkey"),
+        postgresql_partition_by="RANGE (date)",
+    )
+
+
+def is_partitioned(conn, table_name):
+    return bool(conn.execute(sql_text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :name"
+    ), {"name": table_name}).scalar())
+
+
+def list_partitions(conn, table_name):
+    # {partition name: bound expression}
+    rows = conn.execute(sql_text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :name
+        ORDER BY c.relname
+    """), {"name": table_name})
+    return dict(rows.all())
+
+
+def names_to_months(table_name, names):
+    months = []
+    prefix = f"{table_name}_p"
+    for name in names:
+        if name.startswith(prefix):
+            year, month = name[len(prefix):].split("_")
+            months.append(date(int(year), int(month), 1))
+    return sorted(months)
+
+
+def partition_months(conn, table_name):
+    return names_to_months(table_name, list_partitions(conn, table_name))
+
+
+def detached_partitions(conn, table_name):
+    # Month partitions a retention run detached but did not get to drop
+    rows = conn.execute(sql_text(
+        "SELECT relname FROM pg_class WHERE relkind = 'r' AND NOT relispartition AND relname LIKE :pattern"
+    ), {"pattern": f"{table_name}\\_p%"})
+    return [name for name in rows.scalars() if names_to_months(table_name, [name])]
+
+
+def create_month_partitions(conn, table_name, first_month, last_month):
+    created = []
+    existing = set(list_partitions(conn, table_name))
+    month = first_month
+    while month <= last_month:
+        name = partition_name(table_name, month)
+        if name not in existing:
+            conn.execute(sql_text(
+                f"CREATE TABLE {name} PARTITION OF {table_name} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            ))
+            created.append(name)
+        month = add_months(month, 1)
+    if f"{table_name}_default" not in existing:
+        conn.execute(sql_text(f"CREATE TABLE {table_name}_default PARTITION OF {table_name} DEFAULT"))
+        created.append(f"{table_name}_default")
+    return created
+
+
+def create_partitioned(conn, table, months_ahead, first_month=None):
+    conn.execute(CreateTable(partitioned_table(table)))
+    today = month_start(datetime.utcnow())
+    return create_month_partitions(conn, table.name, first_month or today, add_months(today, months_ahead))
+
+
+def migrate_to_partitioned(conn, table, months_ahead, extra_indexes=()):
+    """Rebuild an existing plain table as a partitioned one, keeping ids.
+
+    Runs in the caller's transaction and holds an exclusive lock on the
+    table for the copy, so run it in a maintenance window.
+    """
+    name = table.name
+    legacy = f"{name}_unpartitioned"
+    conn.execute(sql_text(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE"))
+    sequence = conn.execute(sql_text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": name}).scalar()
+    first = conn.execute(sql_text(f"SELECT min(date) FROM {name}")).scalar()
+    conn.execute(sql_text(f"ALTER TABLE {name} RENAME TO {legacy}"))
+    conn.execute(sql_text(f"ALTER TABLE {legacy} RENAME CONSTRAINT {name}_pkey TO {legacy}_pkey"))
+    # Secondary indexes are recreated on the partitioned parent afterwards
+    for index_name in [index.name for index in table.indexes] + list(extra_indexes):
+        conn.execute(sql_text(f"DROP INDEX IF EXISTS {index_name}"))
+    conn.execute(CreateTable(partitioned_table(table, sequence)))
+    today = month_start(datetime.utcnow())
+    create_month_partitions(conn, name, month_start(first) if first else today, add_months(today, months_ahead))
+    columns = ", ".join(column.name for column in table.columns)
+    copied = conn.execute(sql_text(f"INSERT INTO {name} ({columns}) SELECT {columns} FROM {legacy}")).rowcount
+    if sequence:
+        conn.execute(sql_text(f"ALTER SEQUENCE {sequence} OWNED BY {name}.id"))
+    conn.execute(sql_text(f"DROP TABLE {legacy}"))
+    return copied
+
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, (datetime, date)) else value
+
+
+def export_path(export_dir, table, month):
+    # The first free name: a month retired again later (late rows) gets its own file
+    directory = os.path.join(export_dir, table.name)
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f"{table.name}-{month.year:04d}-{month.month:02d}")
+    path, n = base + ".ndjson.gz", 0
+    while os.path.exists(path):
+        n += 1
+        path = f"{base}.{n}.ndjson.gz"
+    return path
+
+
+def export_month(conn, table, month, export_dir, sources=None):
+    # Streams the month's rows of table (or of each of sources, tables with its columns) to one gzip NDJSON file;
+    # returns (path, rows), no file for an empty month
+    path = export_path(export_dir, table, month)
+    tmp = path + ".tmp"
+    rows = 0
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        for source in sources or [table]:
+            query = (
+                select(source)
+                .where(source.c.date >= month, source.c.date < add_months(month, 1))
+                .order_by(source.c.date, source.c.id)
+                .execution_options(yield_per=5000)
+            )
+            for row in conn.execute(query).mappings():
+                f.write(json.dumps({key: export_value(value) for key, value in row.items()}, ensure_ascii=False) + "\n")
+                rows += 1
+    if not rows:
+        os.unlink(tmp)
+        return None, 0
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return path, rows
+
+
+def expired_months(conn, table, cutoff, partitioned):
+    # Months before cutoff that still hold rows or partitions, oldest first; one index seek per month with data.
+    # A partition an earlier run detached is finished off whatever the cutoff is now
+    months = set()
+    if partitioned:
+        months = {month for month in partition_months(conn, table.name) if month < cutoff}
+        months.update(names_to_months(table.name, detached_partitions(conn, table.name)))
+    after = None
+    while True:
+        query = select(func.min(table.c.date))
+        if after:
+            query = query.where(table.c.date >= after)
+        first = conn.execute(query).scalar()
+        if first is None or month_start(first) >= cutoff:
+            break
+        months.add(month_start(first))
+        after = add_months(month_start(first), 1)
+    return sorted(months)
+
+
+@contextmanager
+def snapshot_transaction(engine):
+    # What the export reads is exactly what the DELETE in the same transaction sees: REPEATABLE READ on
+    # PostgreSQL (rows committed later stay for the next run), the write lock on SQLite
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        elif engine.dialect.name == "postgresql":
+            conn = conn.execution_options(isolation_level="REPEATABLE READ")
+        yield conn
+        conn.commit()
+
+
+def retire_month(engine, table, month, export_dir):
+    """Export one month of rows, then drop its partition (or delete the rows).
+
+    The partition is detached first, so writes for the month go to the
+    default partition from then on. The detached table and any rows of the
+    month still in the table are exported in one transaction, and the export
+    is fsynced before that transaction drops and deletes them. If anything
+    fails after the detach, the next run finds the detached table and retries.
+    """
+    name = partition_name(table.name, month)
+    detached = False
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            if name in list_partitions(conn, table.name):
+                conn.execute(sql_text(f"ALTER TABLE {table.name} DETACH PARTITION {name}"))
+            detached = name in detached_partitions(conn, table.name)
+    with snapshot_transaction(engine) as conn:
+        sources = [Table(name, MetaData(), *(column._copy() for column in table.columns))] if detached else []
+        path, rows = export_month(conn, table, month, export_dir, sources + [table])
+        if detached:
+            conn.execute(sql_text(f"DROP TABLE {name}"))
+        # Stray rows that landed in the default partition, or the whole month without partitions
+        conn.execute(table.delete().where(table.c.date >= month, table.c.date < add_months(month, 1)))
+    removed = "partition" if detached else "delete"
+    return {"table": table.name, "month": month.isoformat()[:7], "rows": rows, "export": path, "removed": removed}
@@ -0,0 +1,190 @@
+import re
+import os
+import json
+import time
+import zlib
+import threading
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import event
+
+# Histogram bucket upper bounds in ms; a final bucket counts everything slower
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\?|(?<!:):\w+|\$\d+")
+VALUE_LIST = re.compile(r"\(\?(?:, \?)*\)")
+REPEATED_LISTS = re.compile(r"\(\.\.\.\)(?:, \(\.\.\.\))+")
+WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|CREATE|DROP|ALTER)\b", re.IGNORECASE)
+
+
+def normalize(statement):
+    # Literals and placeholders become ?, IN lists and multi-row VALUES collapse, so one query shape = one key
+    text = STRING_LITERAL.sub("?", statement)
+    text = PLACEHOLDER.sub("?", text)
+    text = NUMBER_LITERAL.sub("?", text)
+    text = " ".join(text.split()).replace("( ", "(").replace(" )", ")").replace(" ,", ",")
+    text = VALUE_LIST.sub("(...)", text)
+    return REPEATED_LISTS.sub("(...)", text)
+
+
+class QueryStats:
+    """Per-statement latency histograms fed by SQLAlchemy cursor events.
+
+    Statements are keyed by a fingerprint of their normalized text. Each
+    one gets a count, total, max and a fixed-bucket latency histogram;
+    runs slower than slow_ms are also logged and their last statement and
+    parameters kept in memory so explain() can re-run them. Nothing is
+    hooked until attach() is called, so a disabled instance costs nothing.
+    """
+
+    def __init__(self, slow_ms=200, max_statements=500, slow_log_size=100):
+        self.slow_ms = slow_ms
+        self.max_statements = max_statements
+        self.lock = threading.Lock()
+        self.local = threading.local()  # start time of the statement running on this thread
+        self.stats = {}  # fingerprint -> counters and histogram
+        self.samples = {}  # fingerprint -> (statement, parameters, executemany) of the last slow run
+        self.slow_log = deque(maxlen=slow_log_size)
+        self.fingerprints = {}  # raw statement -> (fingerprint, normalized)
+        self.attached = False
+
+    def attach(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+        self.attached = True
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        self.local.started = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - self.local.started) * 1000
+        if not getattr(self.local, "paused", False):
+            self.record(statement, parameters, elapsed_ms, executemany)
+
+    def fingerprint(self, statement):
+        cached = self.fingerprints.get(statement)
+        if cached is None:
+            normalized = normalize(statement)
+            cached = (format(zlib.crc32(normalized.encode()), "08x"), normalized)
+            if len(self.fingerprints) >= self.max_statements * 4:
+                # Statements with inlined literals are unbounded; start over rather than grow
+                self.fingerprints.clear()
+            self.fingerprints[statement] = cached
+        return cached
+
+    def record(self, statement, parameters, elapsed_ms, executemany=False):
+        fingerprint, normalized = self.fingerprint(statement)
+        slow = elapsed_ms >= self.slow_ms
+        with self.lock:
+            stats = self.stats.get(fingerprint)
+            if stats is None:
+                if len(self.stats) >= self.max_statements:
+                    fingerprint, normalized = "other", "(statements beyond max_statements)"
+                    stats = self.stats.get(fingerprint)
+                if stats is None:
+                    stats = self.stats[fingerprint] = {
+                        "statement": normalized, "count": 0, "slow": 0, "total_ms": 0.0, "max_ms": 0.0,
+                        "buckets": [0] * (len(BUCKETS_MS) + 1),
+                    }
+            stats["count"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            bucket = 0
+            while bucket < len(BUCKETS_MS) and elapsed_ms > BUCKETS_MS[bucket]:
+                bucket += 1
+            stats["buckets"][bucket] += 1
+            if slow:
+                stats["slow"] += 1
+                self.samples[fingerprint] = (statement, parameters, executemany)
+                self.slow_log.append({
+                    "at": datetime.utcnow().isoformat(), "fingerprint": fingerprint,
+                    "ms": round(elapsed_ms, 1), "statement": normalized,
+                })
+        if slow:
+            print(f"🐢 Slow query {fingerprint} ({elapsed_ms:.0f} ms): {normalized[:200]}")
+
+    @staticmethod
+    def percentile(buckets, count, pct):
+        # Upper bound of the bucket holding the pct-th run; None past the last bound
+        target = count * pct
+        seen = 0
+        for bound, n in zip(BUCKETS_MS + (None,), buckets):
+            seen += n
+            if seen >= target:
+                return bound
+        return None
+
+    def report(self, top=None, order="total_ms"):
+        with self.lock:
+            rows = [dict(stats, buckets=list(stats["buckets"]), fingerprint=fingerprint)
+                    for fingerprint, stats in self.stats.items()]
+            slow_log = list(self.slow_log)
+        for row in rows:
+            row["mean_ms"] = row["total_ms"] / row["count"]
+            row["p50_ms"] = self.percentile(row["buckets"], row["count"], 0.5)
+            row["p95_ms"] = self.percentile(row["buckets"], row["count"], 0.95)
+            row["p99_ms"] = self.percentile(row["buckets"], row["count"], 0.99)
+            row["explainable"] = row["fingerprint"] in self.samples
+        rows.sort(key=lambda row: row.get(order) or 0, reverse=True)
+        return {
+            "enabled": self.attached,
+            "pid": os.getpid(),
+            "slow_ms": self.slow_ms,
+            "bucket_bounds_ms": list(BUCKETS_MS),
+            "statements": rows[:top] if top else rows,
+            "slow_log": slow_log,
+        }
+
+    def write_report(self, path):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        os.replace(tmp, path)
+
+    def metrics(self, top=10):
+        # Compact view for /metrics: busiest statements by total time
+        report = self.report(top)
+        with self.lock:
+            slow_total = sum(stats["slow"] for stats in self.stats.values())
+        statements = [
+            {key: row[key] for key in ("fingerprint", "count", "slow", "total_ms", "max_ms", "p50_ms", "p95_ms")}
+            for row in report["statements"]
+        ]
+        return {"enabled": report["enabled"], "slow_ms": self.slow_ms,
+                "slow_total": slow_total, "top": statements}
+
+    def explain(self, engine, fingerprint):
+        """Re-run the last slow sample of fingerprint under EXPLAIN and return the plan.
+
+        PostgreSQL gets EXPLAIN (ANALYZE, BUFFERS), which executes the query,
+        so only read-only statements are accepted and the transaction is
+        rolled back; SQLite only has EXPLAIN QUERY PLAN.
+        """
+        with self.lock:
+            sample = self.samples.get(fingerprint)
+        if sample is None:
+            raise KeyError(fingerprint)
+        statement, parameters, executemany = sample
+        if WRITES.search(normalize(statement)):
+            raise ValueError("Only read-only statements can be explained")
+        if executemany:
+            parameters = parameters[0]
+        if engine.dialect.name == "postgresql":
+            prefix = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) "
+        elif engine.dialect.name == "sqlite":
+            prefix = "EXPLAIN QUERY PLAN "
+        else:
+            prefix = "EXPLAIN "
+        self.local.paused = True
+        try:
+            with engine.connect() as conn, conn.begin() as transaction:
+                rows = conn.exec_driver_sql(prefix + statement, parameters).all()
+                transaction.rollback()
+        finally:
+            self.local.paused = False
+        if engine.dialect.name == "postgresql":
+            return rows[0][0]
+        return [list(row) for row in rows]
@@ -0,0 +1,333 @@
+"""Replay archived webhook payloads through the event-handling code.
+
+Reads archive segments written by WEBHOOK_ARCHIVE_DIR (or any NDJSON file,
+optionally .gz/.xz) and feeds them to the same code as webhook() and
+sassy_line_myshop_webhook(), without HTTP, signature checks or outbound
+LINE calls. Text messages are written with bulk inserts, one transaction
+per chunk. Files are processed by parallel worker processes. Each file
+keeps a checkpoint so an interrupted run resumes where it stopped.
+
+    python replay.py --archive-dir /var/lib/webhook-archive --since 2025-01-01 \
+        --workers 8 --checkpoint-dir .replay-checkpoints
+    python replay.py --source line exported-events.ndjson.gz
+
+Records are {"ts", "source", "body"} archive lines; plain payload lines are
+accepted too when --source is given.
+
+Events already in the database are skipped: LINE events by webhookEventId,
+MyShop events by (orderNumber, event name, event timestamp). Messages stored
+before webhookEventId was recorded can't be matched, so a replay whose window
+holds such messages, or events that lack those keys, stops unless
+--allow-duplicates is given.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from datetime import datetime, timezone
+
+import archive
+
+# Set in each worker process by init_worker()
+webhook = None
+
+
+class DuplicateCheckError(Exception):
+    pass
+
+
+def init_worker():
+    global webhook
+    os.environ["LINE_OUTBOUND_ENABLED"] = "false"
+    os.environ["INBOUND_QUEUE_ENABLED"] = "false"
+    os.environ["WEBHOOK_ARCHIVE_DIR"] = ""
+    import webhook as webhook_module
+
+    webhook_module.LINE_OUTBOUND_ENABLED = False
+    webhook = webhook_module
+
+
+def parse_time(value):
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def record_payload(record, default_source):
+    if "body" in record and "source" in record:
+        body = record["body"]
+        return record["source"], json.loads(body) if isinstance(body, str) else body
+    return default_source, record
+
+
+def checkpoint_path(checkpoint_dir, path):
+    name = os.path.abspath(path).strip(os.sep).replace(os.sep, "__")
+    return os.path.join(checkpoint_dir, name + ".json")
+
+
+def load_checkpoint(checkpoint_dir, path):
+    if not checkpoint_dir:
+        return {"records": 0, "done": False}
+    try:
+        with open(checkpoint_path(checkpoint_dir, path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"records": 0, "done": False}
+
+
+def save_checkpoint(checkpoint_dir, path, state):
+    if not checkpoint_dir:
+        return
+    target = checkpoint_path(checkpoint_dir, path)
+    tmp = target + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, target)
+
+
+def myshop_event_key(data):
+    event = data.get("event") or {}
+    return data.get("orderNumber"), event.get("name"), event.get("timestamp")
+
+
+def stored_line_event_ids(event_ids):
+    stored = set()
+    if not event_ids:
+        return stored
+    for model in (webhook.Message, webhook.AdminMessage):
+        stored.update(row[0] for row in webhook.session.query(model.webhook_event_id)
+                      .filter(model.webhook_event_id.in_(event_ids)))
+    return stored
+
+
+def stored_myshop_events(keys):
+    if not keys:
+        return set()
+    order, payload = webhook.LineMyShopOrder, webhook.LineMyShopOrderPayload
+    rows = (
+        webhook.session.query(order.order_number, payload.event_name, payload.event_timestamp)
+        .join(payload, payload.order_id == order.id)
+        .filter(order.order_number.in_({key[0] for key in keys}))
+    )
+    return {tuple(row) for row in rows}
+
+
+def new_events(records, default_source, only_source, allow_duplicates):
+    # (source, LINE event or MyShop payload) for every event in records that is not stored yet
+    events = []
+    for record in records:
+        source, data = record_payload(record, default_source)
+        if only_source and source != only_source:
+            continue
+        if source == "line":
+            events += [(source, event, event.get("webhookEventId")) for event in data.get("events", [])]
+        elif source == "myshop":
+            key = myshop_event_key(data)
+            events.append((source, data, key if all(key) else None))
+    if allow_duplicates:
+        return [(source, item) for source, item, _ in events]
+    if any(key is None for _, _, key in events):
+        raise DuplicateCheckError("events without webhookEventId (LINE) or order number, event name and timestamp "
+                                  "(MyShop) can't be checked against the database; rerun with --allow-duplicates")
+    stored = stored_line_event_ids([key for source, _, key in events if source == "line"])
+    stored |= stored_myshop_events([key for source, _, key in events if source == "myshop"])
+    webhook.session.rollback()
+    fresh = []
+    for source, item, key in events:
+        # A key seen twice in the chunk is a redelivery archived twice
+        if key not in stored:
+            stored.add(key)
+            fresh.append((source, item))
+    return fresh
+
+
+def unkeyed_messages(since, until):
+    # Messages stored before webhookEventId was recorded; since/until are epoch seconds like the archive's
+    count = 0
+    for model in (webhook.Message, webhook.AdminMessage):
+        query = webhook.session.query(model.id).filter(model.webhook_event_id.is_(None))
+        if since is not None:
+            query = query.filter(model.date >= datetime.fromtimestamp(since))
+        if until is not None:
+            query = query.filter(model.date <= datetime.fromtimestamp(until))
+        count += query.count()
+    webhook.session.rollback()
+    return count
+
+
+def apply_chunk(events):
+    session = webhook.session
+    messages = []
+    admin_messages = []
+    other_events = []
+    activity = {}
+    for source, data in events:
+        if source == "line":
+            parsed = webhook.parse_text_event(data)
+            if parsed is None:
+                other_events.append(data)
+                continue
+            user_id, text, date = parsed
+            row = {"date": date, "text": text, "user_id": user_id, "webhook_event_id": data.get("webhookEventId")}
+            if user_id == webhook.ADMIN_ID:
+                admin_messages.append(row)
+            else:
+                messages.append(row)
+                activity[(user_id, date.date())] = activity.get((user_id, date.date()), 0) + 1
+        elif source == "myshop":
+            webhook.ingest_myshop_order(data, commit=False)
+    if messages:
+        session.execute(webhook.insert(webhook.Message), messages)
+    if admin_messages:
+        session.execute(webhook.insert(webhook.AdminMessage), admin_messages)
+    if activity:
+        webhook.count_user_activity(activity)
+    session.commit()
+    # Handled after the bulk commit, since handle_event() commits on its own
+    for event in other_events:
+        webhook.handle_event_or_dead_letter(event)
+
+
+def apply_one_by_one(events):
+    # Slow path after a failed chunk: isolate the bad records into the dead-letter table
+    for source, data in events:
+        if source == "line":
+            webhook.handle_event_or_dead_letter(data)
+        elif source == "myshop":
+            try:
+                webhook.ingest_myshop_order(data)
+            except Exception as e:
+                webhook.session.rollback()
+                webhook.dead_letter("myshop", data, e)
+
+
+def replay_file(task):
+    path, options = task
+    state = load_checkpoint(options["checkpoint_dir"], path)
+    if state.get("done"):
+        return path, 0, 0, True
+    skip = state.get("records", 0)
+    started = time.monotonic()
+    seen = 0
+    events = 0
+    chunk = []
+
+    def flush():
+        nonlocal events
+        try:
+            fresh = new_events(chunk, options["default_source"], options["only_source"], options["allow_duplicates"])
+        except DuplicateCheckError as e:
+            raise DuplicateCheckError(f"{path}: {e}") from None
+        try:
+            apply_chunk(fresh)
+        except Exception as e:
+            webhook.session.rollback()
+            print(f"⚠️ Chunk failed in {path} ({e}); retrying record by record", file=sys.stderr)
+            apply_one_by_one(fresh)
+        events += len(fresh)
+        state["records"] = seen
+        save_checkpoint(options["checkpoint_dir"], path, state)
+        elapsed = time.monotonic() - started
+        print(f"⏩ {os.path.basename(path)}: {seen} records, {events} events "
+              f"({events / elapsed if elapsed else 0:,.0f} events/s)", file=sys.stderr)
+        chunk.clear()
+
+    for record in archive.iter_records(path, options["since"], options["until"]):
+        seen += 1
+        if seen <= skip:
+            continue
+        chunk.append(record)
+        if len(chunk) >= options["chunk_size"]:
+            flush()
+    if chunk:
+        flush()
+    state["done"] = True
+    save_checkpoint(options["checkpoint_dir"], path, state)
+    return path, seen - skip, events, False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay archived webhook payloads")
+    parser.add_argument("paths", nargs="*", help="NDJSON files (optionally .gz/.xz)")
+    parser.add_argument("--archive-dir", help="replay segments from this webhook archive")
+    parser.add_argument("--since", help="ISO time; only records received at or after this")
+    parser.add_argument("--until", help="ISO time; only records received at or before this")
+    parser.add_argument("--source", choices=["line", "myshop"],
+                        help="only replay this source (required for plain payload files)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=5000, help="records per transaction")
+    parser.add_argument("--checkpoint-dir", help="persist per-file progress here to allow resuming")
+    parser.add_argument("--allow-duplicates", action="store_true",
+                        help="store every event even when it can't be checked against the database")
+    args = parser.parse_args(argv)
+
+    since, until = parse_time(args.since), parse_time(args.until)
+    paths = list(args.paths)
+    if args.archive_dir:
+        paths += archive.find_segments(args.archive_dir, since, until)
+    if not paths:
+        print("❌ Nothing to replay", file=sys.stderr)
+        return 2
+    if args.checkpoint_dir:
+        os.makedirs(args.checkpoint_dir, exist_ok=True)
+    if not args.allow_duplicates:
+        init_worker()
+        unkeyed = unkeyed_messages(since, until)
+        # The pool's forked workers must not share the connections this check opened
+        webhook.engine.dispose()
+        if unkeyed:
+            print(f"❌ {unkeyed} stored message(s) in this window have no webhookEventId, so their events "
+                  f"would be stored again; narrow --since/--until or pass --allow-duplicates", file=sys.stderr)
+            return 2
+
+    options = {
+        "since": since,
+        "until": until,
+        "default_source": args.source,
+        "only_source": args.source,
+        "chunk_size": args.chunk_size,
+        "checkpoint_dir": args.checkpoint_dir,
+        "allow_duplicates": args.allow_duplicates,
+    }
+    tasks = [(path, options) for path in paths]
+    started = time.monotonic()
+    total_records = total_events = 0
+    print(f"🔁 Replaying {len(paths)} file(s) with {args.workers} worker(s)", file=sys.stderr)
+    try:
+        if args.workers > 1:
+            with multiprocessing.Pool(args.workers, initializer=init_worker) as pool:
+                results = pool.imap_unordered(replay_file, tasks)
+                for path, records, events, skipped in results:
+                    total_records += records
+                    total_events += events
+                    print(f"{'⏭️  skipped' if skipped else '✅ done'} {path}", file=sys.stderr)
+        else:
+            init_worker()
+            for task in tasks:
+                path, records, events, skipped = replay_file(task)
+                total_records += records
+                total_events += events
+                print(f"{'⏭️  skipped' if skipped else '✅ done'} {path}", file=sys.stderr)
+    except DuplicateCheckError as e:
+        # Chunks before the failing one are committed and checkpointed; a rerun resumes there
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+
+    elapsed = time.monotonic() - started
+    print(json.dumps({
+        "files": len(paths),
+        "records": total_records,
+        "events": total_events,
+        "elapsed_s": elapsed,
+        "events_per_sec": total_events / elapsed if elapsed else None,
+    }))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import os
+import time
+import zlib
+import fcntl
+import socket
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import select, func, insert, update
+
+
+class JobScheduler:
+    """Runs periodic jobs once per interval across every worker and node.
+
+    Each process runs one thread per job. When a job is due, the thread
+    takes a per-job lock: pg_try_advisory_lock on PostgreSQL, or a
+    non-blocking flock under lock_dir otherwise (enough for SQLite, which
+    is single-node anyway). The lock holder re-checks last_started_at in
+    the state table, so a run that a sibling has just finished is not
+    repeated. A run that takes longer than its interval is counted as an
+    overlap, since the next one was due before it ended.
+    """
+
+    def __init__(self, engine, table, lock_dir=None, tick=1.0, after_run=None):
+        self.engine = engine
+        self.table = table  # columns: name, last_started_at, last_finished_at, last_duration_s, runs, failures, overlaps, last_error, running_since, owner
+        self.lock_dir = lock_dir or tempfile.gettempdir()
+        self.tick = tick
+        self.after_run = after_run
+        self.jobs = {}
+        self.pid = None
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def add(self, name, interval, fn):
+        if interval and interval > 0:
+            self.jobs[name] = (interval, fn)
+
+    def start(self):
+        # Called from gunicorn post_fork (and as a fallback on first request); once per process
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.owner = f"{socket.gethostname()}:{self.pid}"
+        for name in self.jobs:
+            threading.Thread(target=self._loop, args=(name,), name=f"job-{name}", daemon=True).start()
+
+    def _loop(self, name):
+        interval, _ = self.jobs[name]
+        # Spread workers out so they do not all hit the lock on the same tick
+        jitter = (zlib.crc32(self.owner.encode()) % 1000) / 1000.0 * self.tick
+        time.sleep(self.tick + jitter)
+        while True:
+            wait = self.tick
+            try:
+                if self.run_once(name) != "busy":
+                    state = self._state(name)
+                    wait = max(self._seconds_until_due(state, interval, datetime.utcnow()), self.tick)
+            except Exception as e:
+                print(f"⚠️ Scheduler error in job {name}:", e)
+            time.sleep(wait + jitter)
+
+    @contextmanager
+    def _lock(self, name):
+        if self.engine.dialect.name == "postgresql":
+            key = zlib.crc32(f"job:{name}".encode())
+            with self.engine.connect() as conn:
+                acquired = conn.execute(select(func.pg_try_advisory_lock(key))).scalar()
+                conn.commit()
+                try:
+                    yield acquired
+                finally:
+                    if acquired:
+                        conn.execute(select(func.pg_advisory_unlock(key)))
+                        conn.commit()
+            return
+        path = os.path.join(self.lock_dir, f"job-{name}.lock")
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def _state(self, name):
+        with self.engine.connect() as conn:
+            return conn.execute(select(self.table).where(self.table.c.name == name)).mappings().first()
+
+    def _update(self, name, **values):
+        with self.engine.begin() as conn:
+            conn.execute(update(self.table).where(self.table.c.name == name).values(**values))
+
+    def _seconds_until_due(self, state, interval, now):
+        started = state["last_started_at"] if state else None
+        if started is None:
+            return 0.0
+        return interval - (now - started).total_seconds()
+
+    def run_once(self, name, force=False):
+        # "ran", "not_due" or "busy"
+        interval, fn = self.jobs[name]
+        if not force and self._seconds_until_due(self._state(name), interval, datetime.utcnow()) > 0:
+            return "not_due"
+        with self._lock(name) as acquired:
+            if not acquired:
+                return "busy"
+            now = datetime.utcnow()
+            state = self._state(name)
+            if state is None:
+                with self.engine.begin() as conn:
+                    conn.execute(insert(self.table).values(name=name, runs=0, failures=0, overlaps=0))
+            elif not force and self._seconds_until_due(state, interval, now) > 0:
+                return "not_due"
+            self._update(name, last_started_at=now, running_since=now, owner=self.owner)
+            started = time.monotonic()
+            error = None
+            try:
+                fn()
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                print(f"⚠️ Job {name} failed:", e)
+            finally:
+                if self.after_run:
+                    self.after_run()
+            duration = time.monotonic() - started
+            values = {
+                "last_finished_at": datetime.utcnow(),
+                "last_duration_s": duration,
+                "running_since": None,
+                "runs": self.table.c.runs + 1,
+                "last_error": error,
+            }
+            if error:
+                values["failures"] = self.table.c.failures + 1
+            if duration > interval:
+                values["overlaps"] = self.table.c.overlaps + 1
+            self._update(name, **values)
+            return "ran"
+
+    def metrics(self):
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(self.table)).mappings().all()
+        states = {row["name"]: row for row in rows}
+        report = {}
+        for name, (interval, _) in self.jobs.items():
+            row = states.get(name) or {}
+            report[name] = {
+                "interval_s": interval,
+                "runs": row.get("runs", 0),
+                "failures": row.get("failures", 0),
+                "overlaps": row.get("overlaps", 0),
+                "last_duration_s": row.get("last_duration_s"),
+                "last_started_at": row["last_started_at"].isoformat() if row.get("last_started_at") else None,
+                "running_since": row["running_since"].isoformat() if row.get("running_since") else None,
+                "owner": row.get("owner"),
+                "last_error": row.get("last_error"),
+            }
+        return report
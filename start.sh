@@ -1,2 +1,4 @@
 #!/bin/bash
-gunicorn webhook:app --bind 0.0.0.0:$PORT
+set -e
+flask --app webhook db migrate
+gunicorn webhook:app --config gunicorn.conf.py --bind 0.0.0.0:$PORT
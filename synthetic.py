@@ -0,0 +1,419 @@
+"""Fill an empty database with a deterministic synthetic dataset for scale tests.
+
+Generates users with skewed (Zipf-like) activity, a year of Thai/English
+customer messages with daily and weekly rhythms, admin messages, ChatGPT
+logs, and MyShop orders that have moved through their life-cycle
+(created, paid, shipped, completed or cancelled) by the end date. The
+same --seed, --scale and --end always produce the same rows, ids included;
+--scale multiplies every table's base volume, so 1, 10 and 100 give
+comparable datasets of growing size.
+
+    python synthetic.py --database-url postgresql://localhost/scale --scale 10 --seed 42
+    python synthetic.py --database-url sqlite:///scale.db --scale 1 --truncate
+
+PostgreSQL is loaded with COPY, other backends with batched inserts.
+Monthly partitions are created for the generated range where tables are
+partitioned. Sales rollups and daily activity are rebuilt at the end.
+"""
+import os
+import io
+import sys
+import json
+import time
+import bisect
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from loadtest import THAI_TEXTS, PRODUCTS
+
+# Rows at --scale 1; order items follow from the orders (1-3 each)
+BASE_ROWS = {
+    "user_profiles": 2000,
+    "messages": 200000,
+    "admin_messages": 20000,
+    "chatgpt_logs": 10000,
+    "line_myshop_orders": 20000,
+}
+# Loaded in this order; payloads are cleared by --truncate since they reference orders
+TABLES = ["user_profiles", "messages", "admin_messages", "chatgpt_logs", "line_myshop_orders", "line_myshop_order_items"]
+CLEARED_TABLES = ["line_myshop_order_payloads", "line_myshop_order_items", "line_myshop_orders",
+                  "chatgpt_logs", "admin_messages", "messages", "user_profiles", "user_daily_activity"]
+
+# Share of a day's messages per hour, Bangkok time: quiet at night, peaks at lunch and after work
+HOUR_WEIGHTS = [2, 1, 1, 1, 1, 2, 3, 5, 7, 8, 8, 9, 10, 9, 8, 8, 8, 9, 10, 12, 14, 13, 9, 5]
+WEEKDAY_WEIGHTS = [1.0, 1.0, 1.0, 1.0, 1.1, 1.3, 1.25]
+BANGKOK = timedelta(hours=7)
+
+FIRST_NAMES = ["สมชาย", "สมหญิง", "มานี", "ปิติ", "ชูใจ", "วีระ", "กมลา", "อรุณี", "ณัฐ", "พิมพ์",
+               "Nok", "Ploy", "Beam", "Mint", "Fah", "Ice", "Bank", "Joy", "Praew", "Tong"]
+LAST_NAMES = ["ใจดี", "รักไทย", "ศรีสุข", "มั่นคง", "ทองดี", "แก้วใส", "บุญมา", "สุขสันต์", "", ""]
+PROVINCES = ["กรุงเทพฯ 10110", "นนทบุรี 11000", "เชียงใหม่ 50000", "ขอนแก่น 40000", "ภูเก็ต 83000",
+             "ชลบุรี 20000", "สงขลา 90110", "นครราชสีมา 30000", "อุดรธานี 41000", "สุราษฎร์ธานี 84000"]
+STREETS = ["ถนนสุขุมวิท", "ถนนพหลโยธิน", "ถนนรัชดาภิเษก", "ถนนนิมมานเหมินท์", "ถนนมิตรภาพ", "ซอยลาดพร้าว"]
+CARRIERS = ["ไปรษณีย์ไทย", "Kerry Express", "Flash Express", "J&T Express"]
+ADMIN_TEXTS = [
+    "ส่งของแล้วนะคะ เลขพัสดุ {tracking}",
+    "ได้รับยอดโอนแล้วค่ะ ขอบคุณค่ะ",
+    "สินค้าหมดชั่วคราวค่ะ จะเข้าอีกสัปดาห์หน้า",
+    "ราคา {price} บาทค่ะ ส่งฟรีเมื่อซื้อครบ 500",
+    "/top 10",
+    "ขอชื่อและที่อยู่จัดส่งด้วยค่ะ",
+]
+CHATGPT_ANSWERS = [
+    "สินค้าจัดส่งภายใน 1-3 วันทำการค่ะ",
+    "สามารถชำระเงินผ่านการโอนหรือบัตรเครดิตได้ค่ะ",
+    "โปรโมชั่นเดือนนี้ ซื้อ 2 ชิ้นลด 10% ค่ะ",
+    "ขอโทษค่ะ สินค้านี้หมดชั่วคราว",
+    "Delivery usually takes 1-3 business days.",
+]
+
+
+def table_rng(seed, name):
+    # One stream per table, so a table's rows do not depend on the others or on batch sizes
+    return random.Random(f"{seed}:{name}")
+
+
+def zipf_cum_weights(n, s=1.0):
+    total = 0.0
+    cum = []
+    for rank in range(1, n + 1):
+        total += 1.0 / rank ** s
+        cum.append(total)
+    return cum
+
+
+class UserPool:
+    """Customer ids with Zipf-distributed activity: a few users send most messages."""
+
+    def __init__(self, seed, count):
+        rng = table_rng(seed, "users")
+        self.ids = ["U%032x" % rng.getrandbits(128) for _ in range(count)]
+        self.cum = zipf_cum_weights(count)
+
+    def pick(self, rng):
+        return self.ids[bisect.bisect_left(self.cum, rng.random() * self.cum[-1])]
+
+
+def timeline(rng, total, end, days):
+    """Yield total ascending timestamps over the days before end.
+
+    Volumes grow over the period, follow the week and vary day to day;
+    within a day they follow HOUR_WEIGHTS in Bangkok time (stored as UTC).
+    """
+    weights = []
+    start = end - timedelta(days=days)
+    for day in range(days):
+        weekday = (start + timedelta(days=day)).weekday()
+        weights.append((0.6 + 0.8 * day / days) * WEEKDAY_WEIGHTS[weekday] * rng.lognormvariate(0, 0.25))
+    scale = total / sum(weights)
+    counts = [int(w * scale) for w in weights]
+    # Hand the rounding remainder to the largest fractional parts so the total is exact
+    by_remainder = sorted(range(days), key=lambda d: weights[d] * scale - counts[d], reverse=True)
+    for day in by_remainder[:total - sum(counts)]:
+        counts[day] += 1
+    hours = list(range(24))
+    for day, count in enumerate(counts):
+        local_midnight = start + timedelta(days=day)
+        stamps = []
+        for hour in rng.choices(hours, weights=HOUR_WEIGHTS, k=count):
+            offset = hour * 3600 + rng.random() * 3600
+            stamps.append(local_midnight + timedelta(seconds=offset) - BANGKOK)
+        stamps.sort()
+        yield from stamps
+
+
+def customer_text(rng):
+    roll = rng.random()
+    if roll < 0.86:
+        text = rng.choice(THAI_TEXTS).format(order=rng.randint(10 ** 13, 10 ** 14 - 1))
+        if rng.random() < 0.3:
+            text += " " + rng.choice(THAI_TEXTS).format(order=rng.randint(10 ** 13, 10 ** 14 - 1))
+        return "text", text
+    if roll < 0.94:
+        return "sticker", f"[sticker {rng.randint(11537, 11539)}/{rng.randint(52002734, 52002773)}] happy, thanks"
+    if roll < 0.98:
+        return "image", f"[image {rng.randint(10 ** 17, 10 ** 18 - 1)}]"
+    return "location", f"[location {13.7 + rng.random():.5f},{100.5 + rng.random():.5f}] {rng.choice(PROVINCES)}"
+
+
+def generate_profiles(seed, users, end, days):
+    rng = table_rng(seed, "user_profiles")
+    for row_id, user_id in enumerate(users.ids, 1):
+        status = rng.choices(["active", "unfollowed", "unreachable"], weights=[90, 8, 2])[0]
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}".strip()
+        yield {
+            "id": row_id,
+            "user_id": user_id,
+            "display_name": None if status == "unreachable" else name,
+            "status": status,
+            "status_changed_at": end - timedelta(seconds=rng.randint(0, days * 86400)) if status != "active" else None,
+            "fetched_at": end - timedelta(seconds=rng.randint(0, 30 * 86400)) if status != "unreachable" else None,
+        }
+
+
+def generate_messages(seed, count, users, end, days):
+    rng = table_rng(seed, "messages")
+    for row_id, date in enumerate(timeline(rng, count, end, days), 1):
+        message_type, text = customer_text(rng)
+        yield {"id": row_id, "date": date, "text": text, "user_id": users.pick(rng), "message_type": message_type}
+
+
+def generate_admin_messages(seed, count, end, days):
+    rng = table_rng(seed, "admin_messages")
+    admins = ["U%032x" % rng.getrandbits(128) for _ in range(3)]
+    for row_id, date in enumerate(timeline(rng, count, end, days), 1):
+        text = rng.choice(ADMIN_TEXTS).format(tracking=f"TH{rng.randint(10 ** 9, 10 ** 10 - 1)}",
+                                               price=rng.choice(PRODUCTS)[2])
+        yield {"id": row_id, "date": date, "text": text, "user_id": rng.choices(admins, weights=[6, 3, 1])[0]}
+
+
+def generate_chatgpt_logs(seed, count, users, end, days):
+    rng = table_rng(seed, "chatgpt_logs")
+    for row_id, date in enumerate(timeline(rng, count, end, days), 1):
+        yield {
+            "id": row_id,
+            "date": date,
+            "user_id": users.pick(rng),
+            "prompt": rng.choice(THAI_TEXTS).format(order=rng.randint(10 ** 13, 10 ** 14 - 1)),
+            "response": rng.choice(CHATGPT_ANSWERS),
+        }
+
+
+def order_lifecycle(rng, created, end):
+    # (final status, time of the last event); later stages only happen if they fall before end
+    events = [("CREATED", created)]
+    if rng.random() < 0.08:
+        return "CANCELLED", created + timedelta(minutes=rng.randint(5, 720))
+    paid = created + timedelta(minutes=rng.expovariate(1 / 90))
+    events.append(("PAID", paid))
+    if rng.random() < 0.04:
+        events.append(("CANCELLED", paid + timedelta(hours=rng.randint(1, 48))))
+    else:
+        shipped = paid + timedelta(hours=rng.uniform(4, 48))
+        events.append(("SHIPPED", shipped))
+        events.append(("COMPLETED", shipped + timedelta(days=rng.uniform(1, 5))))
+    reached = [event for event in events if event[1] <= end]
+    return reached[-1]
+
+
+def generate_orders(seed, count, end, days):
+    """Yield (order row, item rows); every order is stored as of its latest event."""
+    rng = table_rng(seed, "line_myshop_orders")
+    item_id = 0
+    for order_id, created in enumerate(timeline(rng, count, end, days), 1):
+        recipient = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}".strip()
+        status, event_at = order_lifecycle(rng, created, end)
+        items = []
+        subtotal = 0.0
+        for name, sku, price, weight in rng.sample(PRODUCTS, rng.choices([1, 2, 3], weights=[6, 3, 1])[0]):
+            quantity = rng.choices([1, 2, 3], weights=[7, 2, 1])[0]
+            discounted = round(price * rng.choice([1.0, 1.0, 0.9, 0.8]), 2)
+            subtotal += discounted * quantity
+            item_id += 1
+            items.append({
+                "id": item_id, "order_id": order_id, "name": name, "sku": sku, "quantity": quantity,
+                "price": price, "discounted_price": discounted, "barcode": str(rng.randint(10 ** 12, 10 ** 13 - 1)),
+                "weight": weight, "image_url": f"https://example.com/images/{sku}.jpg",
+            })
+        shipment_price = 0.0 if subtotal >= 500 else rng.choice([40.0, 50.0])
+        is_cod = rng.random() < 0.2
+        event_time = event_at.replace(microsecond=0, tzinfo=timezone.utc)
+        order = {
+            "id": order_id,
+            "order_number": str(rng.randint(10 ** 13, 10 ** 14 - 1)),
+            "order_status": status,
+            "event_name": "ORDER_STATUS_CHANGED",
+            "event_timestamp": event_time.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "event_time": event_time,
+            "first_event_time": created.replace(microsecond=0, tzinfo=timezone.utc),
+            "payment_method": "COD" if is_cod else rng.choice(["BANK_TRANSFER", "CREDIT_CARD", "PROMPTPAY"]),
+            "payment_status": "PAID" if status in ("PAID", "SHIPPED", "COMPLETED") else "PENDING",
+            "recipient_name": recipient,
+            "phone_number": "0" + rng.choice("689") + str(rng.randint(10 ** 7, 10 ** 8 - 1)),
+            "address": f"{rng.randint(1, 999)}/{rng.randint(1, 99)} {rng.choice(STREETS)} {rng.choice(PROVINCES)}",
+            "shipment_company_name": rng.choice(CARRIERS),
+            "tracking_number": f"TH{rng.randint(10 ** 9, 10 ** 10 - 1)}" if status in ("SHIPPED", "COMPLETED") else None,
+            "subtotal_price": round(subtotal, 2),
+            "total_price": round(subtotal + shipment_price, 2),
+            "shipment_price": shipment_price,
+            "is_cod": is_cod,
+            "is_gift": rng.random() < 0.05,
+            "date": created,
+        }
+        yield order, items
+
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def copy_value(value):
+    # COPY text format: \N is NULL; backslash, tab and newlines are escaped
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class Loader:
+    """Writes batches of row dicts: COPY on PostgreSQL, executemany inserts elsewhere."""
+
+    def __init__(self, webhook, batch_size):
+        self.webhook = webhook
+        self.engine = webhook.engine
+        self.batch_size = batch_size
+        self.copy = self.engine.dialect.name == "postgresql"
+
+    def load(self, table, rows):
+        loaded = 0
+        columns = [column.name for column in table.columns]
+        if self.copy:
+            raw = self.engine.raw_connection()
+            try:
+                cursor = raw.cursor()
+                for batch in batched(rows, self.batch_size):
+                    buffer = io.StringIO()
+                    for row in batch:
+                        buffer.write("\t".join(copy_value(row.get(name)) for name in columns) + "\n")
+                    buffer.seek(0)
+                    cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN", buffer)
+                    loaded += len(batch)
+                raw.commit()
+            finally:
+                raw.close()
+            return loaded
+        with self.engine.begin() as conn:
+            for batch in batched(rows, self.batch_size):
+                conn.execute(self.webhook.insert(table), batch)
+                loaded += len(batch)
+        return loaded
+
+
+def row_counts(webhook, names):
+    counts = {}
+    with webhook.engine.connect() as conn:
+        for name in names:
+            counts[name] = conn.execute(webhook.sql_text(f"SELECT count(*) FROM {name}")).scalar()
+    return counts
+
+
+def clear_tables(webhook):
+    with webhook.engine.begin() as conn:
+        if webhook.engine.dialect.name == "postgresql":
+            conn.execute(webhook.sql_text(f"TRUNCATE {', '.join(CLEARED_TABLES)} RESTART IDENTITY CASCADE"))
+        else:
+            for name in CLEARED_TABLES:
+                conn.execute(webhook.sql_text(f"DELETE FROM {name}"))
+
+
+def prepare_partitions(webhook, start, end):
+    if webhook.engine.dialect.name != "postgresql":
+        return
+    partitions = webhook.partitions
+    with webhook.engine.begin() as conn:
+        for table in webhook.PARTITIONED_TABLES:
+            if partitions.is_partitioned(conn, table.name):
+                partitions.create_month_partitions(conn, table.name, partitions.month_start(start),
+                                                   partitions.month_start(end))
+
+
+def finish(webhook, names):
+    # Explicit ids leave PostgreSQL sequences behind; point them past the generated rows
+    with webhook.engine.begin() as conn:
+        if webhook.engine.dialect.name == "postgresql":
+            for name in names:
+                conn.execute(webhook.sql_text(
+                    f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), (SELECT coalesce(max(id), 0) + 1 FROM {name}), false)"
+                ))
+        activity = webhook.UserDailyActivity.__table__
+        messages = webhook.Message.__table__
+        day = webhook.func.date(messages.c.date)
+        conn.execute(webhook.insert(activity).from_select(
+            ["user_id", "day", "messages"],
+            webhook.select(messages.c.user_id, day, webhook.func.count()).group_by(messages.c.user_id, day),
+        ))
+    webhook.rebuild_rollups()
+    if webhook.engine.dialect.name == "postgresql":
+        with webhook.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            for name in names:
+                conn.execute(webhook.sql_text(f"ANALYZE {name}"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic dataset")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies every table's base row count")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--days", type=int, default=365, help="length of the generated history")
+    parser.add_argument("--end", default="2025-01-01", help="history ends here (UTC); fixed so reruns match")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--truncate", action="store_true", help="empty the target tables first")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("--database-url or DATABASE_URL is required")
+
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["LINE_OUTBOUND_ENABLED"] = "false"
+    import webhook
+
+    if args.truncate:
+        clear_tables(webhook)
+    # Everything --truncate would clear: finish() derives user_daily_activity and would collide with existing rows
+    present = {name: count for name, count in row_counts(webhook, CLEARED_TABLES).items() if count}
+    if present:
+        print(f"❌ Target tables are not empty: {present}; pass --truncate to clear them", file=sys.stderr)
+        return 2
+
+    end = datetime.fromisoformat(args.end)
+    start = end - timedelta(days=args.days)
+    rows = {name: max(1, int(base * args.scale)) for name, base in BASE_ROWS.items()}
+    prepare_partitions(webhook, start, end)
+    users = UserPool(args.seed, rows["user_profiles"])
+    loader = Loader(webhook, args.batch_size)
+    report = {"seed": args.seed, "scale": args.scale, "backend": webhook.engine.dialect.name,
+              "range": [start.isoformat(), end.isoformat()], "tables": {}}
+
+    def timed(name, table, generated):
+        started = time.monotonic()
+        loaded = loader.load(table, generated)
+        elapsed = time.monotonic() - started
+        report["tables"][name] = {"rows": loaded, "seconds": round(elapsed, 1), "rows_per_s": round(loaded / elapsed)}
+        print(f"📝 {name}: {loaded} rows in {elapsed:.1f}s", file=sys.stderr)
+
+    timed("user_profiles", webhook.UserProfile.__table__, generate_profiles(args.seed, users, end, args.days))
+    timed("messages", webhook.Message.__table__,
+          generate_messages(args.seed, rows["messages"], users, end, args.days))
+    timed("admin_messages", webhook.AdminMessage.__table__,
+          generate_admin_messages(args.seed, rows["admin_messages"], end, args.days))
+    timed("chatgpt_logs", webhook.ChatGPTLog.__table__,
+          generate_chatgpt_logs(args.seed, rows["chatgpt_logs"], users, end, args.days))
+
+    # The order stream is generated twice, once per table, rather than holding every item in memory
+    orders = generate_orders(args.seed, rows["line_myshop_orders"], end, args.days)
+    timed("line_myshop_orders", webhook.LineMyShopOrder.__table__, (order for order, _ in orders))
+    orders = generate_orders(args.seed, rows["line_myshop_orders"], end, args.days)
+    timed("line_myshop_order_items", webhook.LineMyShopOrderItem.__table__, (item for _, items in orders for item in items))
+
+    started = time.monotonic()
+    finish(webhook, TABLES)
+    report["finish_seconds"] = round(time.monotonic() - started, 1)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
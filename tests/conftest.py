@@ -0,0 +1,62 @@
+import os
+import hmac
+import json
+import base64
+import hashlib
+import tempfile
+
+import pytest
+
+# webhook.py binds its engine and reads its settings at import, so the environment is set first
+TEST_DIR = tempfile.mkdtemp(prefix="webhook-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(TEST_DIR, 'webhook.db')}",
+    "LINE_CHANNEL_SECRET": "test-channel-secret",
+    "LINESHOP_KEY": "test-shop-key",
+    "LINE_ACCESS_TOKEN": "test-token",
+    "OPENAI_API_KEY": "test-token",
+    "ADMIN_ID": "Uadmin",
+    "ADMIN_API_TOKEN": "test-admin-token",
+    "FORWARD_USER_ID": "",
+    "LINE_OUTBOUND_ENABLED": "false",
+    "WEBHOOK_ARCHIVE_DIR": "",
+    "MEDIA_DIR": "",
+    "EVENT_LANES": "2",
+})
+
+
+def clear_tables(webhook):
+    webhook.session.rollback()
+    for table in reversed(webhook.Base.metadata.sorted_tables):
+        webhook.session.execute(table.delete())
+    webhook.session.commit()
+    webhook.known_profiles.clear()
+    webhook.activity_leaderboard.refresh()
+    webhook.auto_reply_engine.reload(force=True)
+    webhook.faq_retriever.sync()
+
+
+@pytest.fixture
+def wh():
+    # The webhook module over an empty database
+    import webhook
+
+    clear_tables(webhook)
+    yield webhook
+    webhook.session.rollback()
+    webhook.session.remove()
+
+
+@pytest.fixture
+def post_line(wh):
+    # POST a signed LINE webhook body; returns the response
+    def post(*events, status=200):
+        body = json.dumps({"destination": "Ubot", "events": list(events)}, ensure_ascii=False)
+        digest = hmac.new(wh.LINE_CHANNEL_SECRET.encode(), body.encode(), hashlib.sha256).digest()
+        response = wh.app.test_client().post("/webhook", data=body.encode(), headers={
+            "X-Line-Signature": base64.b64encode(digest).decode(), "Content-Type": "application/json",
+        })
+        assert response.status_code == status
+        return response
+
+    return post
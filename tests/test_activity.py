@@ -0,0 +1,61 @@
+import time
+from datetime import datetime, timedelta
+
+from leaderboard import Leaderboard
+
+ADMIN_HEADERS = {"Authorization": "Bearer test-admin-token"}
+
+
+def text_event(user_id, text, n=0):
+    return {"type": "message", "timestamp": int(time.time() * 1000) + n, "webhookEventId": f"E{user_id}{text}{n}",
+            "source": {"type": "user", "userId": user_id}, "message": {"type": "text", "id": str(n), "text": text}}
+
+
+def top_users(wh, n=10):
+    response = wh.app.test_client().get("/reports/top-users", query_string={"n": n}, headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    return [(row["user_id"], row["display_name"], row["messages"]) for row in response.get_json()["users"]]
+
+
+def test_messages_are_counted_per_user_and_day_and_ranked(wh, post_line):
+    wh.session.add(wh.UserProfile(user_id="U2", display_name="Somchai"))
+    wh.session.commit()
+    post_line(*[text_event("U1", "hi", n) for n in range(2)], *[text_event("U2", "hi", n) for n in range(3)],
+              text_event(wh.ADMIN_ID, "/stats"))
+    counts = {(row.user_id, row.messages) for row in wh.session.query(wh.UserDailyActivity)}
+    wh.session.rollback()
+    assert counts == {("U1", 2), ("U2", 3)}
+    assert top_users(wh) == [("U2", "Somchai", 3), ("U1", None, 2)]
+    assert top_users(wh, n=1) == [("U2", "Somchai", 3)]
+
+
+def test_days_outside_the_window_are_not_ranked(wh, monkeypatch):
+    monkeypatch.setattr(wh, "ACTIVITY_WINDOW_DAYS", 7)
+    today = datetime.now().date()
+    wh.session.add_all([
+        wh.UserDailyActivity(user_id="U1", day=today, messages=2),
+        wh.UserDailyActivity(user_id="U2", day=today - timedelta(days=6), messages=3),
+        wh.UserDailyActivity(user_id="U3", day=today - timedelta(days=7), messages=100),
+    ])
+    wh.session.commit()
+    wh.activity_leaderboard.refresh()
+    assert top_users(wh) == [("U2", None, 3), ("U1", None, 2)]
+
+
+def test_admin_top_command_replies_with_the_ranking(wh, post_line, monkeypatch):
+    sent = []
+    monkeypatch.setattr(wh, "reply_to_line_user", lambda user_id, text: sent.append((user_id, text)))
+    post_line(*[text_event("U1", "hi", n) for n in range(2)], text_event("U2", "hi"))
+    post_line(text_event(wh.ADMIN_ID, "/top 1"))
+    assert sent == [(wh.ADMIN_ID, f"🏆 Top 1 customers, last {wh.ACTIVITY_WINDOW_DAYS} days\n1. U1 — 2")]
+
+
+def test_leaderboard_keeps_the_top_n_between_refreshes():
+    board = Leaderboard(2, lambda: {"a": 5, "b": 3, "c": 1})
+    assert board.top() == [("a", 5), ("b", 3)]
+    board.record("c", 2)
+    assert board.top() == [("a", 5), ("b", 3)]  # c ties b: the smallest entry is not displaced
+    board.record("c")
+    assert board.top() == [("a", 5), ("c", 4)]
+    board.record("b", 3)
+    assert board.top() == [("b", 6), ("a", 5)]
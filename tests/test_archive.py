@@ -0,0 +1,56 @@
+import os
+import json
+
+import pytest
+
+from archive import SegmentArchive, find_segments, iter_records, read_index, rebuild_index
+
+
+@pytest.fixture
+def archive_dir(wh, tmp_path, monkeypatch):
+    monkeypatch.setattr(wh, "WEBHOOK_ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(wh, "webhook_archive", None)
+    yield tmp_path
+    if wh.webhook_archive:
+        wh.webhook_archive.close()
+
+
+def records(directory, start=None, end=None):
+    return [(r["ts"], r["source"], r["body"]) for path in find_segments(str(directory), start, end)
+            for r in iter_records(path, start, end)]
+
+
+def test_webhook_archives_the_verified_body_as_received(wh, post_line, archive_dir):
+    event = {"type": "unfollow", "timestamp": 1735725600000, "source": {"type": "user", "userId": "U1"}}
+    post_line(event)
+    wh.app.test_client().post("/webhook", data=b'{"events": []}', headers={"X-Line-Signature": "forged"})
+    wh.webhook_archive.close()
+
+    [(_, source, body)] = records(archive_dir)
+    assert source == "line"
+    assert json.loads(body) == {"destination": "Ubot", "events": [event]}
+
+
+def test_segments_rotate_by_size_and_the_index_narrows_a_time_window(tmp_path):
+    archive = SegmentArchive(str(tmp_path), max_segment_bytes=1, buffer_bytes=1)
+    for ts in (100, 200, 300):
+        archive.append("line", f"body-{ts}", received_at=ts)
+    archive.close()
+
+    assert sorted(entry["first"] for entry in read_index(str(tmp_path)).values()) == [100, 200, 300]
+    assert len(find_segments(str(tmp_path), start=150, end=250)) == 1
+    assert records(tmp_path, start=150, end=250) == [(200, "line", "body-200")]
+
+
+def test_segment_torn_by_a_crash_is_read_up_to_its_last_flush(tmp_path):
+    archive = SegmentArchive(str(tmp_path), compression="xz")
+    archive.append("myshop", "flushed", received_at=100)
+    archive.flush()
+    path = os.path.join(str(tmp_path), archive.segment["segment"])
+    with open(path, "ab") as f:
+        f.write(b"\xfd7zXZ\x00 half a stream")  # the writer died mid-flush
+
+    assert [r["body"] for r in iter_records(path)] == ["flushed"]
+    [entry] = rebuild_index(str(tmp_path))
+    assert (entry["first"], entry["last"], entry["records"]) == (100, 100, 1)
+    assert rebuild_index(str(tmp_path)) == []
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+ADMIN_HEADERS = {"Authorization": "Bearer test-admin-token"}
+
+
+def get_conversation(wh, user_id, **params):
+    response = wh.app.test_client().get(f"/users/{user_id}/conversation", query_string=params, headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def all_pages(wh, user_id, limit):
+    items, cursor = [], None
+    while True:
+        page = get_conversation(wh, user_id, limit=limit, **({"before": cursor} if cursor else {}))
+        items += [(item["kind"], item["text"]) for item in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return items
+
+
+def test_pages_merge_messages_and_bot_answers_newest_first(wh):
+    at = [datetime(2025, 1, 1, 10, minute) for minute in range(3)]
+    wh.session.add_all([
+        wh.Message(date=at[0], text="q1", user_id="U1"),
+        wh.ChatGPTLog(date=at[0], user_id="U1", prompt="q1", response="a1"),
+        wh.Message(date=at[1], text="q2", user_id="U1"),
+        wh.ChatGPTLog(date=at[1], user_id="U1", prompt="q2", response="a2"),
+        wh.Message(date=at[2], text="q3", user_id="U1"),
+        wh.Message(date=at[2], text="other", user_id="U2"),
+    ])
+    wh.session.commit()
+    expected = [("inbound", "q3"), ("bot", "a2"), ("inbound", "q2"), ("bot", "a1"), ("inbound", "q1")]
+    assert all_pages(wh, "U1", limit=50) == expected
+    assert all_pages(wh, "U1", limit=2) == expected
+
+
+def test_admin_messages_are_not_part_of_any_conversation(wh):
+    # The admin's own chats with the bot are stored under ADMIN_ID whoever they concern
+    wh.session.add_all([
+        wh.Message(date=datetime(2025, 1, 1, 10), text="hi", user_id="U1"),
+        wh.AdminMessage(date=datetime(2025, 1, 1, 11), text="/top", user_id=wh.ADMIN_ID),
+    ])
+    wh.session.commit()
+    assert all_pages(wh, "U1", limit=10) == [("inbound", "hi")]
+    assert all_pages(wh, wh.ADMIN_ID, limit=10) == []
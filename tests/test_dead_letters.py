@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def text_event(user_id, text, n):
+    return {"type": "message", "timestamp": 1735725600000 + n, "webhookEventId": f"E{user_id}{n}", "replyToken": "r",
+            "source": {"type": "user", "userId": user_id}, "message": {"type": "text", "id": str(n), "text": text}}
+
+
+@pytest.fixture
+def broken_text(wh, monkeypatch):
+    # handle_event fails for every text in the set until it is emptied
+    broken = set()
+    handle_event = wh.handle_event
+
+    def handle(event):
+        if event.get("message", {}).get("text") in broken:
+            raise RuntimeError("database unavailable")
+        return handle_event(event)
+
+    monkeypatch.setattr(wh, "handle_event", handle)
+    return broken
+
+
+def stored_texts(wh):
+    texts = sorted(row[0] for row in wh.session.query(wh.Message.text))
+    wh.session.rollback()
+    return texts
+
+
+def dead_letters(wh):
+    rows = [(row.status, row.attempts) for row in wh.session.query(wh.DeadLetterEvent).order_by(wh.DeadLetterEvent.id)]
+    wh.session.rollback()
+    return rows
+
+
+def make_due(wh):
+    wh.session.query(wh.DeadLetterEvent).update({"next_attempt_at": datetime.utcnow() - timedelta(seconds=1)})
+    wh.session.commit()
+
+
+def test_failing_event_is_dead_lettered_and_the_rest_are_stored(wh, post_line, broken_text):
+    broken_text.add("bad")
+    post_line(text_event("U1", "hi", 1), text_event("U2", "bad", 2), text_event("U3", "yo", 3))
+    assert stored_texts(wh) == ["hi", "yo"]
+    entry = wh.session.query(wh.DeadLetterEvent).one()
+    assert (entry.source, entry.status, entry.error) == ("line", "pending", "database unavailable")
+    assert entry.next_attempt_at > datetime.utcnow()
+    wh.session.rollback()
+
+
+def test_retry_waits_for_the_backoff_then_resolves(wh, post_line, broken_text):
+    broken_text.add("bad")
+    post_line(text_event("U1", "bad", 1))
+    assert wh.retry_dead_letters()[:2] == (0, 0)  # not due yet
+
+    make_due(wh)
+    assert wh.retry_dead_letters()[:2] == (0, 1)
+    assert dead_letters(wh) == [("pending", 2)]
+
+    broken_text.clear()
+    make_due(wh)
+    assert wh.retry_dead_letters()[:2] == (1, 0)
+    assert dead_letters(wh) == [("resolved", 2)]
+    assert stored_texts(wh) == ["bad"]
+
+
+def test_event_is_abandoned_after_the_last_attempt(wh, post_line, broken_text, monkeypatch):
+    monkeypatch.setattr(wh, "DLQ_MAX_ATTEMPTS", 2)
+    broken_text.add("bad")
+    post_line(text_event("U1", "bad", 1))
+    make_due(wh)
+    wh.retry_dead_letters()
+    assert dead_letters(wh) == [("abandoned", 2)]
+    make_due(wh)
+    assert wh.retry_dead_letters()[:2] == (0, 0)
+    assert wh.retry_dead_letters(include_abandoned=True)[:2] == (0, 1)
+
+
+def test_failed_reply_does_not_dead_letter_a_stored_message(wh, post_line, monkeypatch):
+    wh.session.add(wh.AutoReplyRule(keyword="ราคา", reply="ดูราคาได้ที่หน้าร้านค่ะ"))
+    wh.session.commit()
+    wh.auto_reply_engine.reload(force=True)
+
+    def reply_fails(token, user_id, text):
+        raise RuntimeError("LINE API timeout")
+
+    monkeypatch.setattr(wh, "reply_with_token", reply_fails)
+    post_line(text_event("U1", "ขอราคาหน่อย", 1))
+    assert stored_texts(wh) == ["ขอราคาหน่อย"]
+    assert dead_letters(wh) == []
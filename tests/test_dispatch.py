@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import pytest
+
+
+def event(event_type, user_id="U1", n=1, **fields):
+    source = {"type": "user", "userId": user_id} if user_id else {"type": "group", "groupId": "G1"}
+    return dict({"type": event_type, "timestamp": 1735725600000 + n, "webhookEventId": f"E{n}", "replyToken": "r",
+                 "source": source}, **fields)
+
+
+def message(message_type, n=1, user_id="U1", **fields):
+    return event("message", user_id, n, message=dict({"type": message_type, "id": str(n)}, **fields))
+
+
+@pytest.fixture
+def profile_fetches(wh, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(wh, "schedule_profile_fetch", scheduled.append)
+    return scheduled
+
+
+def stored(wh):
+    rows = wh.session.query(wh.Message.user_id, wh.Message.message_type, wh.Message.text).order_by(wh.Message.id).all()
+    wh.session.rollback()
+    return [tuple(row) for row in rows]
+
+
+def test_non_text_messages_are_stored_with_their_type(wh, post_line, profile_fetches):
+    post_line(
+        message("sticker", 1, packageId="446", stickerId="1988", keywords=["happy", "ok"]),
+        message("location", 2, latitude=13.75, longitude=100.5, title="Siam", address="Bangkok"),
+        event("postback", n=3, postback={"data": "action=buy&sku=TEE-1"}),
+        message("file", 4, fileName="slip.pdf"),
+    )
+    assert stored(wh) == [
+        ("U1", "sticker", "[sticker 446/1988] happy, ok"),
+        ("U1", "location", "[location 13.75,100.5] Siam Bangkok"),
+        ("U1", "postback", "action=buy&sku=TEE-1"),
+        ("U1", "file", "[file 4 slip.pdf]"),
+    ]
+    assert wh.session.query(wh.UserDailyActivity.messages).scalar() == 4
+    wh.session.rollback()
+
+
+def test_follow_and_unfollow_track_the_profile_status(wh, post_line, profile_fetches):
+    post_line(event("follow", n=1))
+    profile = wh.session.query(wh.UserProfile).filter_by(user_id="U1").one()
+    assert (profile.status, profile.display_name) == ("active", None)
+    assert profile_fetches == ["U1"]
+    wh.session.rollback()
+
+    post_line(event("unfollow", n=2))
+    profile = wh.session.query(wh.UserProfile).filter_by(user_id="U1").one()
+    assert profile.status == "unfollowed"
+    assert profile.status_changed_at == datetime.fromtimestamp(1735725600)
+    wh.session.rollback()
+
+
+def test_unhandled_and_group_events_are_ignored_without_dead_lettering(wh, post_line, profile_fetches):
+    post_line(event("beacon", n=1, beacon={"type": "enter"}), message("text", 2, user_id=None, text="hi in a group"),
+              message("text", 3, text="hi"))
+    assert stored(wh) == [("U1", "text", "hi")]
+    assert wh.session.query(wh.DeadLetterEvent).count() == 0
+    wh.session.rollback()
+    metrics = wh.event_handler_metrics()
+    assert metrics["unhandled:beacon/None"]["count"] >= 1
+    assert metrics["unsupported_source:group"]["count"] >= 1
+    assert metrics["handle_text_message"]["count"] >= 1
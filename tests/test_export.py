@@ -0,0 +1,64 @@
+import csv
+import io
+import gzip
+import json
+from datetime import datetime
+
+ADMIN_HEADERS = {"Authorization": "Bearer test-admin-token"}
+ITEMS = [{"name": "Tee", "sku": "TEE-1", "quantity": 2, "price": 50.0}, {"name": "Cap", "sku": "CAP-1", "quantity": 1, "price": 30.0}]
+
+
+def export(wh, kind, status=200, **params):
+    response = wh.app.test_client().get(f"/export/{kind}", query_string=params, headers=ADMIN_HEADERS)
+    assert response.status_code == status
+    return response
+
+
+def add_orders(wh):
+    wh.ingest_myshop_order({"orderNumber": "100001", "orderStatus": "CREATED", "totalPrice": 130.0, "orderItems": ITEMS,
+                            "event": {"name": "ORDER_CREATED", "timestamp": "2025-01-01T10:00:00.000Z"}})
+    wh.ingest_myshop_order({"orderNumber": "100002", "orderStatus": "CREATED", "totalPrice": 0.0,
+                            "event": {"name": "ORDER_CREATED", "timestamp": "2025-01-01T11:00:00.000Z"}})
+
+
+def test_messages_stream_as_ndjson_within_the_date_range(wh):
+    wh.session.add_all([wh.Message(date=datetime(2025, 1, day), text=f"ข้อความ {day}", user_id="U1") for day in (1, 2, 3)])
+    wh.session.commit()
+    response = export(wh, "messages", since="2025-01-02", until="2025-01-03")
+    assert response.mimetype == "application/x-ndjson"
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [(r["date"], r["text"]) for r in records] == [("2025-01-02T00:00:00", "ข้อความ 2")]
+
+
+def test_orders_csv_has_one_line_per_item_and_keeps_orders_without_items(wh):
+    add_orders(wh)
+    rows = list(csv.DictReader(io.StringIO(export(wh, "orders", format="csv").get_data(as_text=True))))
+    assert [(r["order_number"], r["item_sku"], r["item_quantity"]) for r in rows] == [
+        ("100001", "TEE-1", "2"), ("100001", "CAP-1", "1"), ("100002", "", ""),
+    ]
+
+
+def test_orders_ndjson_nests_the_items(wh):
+    add_orders(wh)
+    records = [json.loads(line) for line in export(wh, "orders").get_data(as_text=True).splitlines()]
+    assert [(r["order_number"], [item["sku"] for item in r["items"]]) for r in records] == [
+        ("100001", ["TEE-1", "CAP-1"]), ("100002", []),
+    ]
+
+
+def test_gzip_stream_matches_the_plain_export_across_chunks(wh):
+    wh.session.add_all([wh.Message(date=datetime(2025, 1, 1), text=f"สวัสดี {n}", user_id="U1") for n in range(500)])
+    wh.session.commit()
+    plain = b"".join(wh.export_chunks("messages", "csv", chunk_size=1024))
+    chunks = list(wh.export_chunks("messages", "csv", compress=True, chunk_size=1024))
+    assert len(chunks) > 1
+    assert gzip.decompress(b"".join(chunks)) == plain
+    assert len(plain.decode().splitlines()) == 501
+
+    response = export(wh, "messages", format="csv", gzip="true")
+    assert response.headers["Content-Disposition"] == 'attachment; filename="messages.csv.gz"'
+    assert gzip.decompress(response.get_data()) == plain
+
+
+def test_unknown_format_is_rejected(wh):
+    export(wh, "messages", status=400, format="xlsx")
@@ -0,0 +1,55 @@
+import threading
+import time
+
+from keyed_executor import KeyedExecutor
+
+
+def text_event(user_id, text, n):
+    return {"type": "message", "timestamp": 1735725600000 + n, "webhookEventId": f"E{user_id}{n}",
+            "source": {"type": "user", "userId": user_id}, "message": {"type": "text", "id": str(n), "text": text}}
+
+
+def test_one_keys_tasks_run_in_order_while_other_keys_go_ahead():
+    executor = KeyedExecutor(lanes=4)
+    done = []
+    release = threading.Event()
+
+    def task(label, wait=False):
+        if wait:
+            release.wait(5)
+        done.append(label)
+
+    other_key = next(key for key in ("U2", "U3", "U4", "U5") if executor.home_lane(key) != executor.home_lane("U1"))
+    first = executor.submit("U1", task, "U1-1", True)
+    second = executor.submit("U1", task, "U1-2")
+    other = executor.submit(other_key, task, "other")
+    other.result(5)
+    assert done == ["other"]
+    release.set()
+    first.result(5), second.result(5)
+    assert done == ["other", "U1-1", "U1-2"]
+    executor.shutdown()
+
+
+def test_key_is_not_moved_off_its_lane_while_it_has_pending_tasks():
+    executor = KeyedExecutor(lanes=2, hot_min_depth=1)
+    order = []
+
+    def task(n):
+        time.sleep(0.001)
+        order.append(n)
+
+    futures = [executor.submit("U1", task, n) for n in range(50)]
+    for future in futures:
+        future.result(5)
+    assert order == list(range(50))
+    executor.shutdown()
+
+
+def test_webhook_stores_each_users_messages_in_the_order_sent(wh, post_line):
+    events = [text_event(user, f"{user}-{n}", n) for n in range(10) for user in ("U1", "U2", "U3")]
+    post_line(*events)
+    for user in ("U1", "U2", "U3"):
+        texts = [row[0] for row in wh.session.query(wh.Message.text).filter_by(user_id=user).order_by(wh.Message.id)]
+        assert texts == [f"{user}-{n}" for n in range(10)]
+    wh.session.rollback()
@@ -0,0 +1,115 @@
+import os
+
+import pytest
+
+from media_store import ContentStore
+
+ADMIN_HEADERS = {"Authorization": "Bearer test-admin-token"}
+
+
+class FakeResponse:
+    def __init__(self, status_code, content, content_type):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {"Content-Type": content_type}
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def content(wh, tmp_path, monkeypatch):
+    # url -> (status, body) the content endpoint answers with; requests made are recorded
+    responses = {}
+    requested = []
+
+    def get(url, headers=None, stream=False, timeout=None):
+        requested.append((url, headers))
+        status, body = responses.get(url, (404, b""))
+        return FakeResponse(status, body, "image/jpeg")
+
+    monkeypatch.setattr(wh, "media_store", ContentStore(str(tmp_path)))
+    monkeypatch.setattr(wh.requests, "get", get)
+    return responses, requested
+
+
+def image_event(n, provider=None):
+    message = {"type": "image", "id": f"m{n}", "contentProvider": provider or {"type": "line"}}
+    return {"type": "message", "timestamp": 1735725600000 + n, "webhookEventId": f"E{n}",
+            "source": {"type": "user", "userId": "U1"}, "message": message}
+
+
+def line_url(wh, n):
+    return f"{wh.LINE_DATA_API_BASE_URL}/v2/bot/message/m{n}/content"
+
+
+def media_rows(wh):
+    rows = wh.session.query(wh.Media).order_by(wh.Media.id).all()
+    wh.session.rollback()
+    return rows
+
+
+def test_downloaded_content_is_stored_once_and_served(wh, post_line, content):
+    responses, requested = content
+    responses[line_url(wh, 1)] = responses[line_url(wh, 2)] = (200, b"\xff\xd8 jpeg bytes" * 10000)
+    post_line(image_event(1), image_event(2))
+    first, second = media_rows(wh)
+    assert (first.status, second.status) == ("pending", "pending")
+
+    wh.download_media(first.id)
+    wh.download_media(second.id)
+    first, second = media_rows(wh)
+    assert (first.status, second.status) == ("stored", "stored")
+    assert first.sha256 == second.sha256 and first.size == 130000
+    assert requested[0][1] == {"Authorization": f"Bearer {wh.LINE_ACCESS_TOKEN}"}
+    blobs = [name for _, _, names in os.walk(wh.media_store.directory) for name in names]
+    assert blobs == [first.sha256]
+
+    response = wh.app.test_client().get(f"/media/{first.id}", headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    assert (response.mimetype, response.data) == ("image/jpeg", b"\xff\xd8 jpeg bytes" * 10000)
+
+
+def test_failed_download_is_kept_for_a_retry(wh, post_line, content):
+    responses, requested = content
+    post_line(image_event(1))
+    [media] = media_rows(wh)
+    with pytest.raises(RuntimeError):
+        wh.download_media(media.id)
+    [media] = media_rows(wh)
+    assert (media.status, media.attempts, media.last_error) == ("failed", 1, "content endpoint returned 404")
+    assert wh.app.test_client().get(f"/media/{media.id}", headers=ADMIN_HEADERS).status_code == 404
+
+    responses[line_url(wh, 1)] = (200, b"jpeg")
+    result = wh.app.test_cli_runner().invoke(args=["media", "retry"])
+    assert "Stored 1 of 1" in result.output
+    [media] = media_rows(wh)
+    assert (media.status, media.attempts, media.last_error) == ("stored", 2, None)
+
+
+def test_oversized_content_is_rejected_without_leaving_a_file(wh, post_line, content, monkeypatch):
+    responses, requested = content
+    monkeypatch.setattr(wh, "MEDIA_MAX_MB", 1)
+    responses[line_url(wh, 1)] = (200, b"x" * (1024 * 1024 + 1))
+    post_line(image_event(1))
+    [media] = media_rows(wh)
+    with pytest.raises(ValueError):
+        wh.download_media(media.id)
+    assert media_rows(wh)[0].status == "failed"
+    assert [name for _, _, names in os.walk(wh.media_store.directory) for name in names] == []
+
+
+def test_external_content_is_fetched_from_its_own_url_without_the_token(wh, post_line, content):
+    responses, requested = content
+    responses["https://cdn.example.com/a.jpg"] = (200, b"jpeg")
+    post_line(image_event(1, {"type": "external", "originalContentUrl": "https://cdn.example.com/a.jpg"}))
+    wh.download_media(media_rows(wh)[0].id)
+    assert requested == [("https://cdn.example.com/a.jpg", {})]
+    assert media_rows(wh)[0].status == "stored"
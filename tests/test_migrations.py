@@ -0,0 +1,179 @@
+import threading
+from datetime import datetime
+
+import pytest
+from sqlalchemy import MetaData, Table, Column, Integer, String, Text, Float, Boolean, DateTime, create_engine, event, inspect, select
+
+# The tables as the first release created them: no status/fetched_at, no event_time, raw_data inline
+LEGACY = MetaData()
+Table("messages", LEGACY, Column("id", Integer, primary_key=True), Column("date", DateTime, nullable=False),
+      Column("text", Text, nullable=False), Column("user_id", String, nullable=False))
+Table("user_profiles", LEGACY, Column("id", Integer, primary_key=True),
+      Column("user_id", String, unique=True, nullable=False), Column("display_name", String))
+Table("line_myshop_orders", LEGACY, Column("id", Integer, primary_key=True), Column("order_number", String, nullable=False),
+      Column("order_status", String), Column("event_name", String), Column("event_timestamp", String),
+      Column("total_price", Float), Column("is_cod", Boolean), Column("raw_data", Text), Column("date", DateTime))
+
+
+@pytest.fixture
+def legacy(wh, tmp_path, monkeypatch):
+    # A legacy database with rows in it, swapped in as the webhook engine
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    LEGACY.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(LEGACY.tables["messages"].insert(), [{"date": datetime(2024, 1, 1), "text": "hi", "user_id": "U1"}])
+        conn.execute(LEGACY.tables["user_profiles"].insert(), [{"user_id": "U1", "display_name": "Somchai"}])
+        conn.execute(LEGACY.tables["line_myshop_orders"].insert(), [
+            {"order_number": "A1", "order_status": "PAID", "total_price": 100.0, "raw_data": "{}", "date": datetime(2024, 1, 2)},
+        ])
+    monkeypatch.setattr(wh, "engine", engine)
+    wh.create_tables()
+    yield engine
+    engine.dispose()
+
+
+def table_names(engine):
+    return set(inspect(engine).get_table_names())
+
+
+def test_failed_rebuild_rolls_back_and_can_be_rerun(wh, legacy):
+    def crash_before_rename(conn, cursor, statement, *args):
+        if "RENAME TO line_myshop_orders" in statement:
+            raise RuntimeError("worker killed between DROP and RENAME")
+
+    event.listen(legacy, "before_cursor_execute", crash_before_rename)
+    with pytest.raises(RuntimeError):
+        wh.migrate_schema()
+    event.remove(legacy, "before_cursor_execute", crash_before_rename)
+
+    assert "line_myshop_orders" in table_names(legacy)
+    assert "line_myshop_orders_rebuild" not in table_names(legacy)
+    with legacy.connect() as conn:
+        assert conn.execute(select(LEGACY.tables["line_myshop_orders"].c.order_number)).scalars().all() == ["A1"]
+
+    assert wh.migrate_schema()
+    assert wh.pending_migrations() == []
+    with legacy.connect() as conn:
+        row = conn.execute(select(wh.LineMyShopOrder.__table__)).mappings().one()
+    assert (row["order_number"], row["total_price"], row["date"]) == ("A1", 100.0, datetime(2024, 1, 2))
+
+
+def test_rebuild_leftover_from_an_old_crash_is_replaced(wh, legacy):
+    with legacy.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE line_myshop_orders_rebuild (id INTEGER PRIMARY KEY)")
+    wh.migrate_schema()
+    assert "line_myshop_orders_rebuild" not in table_names(legacy)
+    assert wh.pending_migrations() == []
+
+
+def test_rebuild_refuses_to_run_outside_a_transaction(wh, legacy):
+    with legacy.connect() as conn:
+        with pytest.raises(RuntimeError):
+            wh.rebuild_sqlite_table(conn, wh.LineMyShopOrder.__table__)
+    assert "line_myshop_orders" in table_names(legacy)
+
+
+def test_pending_changes_are_reported_not_applied(wh, legacy):
+    pending = wh.pending_migrations()
+    assert "add column user_profiles.fetched_at" in pending
+    assert "add column line_myshop_orders.event_time" in pending
+    columns = {column["name"] for column in inspect(legacy).get_columns("user_profiles")}
+    assert "fetched_at" not in columns
+
+
+def test_concurrent_migrations_apply_each_change_once(wh, legacy):
+    errors = []
+
+    def run():
+        try:
+            wh.create_tables()
+            wh.migrate_schema()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert wh.pending_migrations() == []
+
+
+def test_added_columns_are_not_null_only_where_the_model_says(wh, legacy):
+    wh.migrate_schema()
+    columns = {column["name"]: column for column in inspect(legacy).get_columns("user_profiles")}
+    assert columns["status"]["nullable"] is False
+    assert columns["fetched_at"]["nullable"] is True
+    with legacy.connect() as conn:
+        assert conn.execute(select(wh.UserProfile.status)).scalar() == "active"
+        assert conn.execute(select(wh.Message.message_type)).scalar() == "text"
+
+
+def test_duplicate_order_rows_are_merged_before_the_unique_index(wh, legacy):
+    orders = LEGACY.tables["line_myshop_orders"]
+    with legacy.begin() as conn:
+        # Every event used to append a row; the first A1 row came from the fixture
+        conn.execute(orders.insert(), [
+            {"order_number": "A1", "order_status": "SHIPPED", "total_price": 100.0, "raw_data": "{'orderStatus': 'SHIPPED'}",
+             "date": datetime(2024, 1, 3)},
+            {"order_number": "B2", "order_status": "PAID", "total_price": 5.0, "raw_data": "{}", "date": datetime(2024, 1, 3)},
+        ])
+    with pytest.raises(RuntimeError, match="move-raw-data"):
+        wh.migrate_schema()
+
+    assert wh.move_raw_data() == 3
+    with legacy.begin() as conn:
+        conn.execute(wh.LineMyShopOrderItem.__table__.insert(), [
+            {"order_id": 1, "sku": "OLD"}, {"order_id": 2, "sku": "NEW"},
+        ])
+    assert "merge 1 superseded line_myshop_orders row(s) into the newest row of their order" in wh.pending_migrations()
+    wh.migrate_schema()
+    assert wh.pending_migrations() == []
+
+    with legacy.connect() as conn:
+        assert conn.execute(select(wh.LineMyShopOrder.id, wh.LineMyShopOrder.order_status)
+                            .order_by(wh.LineMyShopOrder.id)).all() == [(2, "SHIPPED"), (3, "PAID")]
+        assert conn.execute(select(wh.LineMyShopOrderPayload.order_id)
+                            .order_by(wh.LineMyShopOrderPayload.id)).scalars().all() == [2, 2, 3]
+        assert conn.execute(select(wh.LineMyShopOrderItem.sku)).scalars().all() == ["NEW"]
+    unique = {index["name"]: index["unique"] for index in inspect(legacy).get_indexes("line_myshop_orders")}
+    assert unique["uq_line_myshop_orders_order_number"]
+    assert "ix_line_myshop_orders_order_number" not in unique
+
+
+def test_index_only_the_admin_conversation_used_is_dropped(wh, legacy):
+    with legacy.begin() as conn:
+        conn.exec_driver_sql("CREATE INDEX ix_admin_messages_user_date_id ON admin_messages (user_id, date, id)")
+    assert "drop index ix_admin_messages_user_date_id" in wh.pending_migrations()
+    wh.migrate_schema()
+    assert not inspect(legacy).has_index("admin_messages", "ix_admin_messages_user_date_id")
+
+
+def test_raw_data_moves_to_compressed_payloads_in_batches(wh, legacy):
+    orders = LEGACY.tables["line_myshop_orders"]
+    with legacy.begin() as conn:
+        conn.execute(orders.update().values(raw_data="{'orderStatus': 'PAID', 'note': 'ส่งด่วน'}", event_name="ORDER_PAID",
+                                            event_timestamp="2024-01-02T10:00:00.000Z"))
+        conn.execute(orders.insert(), [
+            {"order_number": "B2", "raw_data": "not a dict", "date": datetime(2024, 1, 3)},
+            {"order_number": "C3", "raw_data": None, "date": datetime(2024, 1, 4)},
+            {"order_number": "D4", "raw_data": "{}", "date": datetime(2024, 1, 5)},
+        ])
+        # A run that died part way already copied D4
+        conn.execute(wh.LineMyShopOrderPayload.__table__.insert(), [
+            {"order_id": 4, "received_at": datetime(2024, 1, 5), "payload": wh.compress_payload({"copied": True})},
+        ])
+
+    assert wh.move_raw_data(batch_size=1) == 2
+    assert "raw_data" not in {column["name"] for column in inspect(legacy).get_columns("line_myshop_orders")}
+    assert wh.move_raw_data() == 0
+    payload = wh.LineMyShopOrderPayload
+    with legacy.connect() as conn:
+        rows = conn.execute(select(payload.order_id, payload.event_name, payload.event_timestamp, payload.received_at,
+                                   payload.payload).order_by(payload.order_id)).all()
+    assert [row[:4] + (wh.decompress_payload(row[4]),) for row in rows] == [
+        (1, "ORDER_PAID", "2024-01-02T10:00:00.000Z", datetime(2024, 1, 2), {"orderStatus": "PAID", "note": "ส่งด่วน"}),
+        (2, None, None, datetime(2024, 1, 3), {"raw_data": "not a dict"}),
+        (4, None, None, datetime(2024, 1, 5), {"copied": True}),
+    ]
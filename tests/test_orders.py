@@ -0,0 +1,213 @@
+import hmac
+import json
+import hashlib
+
+ADDRESS = {"recipientName": "คุณสมชาย", "phoneNumber": "0812345678", "address": "Bangkok 10110"}
+ITEMS = [{"name": "Tee", "sku": "TEE-1", "quantity": 2, "price": 50.0, "discountedPrice": 45.0}]
+
+
+def order_event(status, timestamp, number="100001", **fields):
+    return dict({"orderNumber": number, "orderStatus": status,
+                 "event": {"name": "ORDER_STATUS_CHANGED", "timestamp": timestamp}}, **fields)
+
+
+def created(timestamp="2025-01-01T10:00:00.000Z", number="100001"):
+    return order_event("CREATED", timestamp, number, totalPrice=100.0, subtotalPrice=90.0, shipmentPrice=10.0,
+                       shippingAddress=ADDRESS, orderItems=ITEMS)
+
+
+def post_myshop(wh, payload):
+    body = json.dumps(payload, ensure_ascii=False)
+    signature = hmac.new(wh.LINESHOP_KEY.encode(), body.encode(), hashlib.sha256).hexdigest()
+    response = wh.app.test_client().post("/sassy-line-myshop-webhook", data=body.encode(),
+                                         headers={"x-myshop-signature": signature, "Content-Type": "application/json"})
+    assert response.status_code == 200
+
+
+def status_rollup(wh):
+    rows = wh.session.query(wh.SalesDailyStatus).all()
+    wh.session.rollback()
+    return {(r.day.isoformat(), r.order_status): (r.orders, r.revenue) for r in rows if r.orders or r.revenue}
+
+
+def sku_rollup(wh):
+    rows = wh.session.query(wh.SalesDailySku).all()
+    wh.session.rollback()
+    return {(r.day.isoformat(), r.sku): (r.units, r.revenue) for r in rows if r.units or r.revenue}
+
+
+def the_order(wh, number="100001"):
+    order = wh.session.query(wh.LineMyShopOrder).filter_by(order_number=number).one()
+    wh.session.refresh(order)
+    return order
+
+
+def assert_matches_rebuild(wh):
+    # The incremental rollups must agree with a full recompute from the orders
+    incremental = status_rollup(wh), sku_rollup(wh)
+    wh.rebuild_rollups()
+    assert (status_rollup(wh), sku_rollup(wh)) == incremental
+
+
+def test_new_order_is_stored_with_items_payload_and_rollups(wh):
+    post_myshop(wh, created())
+    order = the_order(wh)
+    assert (order.order_status, order.total_price, order.recipient_name) == ("CREATED", 100.0, "คุณสมชาย")
+    assert [(item.sku, item.quantity) for item in order.items] == [("TEE-1", 2)]
+    assert [wh.decompress_payload(p.payload)["orderStatus"] for p in order.payloads] == ["CREATED"]
+    assert status_rollup(wh) == {("2025-01-01", "CREATED"): (1, 100.0)}
+    assert sku_rollup(wh) == {("2025-01-01", "TEE-1"): (2, 90.0)}
+    assert_matches_rebuild(wh)
+
+
+def test_status_only_event_keeps_totals_address_and_items(wh):
+    post_myshop(wh, created())
+    post_myshop(wh, order_event("SHIPPED", "2025-01-01T12:00:00.000Z",
+                                shipmentDetail={"trackingNumber": "TH123", "shipmentCompanyNameTh": "ไปรษณีย์ไทย"}))
+    order = the_order(wh)
+    assert (order.order_status, order.total_price, order.subtotal_price, order.shipment_price) == ("SHIPPED", 100.0, 90.0, 10.0)
+    assert (order.recipient_name, order.phone_number, order.address) == ("คุณสมชาย", "0812345678", "Bangkok 10110")
+    assert order.tracking_number == "TH123"
+    assert len(order.items) == 1
+    assert status_rollup(wh) == {("2025-01-01", "SHIPPED"): (1, 100.0)}
+    assert sku_rollup(wh) == {("2025-01-01", "TEE-1"): (2, 90.0)}
+    assert_matches_rebuild(wh)
+
+
+def test_status_change_on_a_later_day_keeps_the_order_on_its_first_day(wh):
+    post_myshop(wh, created("2025-01-01T10:00:00.000Z"))
+    post_myshop(wh, order_event("SHIPPED", "2025-01-03T10:00:00.000Z"))
+    assert the_order(wh).first_event_time.date().isoformat() == "2025-01-01"
+    assert status_rollup(wh) == {("2025-01-01", "SHIPPED"): (1, 100.0)}
+    assert sku_rollup(wh) == {("2025-01-01", "TEE-1"): (2, 90.0)}
+    assert_matches_rebuild(wh)
+
+
+def test_event_with_new_items_replaces_them(wh):
+    post_myshop(wh, created())
+    post_myshop(wh, order_event("PAID", "2025-01-01T11:00:00.000Z", totalPrice=60.0,
+                                orderItems=[{"sku": "CAP-1", "quantity": 1, "price": 60.0}]))
+    order = the_order(wh)
+    assert [(item.sku, item.quantity) for item in order.items] == [("CAP-1", 1)]
+    assert status_rollup(wh) == {("2025-01-01", "PAID"): (1, 60.0)}
+    assert sku_rollup(wh) == {("2025-01-01", "CAP-1"): (1, 60.0)}
+    assert_matches_rebuild(wh)
+
+
+def test_cancelled_order_leaves_the_sku_rollup(wh):
+    post_myshop(wh, created())
+    post_myshop(wh, order_event("CANCELLED", "2025-01-01T11:00:00.000Z"))
+    assert status_rollup(wh) == {("2025-01-01", "CANCELLED"): (1, 100.0)}
+    assert sku_rollup(wh) == {}
+    assert_matches_rebuild(wh)
+
+
+def test_late_older_event_does_not_move_the_order_back(wh):
+    post_myshop(wh, created("2025-01-01T10:00:00.000Z"))
+    post_myshop(wh, order_event("SHIPPED", "2025-01-03T10:00:00.000Z"))
+    post_myshop(wh, order_event("PAID", "2025-01-02T10:00:00.000Z", totalPrice=80.0))
+    order = the_order(wh)
+    assert (order.order_status, order.total_price, order.event_timestamp) == ("SHIPPED", 100.0, "2025-01-03T10:00:00.000Z")
+    assert {status for _, status in status_rollup(wh)} == {"SHIPPED"}
+    assert [p.event_timestamp for p in order.payloads][-1] == "2025-01-02T10:00:00.000Z"
+    assert_matches_rebuild(wh)
+
+
+def test_late_event_fills_in_what_the_order_lacks(wh):
+    # The status change arrived first; the CREATED event with the details comes in late
+    post_myshop(wh, order_event("SHIPPED", "2025-01-03T10:00:00.000Z"))
+    post_myshop(wh, created("2025-01-01T10:00:00.000Z"))
+    order = the_order(wh)
+    assert (order.order_status, order.total_price, order.recipient_name) == ("SHIPPED", 100.0, "คุณสมชาย")
+    assert [item.sku for item in order.items] == ["TEE-1"]
+    assert status_rollup(wh) == {("2025-01-01", "SHIPPED"): (1, 100.0)}
+    assert_matches_rebuild(wh)
+
+
+def test_redelivered_event_changes_nothing(wh):
+    post_myshop(wh, created())
+    post_myshop(wh, order_event("SHIPPED", "2025-01-02T10:00:00.000Z"))
+    post_myshop(wh, order_event("SHIPPED", "2025-01-02T10:00:00.000Z"))
+    assert the_order(wh).order_status == "SHIPPED"
+    assert {status: values for (_, status), values in status_rollup(wh).items()} == {"SHIPPED": (1, 100.0)}
+    assert_matches_rebuild(wh)
+
+
+def test_losing_the_insert_race_updates_the_winners_row(wh, monkeypatch):
+    # Both workers looked the order up before either inserted it; the first one has committed already
+    post_myshop(wh, created())
+    lookups = []
+
+    def lock_order_too_early(order_number):
+        lookups.append(order_number)
+        return None if len(lookups) == 1 else wh.session.query(wh.LineMyShopOrder).filter_by(order_number=order_number).first()
+
+    monkeypatch.setattr(wh, "lock_order", lock_order_too_early)
+    post_myshop(wh, order_event("PAID", "2025-01-01T11:00:00.000Z"))
+    assert len(lookups) == 2
+    assert wh.session.query(wh.LineMyShopOrder).count() == 1
+    assert the_order(wh).order_status == "PAID"
+    assert status_rollup(wh) == {("2025-01-01", "PAID"): (1, 100.0)}
+    assert wh.session.query(wh.DeadLetterEvent).count() == 0
+    assert_matches_rebuild(wh)
+
+
+def orders_in_range(wh, **params):
+    response = wh.app.test_client().get("/orders", query_string=params, headers={"Authorization": "Bearer test-admin-token"})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_range_query_filters_on_the_event_time_in_utc(wh):
+    post_myshop(wh, created("2025-01-01T23:30:00.000Z", number="A"))
+    post_myshop(wh, created("2025-01-02T06:30:00+07:00", number="B"))  # 2025-01-01T23:30Z
+    post_myshop(wh, created("1735776000000", number="C"))  # epoch ms, 2025-01-02T00:00Z
+    post_myshop(wh, order_event("PAID", "2025-01-02T01:00:00.000Z", number="A"))  # A moves to its latest event
+
+    page = orders_in_range(wh, **{"from": "2025-01-01T00:00:00+00:00", "to": "2025-01-02T00:00:00+00:00"})
+    assert [(o["order_number"], o["event_time"]) for o in page["orders"]] == [("B", "2025-01-01T23:30:00+00:00")]
+    page = orders_in_range(wh, **{"from": "2025-01-02T07:00:00+07:00", "to": "2025-01-03T00:00:00"})
+    assert [o["order_number"] for o in page["orders"]] == ["C", "A"]
+    page = orders_in_range(wh, **{"from": "2025-01-01", "to": "2025-01-03", "status": "PAID"})
+    assert [o["order_number"] for o in page["orders"]] == ["A"]
+
+
+def test_range_query_pages_with_a_cursor(wh):
+    for n in range(5):
+        post_myshop(wh, created(f"2025-01-01T1{n}:00:00.000Z", number=f"N{n}"))
+    numbers, cursor = [], None
+    while True:
+        page = orders_in_range(wh, **{"from": "2025-01-01", "to": "2025-01-02", "limit": 2}, **({"cursor": cursor} if cursor else {}))
+        numbers.append([o["order_number"] for o in page["orders"]])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert numbers == [["N0", "N1"], ["N2", "N3"], ["N4"]]
+
+
+def test_backfill_parses_event_times_stored_before_the_column(wh):
+    post_myshop(wh, created("2025-01-02T10:00:00.000Z"))
+    wh.session.query(wh.LineMyShopOrder).update({"event_time": None, "first_event_time": None})
+    wh.session.commit()
+    assert orders_in_range(wh, **{"from": "2025-01-01", "to": "2025-01-03"})["orders"] == []
+
+    assert wh.backfill_event_times(batch_size=1) == 1
+    order = the_order(wh)
+    assert (wh.to_utc(order.event_time), wh.to_utc(order.first_event_time)) == (
+        wh.parse_event_time("2025-01-02T10:00:00Z"), wh.parse_event_time("2025-01-02T10:00:00Z"))
+    assert [o["order_number"] for o in orders_in_range(wh, **{"from": "2025-01-01", "to": "2025-01-03"})["orders"]] == ["100001"]
+
+
+def test_sales_report_reads_the_rollups(wh):
+    post_myshop(wh, created("2025-01-01T10:00:00.000Z", number="A"))
+    post_myshop(wh, created("2025-01-02T10:00:00.000Z", number="B"))
+    post_myshop(wh, order_event("CANCELLED", "2025-01-02T11:00:00.000Z", number="B"))
+    response = wh.app.test_client().get("/reports/sales", query_string={"from": "2025-01-01", "to": "2025-01-02"},
+                                        headers={"Authorization": "Bearer test-admin-token"})
+    assert response.status_code == 200
+    report = response.get_json()
+    assert report["days"] == {
+        "2025-01-01": {"orders": 1, "revenue": 100.0, "by_status": {"CREATED": {"orders": 1, "revenue": 100.0}}},
+        "2025-01-02": {"orders": 1, "revenue": 100.0, "by_status": {"CANCELLED": {"orders": 1, "revenue": 100.0}}},
+    }
+    assert report["skus"] == [{"sku": "TEE-1", "units": 2, "revenue": 90.0}]
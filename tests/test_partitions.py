@@ -0,0 +1,35 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+
+import partitions
+
+
+def messages_table():
+    return Table(
+        "messages", MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("date", DateTime, nullable=False),
+        Column("text", String, nullable=False),
+    )
+
+
+def compile_ddl(table):
+    return str(CreateTable(table).compile(dialect=postgresql.dialect()))
+
+
+def test_reused_sequence_becomes_the_id_default():
+    ddl = compile_ddl(partitions.partitioned_table(messages_table(), sequence="messages_id_seq"))
+    assert "id INTEGER DEFAULT nextval('messages_id_seq') NOT NULL" in ddl
+    assert "SERIAL" not in ddl
+
+
+def test_new_table_gets_a_serial_id():
+    ddl = compile_ddl(partitions.partitioned_table(messages_table()))
+    assert "id SERIAL NOT NULL" in ddl
+
+
+def test_primary_key_includes_the_partition_key():
+    ddl = compile_ddl(partitions.partitioned_table(messages_table(), sequence="messages_id_seq"))
+    assert "CONSTRAINT messages_pkey PRIMARY KEY (id, date)" in ddl
+    assert "PARTITION BY RANGE (date)" in ddl
@@ -0,0 +1,168 @@
+from datetime import datetime, timedelta
+
+import pytest
+import requests
+
+from ratelimit import RateLimiter
+
+
+@pytest.fixture
+def line_profiles(wh, monkeypatch):
+    # user id -> display name; an Exception instance makes the fetch raise, None is LINE's 404
+    profiles = {}
+    fetched = []
+
+    def fetch_line_profile(user_id):
+        fetched.append(user_id)
+        profile = profiles.get(user_id)
+        if isinstance(profile, Exception):
+            raise profile
+        return {"displayName": profile} if profile else None
+
+    monkeypatch.setattr(wh, "fetch_line_profile", fetch_line_profile)
+    return profiles, fetched
+
+
+def add_profiles(wh, *user_ids, **fields):
+    for user_id in user_ids:
+        wh.session.add(wh.UserProfile(user_id=user_id, **fields))
+    wh.session.commit()
+
+
+def the_profile(wh, user_id):
+    profile = wh.session.query(wh.UserProfile).filter_by(user_id=user_id).one()
+    wh.session.refresh(profile)
+    return profile
+
+
+def refresh(wh):
+    return wh.refresh_stale_profiles(limit=10, limiter=RateLimiter(1000))
+
+
+def test_claiming_takes_a_lease_without_marking_the_profile_fresh(wh):
+    add_profiles(wh, "U1", "U2")
+    assert wh.claim_stale_profiles(10) == ["U1", "U2"]
+    profile = the_profile(wh, "U1")
+    assert profile.fetched_at is None
+    assert profile.refresh_claimed_at is not None
+    # A second worker skips the leased rows
+    assert wh.claim_stale_profiles(10) == []
+
+
+def test_failed_refresh_is_retried_once_its_lease_expires(wh, line_profiles, monkeypatch):
+    profiles, fetched = line_profiles
+    profiles.update({"U1": "Somchai", "U2": RuntimeError("LINE is down")})
+    add_profiles(wh, "U1", "U2")
+    assert refresh(wh) == (1, 0, 1)
+
+    assert (the_profile(wh, "U1").display_name, the_profile(wh, "U1").refresh_claimed_at) == ("Somchai", None)
+    assert the_profile(wh, "U1").fetched_at is not None
+    failed = the_profile(wh, "U2")
+    assert failed.fetched_at is None
+    assert failed.refresh_claimed_at is not None
+
+    # Still leased: the next cycle leaves it alone
+    profiles["U2"] = "Malee"
+    assert refresh(wh) == (0, 0, 0)
+    monkeypatch.setattr(wh, "PROFILE_REFRESH_CLAIM_SECONDS", 0)
+    assert refresh(wh) == (1, 0, 0)
+    assert fetched == ["U1", "U2", "U2"]
+    assert the_profile(wh, "U2").display_name == "Malee"
+    assert the_profile(wh, "U2").fetched_at is not None
+
+
+def test_fresh_profiles_are_not_claimed_until_they_age(wh, monkeypatch):
+    add_profiles(wh, "U1", fetched_at=datetime.utcnow() - timedelta(days=1))
+    add_profiles(wh, "U2", fetched_at=datetime.utcnow() - timedelta(days=30))
+    assert wh.claim_stale_profiles(10) == ["U2"]
+
+
+def test_unreachable_profiles_are_released_and_not_claimed_again(wh, line_profiles):
+    add_profiles(wh, "U1")
+    assert refresh(wh) == (0, 1, 0)
+    profile = the_profile(wh, "U1")
+    assert (profile.status, profile.refresh_claimed_at) == ("unreachable", None)
+    assert wh.claim_stale_profiles(10) == []
+
+
+@pytest.fixture
+def scheduled(wh, monkeypatch):
+    calls = []
+    monkeypatch.setattr(wh, "schedule_profile_fetch", calls.append)
+    return calls
+
+
+def text_event(user_id, text="สวัสดี"):
+    return {"type": "message", "timestamp": 1735725600000, "source": {"type": "user", "userId": user_id},
+            "message": {"type": "text", "id": "1", "text": text}}
+
+
+def test_profile_without_a_name_is_fetched_again_on_the_next_message(wh, scheduled):
+    add_profiles(wh, "U1")
+    wh.handle_text_message(text_event("U1"))
+    wh.handle_text_message(text_event("U1"))
+    assert scheduled == ["U1", "U1"]
+
+    add_profiles(wh, "U2", display_name="Malee")
+    wh.handle_text_message(text_event("U2"))
+    wh.handle_text_message(text_event("U2"))
+    assert scheduled == ["U1", "U1"]
+
+
+def test_follow_leaves_the_user_unknown_until_the_name_arrives(wh, scheduled):
+    wh.handle_follow({"type": "follow", "timestamp": 1735725600000, "source": {"type": "user", "userId": "U1"}})
+    assert scheduled == ["U1"]
+    assert the_profile(wh, "U1").display_name is None
+    wh.handle_text_message(text_event("U1"))
+    assert scheduled == ["U1", "U1"]
+
+
+def test_background_fetch_retries_transient_errors(wh, line_profiles, monkeypatch):
+    profiles, fetched = line_profiles
+    errors = [requests.ConnectionError("reset by peer")]
+
+    def flaky(user_id):
+        if errors:
+            fetched.append(user_id)
+            raise errors.pop()
+        return {"displayName": "Somchai"}
+
+    monkeypatch.setattr(wh, "fetch_line_profile", flaky)
+    monkeypatch.setattr(wh.time, "sleep", lambda seconds: None)
+    wh.fetch_and_store_profile("U1")
+    assert fetched == ["U1"]
+    assert the_profile(wh, "U1").display_name == "Somchai"
+
+
+def test_background_fetch_failure_leaves_the_name_unknown(wh, line_profiles, scheduled, monkeypatch):
+    profiles, fetched = line_profiles
+    profiles["U1"] = ValueError("bad response")
+    add_profiles(wh, "U1")
+    wh.fetch_and_store_profile("U1")
+    assert the_profile(wh, "U1").display_name is None
+    wh.handle_text_message(text_event("U1"))
+    assert scheduled == ["U1"]
+
+
+def test_missing_profile_is_marked_unreachable_and_not_fetched_per_message(wh, line_profiles, scheduled):
+    add_profiles(wh, "U1")
+    wh.fetch_and_store_profile("U1")
+    assert the_profile(wh, "U1").status == "unreachable"
+    wh.handle_text_message(text_event("U1"))
+    assert scheduled == []
+
+
+def test_follower_backfill_fetches_only_unnamed_followers(wh, line_profiles, monkeypatch):
+    profiles, fetched = line_profiles
+    pages = {None: {"userIds": ["U1", "U2"], "next": "p2"}, "p2": {"userIds": ["U3", "U4", "U5"]}}
+    monkeypatch.setattr(wh, "fetch_follower_ids_page", lambda start: pages[start])
+    add_profiles(wh, "U1", display_name="Malee")
+    add_profiles(wh, "U3", "U4")
+    profiles.update({"U2": "Somchai", "U3": "Niran", "U5": ValueError("bad response")})
+
+    totals = wh.backfill_profiles(rate=1000, workers=2)
+    assert totals == {"followers": 5, "fetched": 2, "skipped": 1, "missing": 1, "failed": 1}
+    assert sorted(fetched) == ["U2", "U3", "U4", "U5"]
+    assert [the_profile(wh, user_id).display_name for user_id in ("U1", "U2", "U3")] == ["Malee", "Somchai", "Niran"]
+    assert the_profile(wh, "U4").status == "unreachable"
+    assert wh.session.query(wh.UserProfile).filter_by(user_id="U5").count() == 0
@@ -0,0 +1,58 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from querystats import QueryStats, normalize
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'stats.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE messages (id INTEGER PRIMARY KEY, user_id TEXT, text TEXT)"))
+    yield engine
+    engine.dispose()
+
+
+def run(engine, *statements):
+    with engine.begin() as conn:
+        for statement, params in statements:
+            conn.execute(text(statement), params)
+
+
+def test_literals_placeholders_and_lists_collapse_into_one_shape():
+    assert normalize("SELECT * FROM messages WHERE user_id = 'U1' AND id IN (1, 2, 3)") == \
+        normalize("SELECT * FROM messages WHERE user_id = 'U2' AND id IN (?, ?)") == \
+        "SELECT * FROM messages WHERE user_id = ? AND id IN (...)"
+    assert normalize("INSERT INTO t (a, b) VALUES (?, ?), (?, ?), (?, ?)") == "INSERT INTO t (a, b) VALUES (...)"
+
+
+def test_statements_are_counted_per_shape_and_slow_ones_can_be_explained(engine):
+    stats = QueryStats(slow_ms=0)
+    stats.attach(engine)
+    run(engine, *[("INSERT INTO messages (user_id, text) VALUES (:u, :t)", {"u": f"U{n}", "t": "hi"}) for n in range(3)],
+        ("SELECT text FROM messages WHERE user_id = :u", {"u": "U1"}))
+    rows = {row["statement"]: row for row in stats.report()["statements"]}
+    insert = rows["INSERT INTO messages (user_id, text) VALUES (...)"]
+    select = rows["SELECT text FROM messages WHERE user_id = ?"]
+    assert (insert["count"], insert["slow"], select["count"]) == (3, 3, 1)
+    assert sum(insert["buckets"]) == 3
+    assert [entry["fingerprint"] for entry in stats.report()["slow_log"]] == [insert["fingerprint"]] * 3 + [select["fingerprint"]]
+
+    plan = stats.explain(engine, select["fingerprint"])
+    assert any("messages" in str(step) for step in plan)
+    with pytest.raises(ValueError):
+        stats.explain(engine, insert["fingerprint"])
+    with pytest.raises(KeyError):
+        stats.explain(engine, "00000000")
+    # EXPLAIN runs are not measured themselves
+    assert {row["statement"] for row in stats.report()["statements"]} == set(rows)
+
+
+def test_fast_statements_are_not_logged_and_extra_shapes_share_one_row(engine):
+    stats = QueryStats(slow_ms=10000, max_statements=1)
+    stats.attach(engine)
+    run(engine, ("SELECT id FROM messages", {}), ("SELECT text FROM messages", {}), ("SELECT user_id FROM messages", {}))
+    report = stats.report()
+    assert report["slow_log"] == []
+    counts = {row["fingerprint"]: row["count"] for row in report["statements"]}
+    assert len(counts) == 2 and counts["other"] == 2
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+
+def text_event(user_id, text, n):
+    return {"type": "message", "timestamp": 1735725600000 + n, "webhookEventId": f"E{user_id}{n}",
+            "source": {"type": "user", "userId": user_id}, "message": {"type": "text", "id": str(n), "text": text}}
+
+
+def queue_rows(wh):
+    rows = [(row.status, row.attempts, row.locked_by) for row in wh.session.query(wh.InboundEvent).order_by(wh.InboundEvent.id)]
+    wh.session.rollback()
+    return rows
+
+
+def stored_texts(wh):
+    texts = sorted(row[0] for row in wh.session.query(wh.Message.text))
+    wh.session.rollback()
+    return texts
+
+
+def test_webhook_queues_events_and_a_worker_stores_them(wh, post_line, monkeypatch):
+    monkeypatch.setattr(wh, "INBOUND_QUEUE_ENABLED", True)
+    post_line(text_event("U1", "hi", 1), text_event("U2", "yo", 2))
+    assert stored_texts(wh) == []
+    assert queue_rows(wh) == [("pending", 0, None), ("pending", 0, None)]
+
+    assert wh.run_inbound_batch("w1", 10) == (2, 0)
+    assert stored_texts(wh) == ["hi", "yo"]
+    assert queue_rows(wh) == [("done", 1, "w1"), ("done", 1, "w1")]
+    assert wh.run_inbound_batch("w1", 10) == (0, 0)
+
+
+def test_failed_event_is_retried_later_then_marked_dead(wh, monkeypatch):
+    monkeypatch.setattr(wh, "INBOUND_MAX_ATTEMPTS", 2)
+    wh.enqueue_inbound("line", [{"type": "message", "source": {"type": "user", "userId": "U1"}}])  # no message body
+
+    assert wh.run_inbound_batch("w1", 10) == (1, 1)
+    row = wh.session.query(wh.InboundEvent).one()
+    assert (row.status, row.attempts) == ("pending", 1)
+    assert row.available_at > datetime.utcnow()
+    wh.session.rollback()
+    assert wh.run_inbound_batch("w1", 10) == (0, 0)  # not due yet
+
+    wh.session.query(wh.InboundEvent).update({"available_at": datetime.utcnow() - timedelta(seconds=1)})
+    wh.session.commit()
+    assert wh.run_inbound_batch("w1", 10) == (1, 1)
+    row = wh.session.query(wh.InboundEvent).one()
+    assert (row.status, row.attempts) == ("dead", 2)
+    assert row.last_error
+    wh.session.rollback()
+
+
+def test_expired_lease_is_taken_over_and_the_late_worker_is_ignored(wh):
+    wh.enqueue_inbound("line", [text_event("U1", "hi", 1)])
+    [(event_id, _, _, attempts)] = wh.claim_inbound_events("w1", 10)
+    assert wh.claim_inbound_events("w2", 10) == []  # leased to w1
+
+    wh.session.query(wh.InboundEvent).update({"locked_until": datetime.utcnow() - timedelta(seconds=1)})
+    wh.session.commit()
+    assert wh.run_inbound_batch("w2", 10) == (1, 0)
+    assert queue_rows(wh) == [("done", 2, "w2")]
+
+    # w1 comes back after its lease expired: its verdict must not overwrite w2's
+    wh.finish_inbound_event(event_id, "w1", attempts, error="worker crashed")
+    assert queue_rows(wh) == [("done", 2, "w2")]
+    assert stored_texts(wh) == ["hi"]
@@ -0,0 +1,81 @@
+import json
+from datetime import datetime
+
+import pytest
+
+import replay
+
+
+@pytest.fixture
+def run_replay(wh, tmp_path, monkeypatch):
+    # init_worker() points the environment at replay mode; undone after the test
+    for name in ("LINE_OUTBOUND_ENABLED", "INBOUND_QUEUE_ENABLED", "WEBHOOK_ARCHIVE_DIR"):
+        monkeypatch.setenv(name, "")
+
+    def run(source, payloads, *options):
+        path = tmp_path / f"{source}.ndjson"
+        path.write_text("".join(json.dumps(payload, ensure_ascii=False) + "\n" for payload in payloads))
+        return replay.main(["--source", source, "--workers", "1", *options, str(path)])
+
+    return run
+
+
+def line_payload(*events):
+    return {"destination": "Ubot", "events": list(events)}
+
+
+def text_event(event_id, text, user_id="U1"):
+    event = {"type": "message", "timestamp": 1735725600000, "source": {"type": "user", "userId": user_id},
+             "message": {"type": "text", "id": "m" + text, "text": text}}
+    if event_id:
+        event["webhookEventId"] = event_id
+    return event
+
+
+def shop_event(status, timestamp):
+    return {"orderNumber": "100001", "orderStatus": status, "totalPrice": 100.0,
+            "event": {"name": "ORDER_STATUS_CHANGED", "timestamp": timestamp}}
+
+
+def stored_texts(wh):
+    texts = sorted(row[0] for row in wh.session.query(wh.Message.text))
+    wh.session.rollback()
+    return texts
+
+
+def test_replaying_the_same_events_twice_stores_them_once(wh, run_replay):
+    events = [line_payload(text_event("E1", "hi"), text_event("E2", "bye")), line_payload(text_event("E1", "hi"))]
+    assert run_replay("line", events) == 0
+    assert run_replay("line", events) == 0
+    assert stored_texts(wh) == ["bye", "hi"]
+    assert wh.session.query(wh.UserDailyActivity.messages).scalar() == 2
+
+
+def test_events_the_webhook_already_stored_are_skipped(wh, run_replay):
+    wh.handle_text_message(text_event("E1", "hi"))
+    assert run_replay("line", [line_payload(text_event("E1", "hi"), text_event("E2", "new"))]) == 0
+    assert stored_texts(wh) == ["hi", "new"]
+
+
+def test_myshop_events_already_stored_are_skipped(wh, run_replay):
+    events = [shop_event("CREATED", "2025-01-01T10:00:00.000Z"), shop_event("PAID", "2025-01-01T11:00:00.000Z")]
+    assert run_replay("myshop", events) == 0
+    assert run_replay("myshop", events) == 0
+    assert wh.session.query(wh.LineMyShopOrderPayload).count() == 2
+    assert wh.session.query(wh.LineMyShopOrder.order_status).scalar() == "PAID"
+
+
+def test_messages_stored_without_an_event_id_need_allow_duplicates(wh, run_replay):
+    wh.session.add(wh.Message(date=datetime(2025, 1, 1), text="old", user_id="U1"))
+    wh.session.commit()
+    assert run_replay("line", [line_payload(text_event("E1", "hi"))]) == 2
+    assert stored_texts(wh) == ["old"]
+    assert run_replay("line", [line_payload(text_event("E1", "hi"))], "--allow-duplicates") == 0
+    assert stored_texts(wh) == ["hi", "old"]
+
+
+def test_events_without_an_id_need_allow_duplicates(wh, run_replay):
+    assert run_replay("line", [line_payload(text_event(None, "hi"))]) == 2
+    assert stored_texts(wh) == []
+    assert run_replay("line", [line_payload(text_event(None, "hi"))], "--allow-duplicates") == 0
+    assert stored_texts(wh) == ["hi"]
@@ -0,0 +1,98 @@
+import pytest
+
+from autoreply import AutoReplyEngine, KeywordAutomaton
+
+ADMIN_HEADERS = {"Authorization": "Bearer test-admin-token"}
+
+
+def text_event(user_id, text):
+    return {"type": "message", "timestamp": 1735725600000, "replyToken": "r", "source": {"type": "user", "userId": user_id},
+            "message": {"type": "text", "id": "1", "text": text}}
+
+
+@pytest.fixture
+def replies(wh, monkeypatch):
+    # (user id, text) of every reply the bot sends
+    sent = []
+    monkeypatch.setattr(wh, "reply_with_token", lambda token, user_id, text: sent.append((user_id, text)))
+    return sent
+
+
+def bot_log(wh):
+    rows = wh.session.query(wh.ChatGPTLog).order_by(wh.ChatGPTLog.id).all()
+    wh.session.rollback()
+    return [(row.user_id, row.prompt, row.response, row.source) for row in rows]
+
+
+def conversation(wh, user_id):
+    response = wh.app.test_client().get(f"/users/{user_id}/conversation", headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    return response.get_json()["items"]
+
+
+def test_auto_reply_is_kept_in_the_bot_log_and_the_conversation(wh, replies):
+    wh.session.add(wh.AutoReplyRule(keyword="ราคา", reply="ดูราคาได้ที่หน้าร้านค่ะ"))
+    wh.session.commit()
+    wh.auto_reply_engine.reload(force=True)
+
+    wh.handle_text_message(text_event("U1", "ขอราคาหน่อย"))
+    assert replies == [("U1", "ดูราคาได้ที่หน้าร้านค่ะ")]
+    assert bot_log(wh) == [("U1", "ขอราคาหน่อย", "ดูราคาได้ที่หน้าร้านค่ะ", "auto_reply")]
+    bot, inbound = conversation(wh, "U1")
+    assert (inbound["kind"], inbound["text"]) == ("inbound", "ขอราคาหน่อย")
+    assert (bot["kind"], bot["text"], bot["source"]) == ("bot", "ดูราคาได้ที่หน้าร้านค่ะ", "auto_reply")
+
+
+def test_rules_pick_the_lowest_priority_then_the_longest_keyword():
+    automaton = KeywordAutomaton([("he", "he", 2), ("she", "she", 2), ("hers", "hers", 1), ("his", "his", 3)])
+    assert automaton.best("ushers") == "hers"  # found through the failure link from "she"
+    assert automaton.best("this") == "his"
+    assert automaton.best("xyz") is None
+
+    rules = [("พัสดุ", "ดูสถานะพัสดุได้ที่ลิงก์ค่ะ", 100), ("เลขพัสดุ", "รอเลขพัสดุสักครู่ค่ะ", 100), ("PROMO", "ลด 10%", 100)]
+    engine = AutoReplyEngine(lambda: rules, lambda: 1)
+    assert engine.match("ขอเลขพัสดุหน่อย") == "รอเลขพัสดุสักครู่ค่ะ"
+    assert engine.match("พัสดุถึงไหนแล้ว") == "ดูสถานะพัสดุได้ที่ลิงก์ค่ะ"
+    assert engine.match("any promo?") == "ลด 10%"
+
+
+def test_rule_changes_are_picked_up_on_the_next_reload(wh, replies, monkeypatch):
+    monkeypatch.setattr(wh.auto_reply_engine, "reload_interval", 0)
+    wh.session.add(wh.AutoReplyRule(keyword="ราคา", reply="ดูราคาได้ที่หน้าร้านค่ะ"))
+    wh.session.commit()
+    wh.handle_text_message(text_event("U1", "ขอราคาหน่อย"))
+    wh.session.query(wh.AutoReplyRule).update({"enabled": False})
+    wh.session.commit()
+    wh.handle_text_message(text_event("U1", "ขอราคาอีกที"))
+    assert replies == [("U1", "ดูราคาได้ที่หน้าร้านค่ะ")]
+
+
+def test_chatgpt_answer_is_logged_as_chatgpt(wh, replies, monkeypatch):
+    monkeypatch.setattr(wh, "CHATGPT_REPLY_ENABLED", True)
+    monkeypatch.setattr(wh, "call_chatgpt", lambda text, context=None: "ส่งภายใน 2 วันค่ะ")
+    wh.handle_text_message(text_event("U1", "ส่งกี่วัน"))
+    assert replies == [("U1", "ส่งภายใน 2 วันค่ะ")]
+    assert bot_log(wh) == [("U1", "ส่งกี่วัน", "ส่งภายใน 2 วันค่ะ", "chatgpt")]
+
+
+def test_unanswered_message_logs_nothing(wh, replies):
+    wh.handle_text_message(text_event("U1", "ส่งกี่วัน"))
+    assert replies == []
+    assert bot_log(wh) == []
+
+
+def test_faq_answer_is_logged_with_the_entry_that_matched(wh, replies):
+    wh.session.add_all([
+        wh.FaqEntry(question="ส่งสินค้ากี่วัน", answer="ส่งภายใน 2 วันค่ะ"),
+        wh.FaqEntry(question="เก็บเงินปลายทางได้ไหม", answer="ได้ค่ะ"),
+    ])
+    wh.session.commit()
+    entry_id = wh.session.query(wh.FaqEntry.id).filter_by(answer="ได้ค่ะ").scalar()
+    wh.faq_retriever.sync()
+
+    wh.handle_text_message(text_event("U1", "เก็บเงินปลายทางได้ไหม"))
+    assert replies == [("U1", "ได้ค่ะ")]
+    assert bot_log(wh) == [("U1", "เก็บเงินปลายทางได้ไหม", "ได้ค่ะ", "faq")]
+    assert wh.session.query(wh.ChatGPTLog.faq_entry_id).scalar() == entry_id
+    bot = conversation(wh, "U1")[0]
+    assert (bot["source"], bot["faq_entry_id"]) == ("faq", entry_id)
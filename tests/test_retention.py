@@ -0,0 +1,83 @@
+import gzip
+import json
+import threading
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+
+import partitions
+
+
+@pytest.fixture
+def export_dir(wh, tmp_path, monkeypatch):
+    monkeypatch.setattr(wh, "RETENTION_EXPORT_DIR", str(tmp_path))
+    return tmp_path
+
+
+def add_messages(wh, *rows):
+    wh.session.add_all([wh.Message(date=date, text=text, user_id="U1") for date, text in rows])
+    wh.session.commit()
+
+
+def exported(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line)["text"] for line in f]
+
+
+def stored_texts(wh):
+    texts = sorted(row[0] for row in wh.session.query(wh.Message.text))
+    wh.session.rollback()
+    return texts
+
+
+def test_old_months_are_exported_then_removed(wh, export_dir):
+    add_messages(wh, (datetime(2024, 1, 5), "jan"), (datetime(2024, 1, 20), "jan2"), (datetime(2024, 2, 1), "feb"),
+                 (datetime.utcnow(), "now"))
+    retired = [r for r in wh.run_retention(months=1) if r["table"] == "messages"]
+    assert [(r["month"], r["rows"], r["removed"]) for r in retired] == [("2024-01", 2, "delete"), ("2024-02", 1, "delete")]
+    assert exported(export_dir / "messages" / "messages-2024-01.ndjson.gz") == ["jan", "jan2"]
+    assert stored_texts(wh) == ["now"]
+
+
+def test_row_written_during_the_export_is_kept_for_the_next_run(wh, export_dir, monkeypatch):
+    add_messages(wh, (datetime(2024, 1, 5), "jan"))
+    writer = create_engine(wh.engine.url, connect_args={"timeout": 30})
+    export_month = partitions.export_month
+    threads = []
+
+    def write_late_row():
+        with writer.begin() as conn:
+            conn.execute(wh.Message.__table__.insert(), {"date": datetime(2024, 1, 6), "text": "late", "user_id": "U1"})
+
+    def export_while_a_write_arrives(conn, table, month, *args):
+        if table.name == "messages" and not threads:
+            threads.append(threading.Thread(target=write_late_row))
+            threads[0].start()
+            threads[0].join(0.3)
+        return export_month(conn, table, month, *args)
+
+    monkeypatch.setattr(partitions, "export_month", export_while_a_write_arrives)
+    wh.run_retention(months=1)
+    threads[0].join()
+    writer.dispose()
+
+    # The write waited for the retention transaction instead of slipping in between export and delete
+    assert exported(export_dir / "messages" / "messages-2024-01.ndjson.gz") == ["jan"]
+    assert stored_texts(wh) == ["late"]
+    wh.run_retention(months=1)
+    assert exported(export_dir / "messages" / "messages-2024-01.1.ndjson.gz") == ["late"]
+    assert exported(export_dir / "messages" / "messages-2024-01.ndjson.gz") == ["jan"]
+    assert stored_texts(wh) == []
+
+
+def test_failed_removal_keeps_the_rows(wh, export_dir, monkeypatch):
+    add_messages(wh, (datetime(2024, 1, 5), "jan"))
+
+    def crash(*args, **kwargs):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(partitions, "export_month", crash)
+    with pytest.raises(RuntimeError):
+        wh.run_retention(months=1)
+    assert stored_texts(wh) == ["jan"]
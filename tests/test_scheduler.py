@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+from scheduler import JobScheduler
+
+
+@pytest.fixture
+def make_scheduler(wh, tmp_path):
+    # Each scheduler stands in for a separate worker process sharing the database and lock directory
+    def make(**kwargs):
+        return JobScheduler(wh.engine, wh.ScheduledJob.__table__, lock_dir=str(tmp_path), **kwargs)
+
+    return make
+
+
+def test_a_due_job_runs_once_across_workers(make_scheduler):
+    runs = []
+    first, second = make_scheduler(), make_scheduler()
+    for scheduler in (first, second):
+        scheduler.add("cleanup", 60, lambda: runs.append(1))
+    assert first.run_once("cleanup") == "ran"
+    assert second.run_once("cleanup") == "not_due"
+    assert runs == [1]
+    assert first.metrics()["cleanup"]["runs"] == 1
+
+
+def test_worker_skips_a_job_another_worker_is_running(make_scheduler):
+    first, second = make_scheduler(), make_scheduler()
+    seen = []
+    first.add("cleanup", 60, lambda: seen.append(second.run_once("cleanup", force=True)))
+    second.add("cleanup", 60, lambda: seen.append("second ran"))
+    assert first.run_once("cleanup") == "ran"
+    assert seen == ["busy"]
+
+
+def test_failures_and_overlaps_are_recorded(make_scheduler):
+    finished = []
+    scheduler = make_scheduler(after_run=lambda: finished.append(True))
+
+    def slow_failure():
+        time.sleep(0.05)
+        raise RuntimeError("lock timeout")
+
+    scheduler.add("rollup", 0.01, slow_failure)
+    assert scheduler.run_once("rollup") == "ran"
+    report = scheduler.metrics()["rollup"]
+    assert (report["runs"], report["failures"], report["overlaps"]) == (1, 1, 1)
+    assert report["last_error"] == "RuntimeError: lock timeout"
+    assert report["running_since"] is None
+    assert finished == [True]
+
+
+def test_jobs_with_no_interval_are_not_scheduled(make_scheduler):
+    scheduler = make_scheduler()
+    scheduler.add("retention", 0, lambda: None)
+    scheduler.add("dlq_retry", None, lambda: None)
+    assert scheduler.jobs == {}
@@ -0,0 +1,62 @@
+from datetime import datetime
+
+ADMIN_HEADERS = {"Authorization": "Bearer test-admin-token"}
+
+
+def search(wh, status=200, **params):
+    response = wh.app.test_client().get("/search", query_string=params, headers=ADMIN_HEADERS)
+    assert response.status_code == status
+    return response.get_json()
+
+
+def texts(wh, **params):
+    return [row["text"] for row in search(wh, **params)["results"]]
+
+
+def add_messages(wh, *rows):
+    wh.session.add_all([wh.Message(date=datetime(2025, 1, 1, 10, minute), text=text, user_id=user_id)
+                        for minute, (user_id, text) in enumerate(rows)])
+    wh.session.commit()
+
+
+def test_search_finds_thai_text_inside_a_message_newest_first(wh):
+    add_messages(wh, ("U1", "สั่งเสื้อสีแดงสองตัว"), ("U2", "มีเสื้อสีแดงไหม"), ("U1", "ส่งกี่วัน"))
+    assert wh.SEARCH_BACKEND == "fts5"
+    assert texts(wh, q="เสื้อสีแดง") == ["มีเสื้อสีแดงไหม", "สั่งเสื้อสีแดงสองตัว"]
+    assert texts(wh, q="เสื้อ แดง") == ["มีเสื้อสีแดงไหม", "สั่งเสื้อสีแดงสองตัว"]
+    assert texts(wh, q="เสื้อสีแดง", user_id="U1") == ["สั่งเสื้อสีแดงสองตัว"]
+    assert texts(wh, q="เสื้อสีแดง", since="2025-01-01T10:01:00") == ["มีเสื้อสีแดงไหม"]
+
+
+def test_like_wildcards_in_short_terms_match_literally(wh):
+    add_messages(wh, ("U1", "ลด 50% วันนี้"), ("U1", "ลด 50 บาท"), ("U1", "code_a1"), ("U1", "codeXa1"))
+    assert texts(wh, q="0%") == ["ลด 50% วันนี้"]
+    assert texts(wh, q="e_a") == ["code_a1"]
+
+
+def test_cursor_pages_through_every_match_once(wh):
+    add_messages(wh, *[("U1", f"order {n}") for n in range(5)])
+    pages, cursor = [], None
+    while True:
+        page = search(wh, q="order", limit=2, **({"cursor": cursor} if cursor else {}))
+        pages.append([row["text"] for row in page["results"]])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert pages == [["order 4", "order 3"], ["order 2", "order 1"], ["order 0"]]
+
+
+def test_deleted_messages_drop_out_of_the_index(wh):
+    add_messages(wh, ("U1", "เสื้อสีแดง"))
+    wh.session.query(wh.Message).delete()
+    wh.session.commit()
+    add_messages(wh, ("U1", "กางเกงสีดำ"))
+    assert texts(wh, q="เสื้อสีแดง") == []
+    assert texts(wh, q="กางเกง") == ["กางเกงสีดำ"]
+
+
+def test_bad_requests_are_rejected(wh):
+    search(wh, status=400, q="")
+    search(wh, status=400, q="x", cursor="not-a-cursor")
+    search(wh, status=400, q="x", since="yesterday")
+    assert wh.app.test_client().get("/search", query_string={"q": "x"}).status_code == 403
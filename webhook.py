@@ -4,12 +4,40 @@ import hashlib
 import base64
 import requests
 import time
-from flask import Flask, request, jsonify, abort
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Float, Boolean
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
-from sqlalchemy.exc import NoResultFound
-from datetime import datetime
+import json
+import signal
+import socket
+import threading
+import atexit
+import heapq
+import csv
+import io
+import zlib
+import ast
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from contextlib import contextmanager
+from flask import Flask, request, jsonify, abort, Response, send_file
+from sqlalchemy import inspect, create_engine, MetaData, Table, Column, Integer, String, Text, LargeBinary, DateTime, Date, ForeignKey, Float, Boolean, Index, insert, select, func, or_, and_, tuple_, bindparam, text as sql_text
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship, scoped_session, deferred
+from sqlalchemy.exc import NoResultFound, IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.ext.compiler import compiles
+from datetime import datetime, timedelta, timezone, date as date_type
+import click
+from flask.cli import AppGroup
 from dotenv import load_dotenv
+from keyed_executor import KeyedExecutor
+from archive import SegmentArchive
+from leaderboard import Leaderboard
+from autoreply import AutoReplyEngine
+from faq import FaqRetriever
+from ratelimit import RateLimiter
+from media_store import ContentStore
+from scheduler import JobScheduler
+from querystats import QueryStats
+import partitions
 
 # Load .env file in local development
 load_dotenv()
@@ -25,28 +53,126 @@ FORWARD_USER_ID = os.environ.get("FORWARD_USER_ID")
 ADMIN_ID = os.environ.get("ADMIN_ID")
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 LINESHOP_KEY = os.environ.get("LINESHOP_KEY")
+# Point these at fake_apis.py to run without the real LINE / OpenAI services
+LINE_API_BASE_URL = os.environ.get("LINE_API_BASE_URL", "https://api.line.me").rstrip("/")
+LINE_DATA_API_BASE_URL = os.environ.get("LINE_DATA_API_BASE_URL", "https://api-data.line.me").rstrip("/")
+OPENAI_API_BASE_URL = os.environ.get("OPENAI_API_BASE_URL", "https://api.openai.com").rstrip("/")
+ADMIN_API_TOKEN = os.environ.get("ADMIN_API_TOKEN")
+# Replays and backfills turn this off so no LINE push/profile calls are made
+LINE_OUTBOUND_ENABLED = os.environ.get("LINE_OUTBOUND_ENABLED", "true").lower() == "true"
+EVENT_LANES = int(os.environ.get("EVENT_LANES", "4"))
+# When enabled the web tier only verifies and enqueues; `flask queue work` processes
+INBOUND_QUEUE_ENABLED = os.environ.get("INBOUND_QUEUE_ENABLED", "false").lower() == "true"
+INBOUND_VISIBILITY_TIMEOUT = int(os.environ.get("INBOUND_VISIBILITY_TIMEOUT", "300"))
+INBOUND_MAX_ATTEMPTS = int(os.environ.get("INBOUND_MAX_ATTEMPTS", "5"))
+# Orders in these statuses count towards the status rollup but not towards SKU units/revenue
+ROLLUP_EXCLUDED_STATUSES = {
+    s.strip() for s in os.environ.get("ROLLUP_EXCLUDED_STATUSES", "CANCELLED,CANCELED,REFUNDED").split(",") if s.strip()
+}
+ACTIVITY_WINDOW_DAYS = int(os.environ.get("ACTIVITY_WINDOW_DAYS", "7"))
+ACTIVITY_TOP_N = int(os.environ.get("ACTIVITY_TOP_N", "50"))
+AUTO_REPLY_ENABLED = os.environ.get("AUTO_REPLY_ENABLED", "true").lower() == "true"
+AUTO_REPLY_RELOAD_SECONDS = int(os.environ.get("AUTO_REPLY_RELOAD_SECONDS", "30"))
+FAQ_ENABLED = os.environ.get("FAQ_ENABLED", "true").lower() == "true"
+FAQ_MIN_SCORE = float(os.environ.get("FAQ_MIN_SCORE", "0.6"))
+FAQ_TOP_K = int(os.environ.get("FAQ_TOP_K", "3"))
+FAQ_RELOAD_SECONDS = int(os.environ.get("FAQ_RELOAD_SECONDS", "30"))
+CHATGPT_REPLY_ENABLED = os.environ.get("CHATGPT_REPLY_ENABLED", "false").lower() == "true"
+PROFILE_FETCH_WORKERS = int(os.environ.get("PROFILE_FETCH_WORKERS", "2"))
+KNOWN_PROFILES_MAX = int(os.environ.get("KNOWN_PROFILES_MAX", "100000"))  # user ids remembered as having a profile, per process
+PROFILE_RATE_LIMIT = float(os.environ.get("PROFILE_RATE_LIMIT", "20"))  # profile requests/s per process, background only
+PROFILE_REFRESH_INTERVAL = int(os.environ.get("PROFILE_REFRESH_INTERVAL", "0"))  # seconds, 0 = no background refresh
+PROFILE_REFRESH_BATCH = int(os.environ.get("PROFILE_REFRESH_BATCH", "200"))
+PROFILE_REFRESH_MAX_AGE_DAYS = int(os.environ.get("PROFILE_REFRESH_MAX_AGE_DAYS", "7"))
+PROFILE_REFRESH_CLAIM_SECONDS = int(os.environ.get("PROFILE_REFRESH_CLAIM_SECONDS", "900"))  # a failed refresh is retried after this
+MEDIA_DIR = os.environ.get("MEDIA_DIR")  # unset = media content is not downloaded
+MEDIA_DOWNLOAD_WORKERS = int(os.environ.get("MEDIA_DOWNLOAD_WORKERS", "4"))
+MEDIA_DOWNLOAD_QUEUE = int(os.environ.get("MEDIA_DOWNLOAD_QUEUE", "200"))
+MEDIA_MAX_MB = int(os.environ.get("MEDIA_MAX_MB", "300"))
+ROLLUP_REBUILD_INTERVAL = int(os.environ.get("ROLLUP_REBUILD_INTERVAL", "0"))  # seconds, 0 = never
+PARTITION_MONTHS_AHEAD = int(os.environ.get("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_MAINTENANCE_INTERVAL = int(os.environ.get("PARTITION_MAINTENANCE_INTERVAL", "86400"))
+RETENTION_MONTHS = int(os.environ.get("RETENTION_MONTHS", "0"))  # 0 = keep message history forever
+RETENTION_EXPORT_DIR = os.environ.get("RETENTION_EXPORT_DIR")
+RETENTION_INTERVAL = int(os.environ.get("RETENTION_INTERVAL", "86400"))
+# Per-statement timing via engine events; off means no listeners are attached at all
+QUERY_STATS_ENABLED = os.environ.get("QUERY_STATS_ENABLED", "false").lower() == "true"
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "200"))
+QUERY_STATS_MAX_STATEMENTS = int(os.environ.get("QUERY_STATS_MAX_STATEMENTS", "500"))
+QUERY_STATS_REPORT = os.environ.get("QUERY_STATS_REPORT")  # JSON report written at exit; "{pid}" is expanded
+JOB_LOCK_DIR = os.environ.get("JOB_LOCK_DIR")  # flock directory for job leader election off PostgreSQL
+DLQ_MAX_ATTEMPTS = int(os.environ.get("DLQ_MAX_ATTEMPTS", "8"))
+DLQ_BASE_DELAY = int(os.environ.get("DLQ_BASE_DELAY", "30"))
+DLQ_MAX_DELAY = int(os.environ.get("DLQ_MAX_DELAY", "21600"))
+DLQ_RETRY_INTERVAL = int(os.environ.get("DLQ_RETRY_INTERVAL", "0"))  # seconds, 0 = no background retries
+# Verified raw bodies are kept here as compressed NDJSON segments when set
+WEBHOOK_ARCHIVE_DIR = os.environ.get("WEBHOOK_ARCHIVE_DIR")
+WEBHOOK_ARCHIVE_COMPRESSION = os.environ.get("WEBHOOK_ARCHIVE_COMPRESSION", "gzip")
+WEBHOOK_ARCHIVE_SEGMENT_MB = int(os.environ.get("WEBHOOK_ARCHIVE_SEGMENT_MB", "64"))
+WEBHOOK_ARCHIVE_SEGMENT_SECONDS = int(os.environ.get("WEBHOOK_ARCHIVE_SEGMENT_SECONDS", "3600"))
+WEBHOOK_ARCHIVE_FSYNC_SECONDS = float(os.environ.get("WEBHOOK_ARCHIVE_FSYNC_SECONDS", "5"))
 engine = create_engine(DATABASE_URL)
+query_stats = QueryStats(SLOW_QUERY_MS, QUERY_STATS_MAX_STATEMENTS)
+if QUERY_STATS_ENABLED:
+    query_stats.attach(engine)
+    if QUERY_STATS_REPORT:
+        atexit.register(lambda: query_stats.write_report(QUERY_STATS_REPORT.format(pid=os.getpid())))
 Base = declarative_base()
 
+class utcnow(FunctionElement):
+    # Server-side UTC "now" for naive DateTime columns
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(utcnow, "postgresql")
+def pg_utcnow(element, compiler, **kw):
+    return "timezone('utc', now())"
+
+@compiles(utcnow, "sqlite")
+def sqlite_utcnow(element, compiler, **kw):
+    return "(strftime('%Y-%m-%d %H:%M:%f', 'now'))"
+
+@compiles(utcnow)
+def default_utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
 class Message(Base):
     __tablename__ = "messages"
     id = Column(Integer, primary_key=True)
     date = Column(DateTime, nullable=False)
     text = Column(Text, nullable=False)
     user_id = Column(String, nullable=False)
+    message_type = Column(String, nullable=False, default="text", server_default="text")
+    webhook_event_id = Column(String)  # LINE's id for the event; replay skips events already stored
+    __table_args__ = (
+        Index("ix_messages_date_id", "date", "id"),
+        Index("ix_messages_user_date_id", "user_id", "date", "id"),
+        Index("ix_messages_webhook_event_id", "webhook_event_id",
+              postgresql_where=sql_text("webhook_event_id IS NOT NULL"), sqlite_where=sql_text("webhook_event_id IS NOT NULL")),
+    )
 
 class AdminMessage(Base):
     __tablename__ = "admin_messages"
     id = Column(Integer, primary_key=True)
     date = Column(DateTime, nullable=False)
     text = Column(Text, nullable=False)
-    user_id = Column(String, nullable=False)
+    user_id = Column(String, nullable=False)  # always ADMIN_ID: these are the admin's own chats with the bot
+    webhook_event_id = Column(String)
+    __table_args__ = (
+        Index("ix_admin_messages_webhook_event_id", "webhook_event_id",
+              postgresql_where=sql_text("webhook_event_id IS NOT NULL"), sqlite_where=sql_text("webhook_event_id IS NOT NULL")),
+    )
 
 class UserProfile(Base):
     __tablename__ = "user_profiles"
     id = Column(Integer, primary_key=True)
     user_id = Column(String, unique=True, nullable=False)
     display_name = Column(String)
+    status = Column(String, nullable=False, default="active", server_default="active")  # active | unfollowed | unreachable
+    status_changed_at = Column(DateTime)
+    fetched_at = Column(DateTime)  # last successful LINE profile fetch
+    refresh_claimed_at = Column(DateTime)  # set while a refresh worker holds the row; cleared once it is fetched
+    __table_args__ = (Index("ix_user_profiles_status_fetched_at", "status", "fetched_at"),)
 
 class ChatGPTLog(Base):
     __tablename__ = "chatgpt_logs"
@@ -55,6 +181,9 @@ class ChatGPTLog(Base):
     user_id = Column(String, nullable=False)
     prompt = Column(Text, nullable=False)
     response = Column(Text, nullable=False)
+    source = Column(String, nullable=False, default="chatgpt", server_default="chatgpt")  # chatgpt | auto_reply | faq
+    faq_entry_id = Column(Integer)  # the FAQ entry that answered, for source faq
+    __table_args__ = (Index("ix_chatgpt_logs_user_date_id", "user_id", "date", "id"),)
 
 class LineMyShopOrder(Base):
     __tablename__ = "line_myshop_orders"
@@ -62,7 +191,9 @@ class LineMyShopOrder(Base):
     order_number = Column(String, nullable=False)
     order_status = Column(String)
     event_name = Column(String)
-    event_timestamp = Column(String)
+    event_timestamp = Column(String)  # as sent by MyShop
+    event_time = Column(DateTime(timezone=True))  # event_timestamp parsed at ingest, UTC
+    first_event_time = Column(DateTime(timezone=True))  # earliest event_time seen for the order; its rollup day
     payment_method = Column(String)
     payment_status = Column(String)
     recipient_name = Column(String)
@@ -75,9 +206,16 @@ class LineMyShopOrder(Base):
     shipment_price = Column(Float)
     is_cod = Column(Boolean)
     is_gift = Column(Boolean)
-    raw_data = Column(Text)
-    date = Column(DateTime, default=datetime.utcnow)
+    date = Column(DateTime, nullable=False, server_default=utcnow())
     items = relationship("LineMyShopOrderItem", back_populates="order")
+    payloads = relationship("LineMyShopOrderPayload", back_populates="order", order_by="LineMyShopOrderPayload.id")
+    __table_args__ = (
+        # One row per order: concurrent first events for an order rely on this to not both insert
+        Index("uq_line_myshop_orders_order_number", "order_number", unique=True),
+        # btree rather than BRIN: status events rewrite rows, so physical order drifts from event time
+        Index("ix_line_myshop_orders_event_time_id", "event_time", "id"),
+    )
+    __mapper_args__ = {"eager_defaults": True}  # date comes back with the INSERT
 
 class LineMyShopOrderItem(Base):
     __tablename__ = "line_myshop_order_items"
@@ -91,15 +229,496 @@ class LineMyShopOrderItem(Base):
     barcode = Column(String)
     weight = Column(Float)
     image_url = Column(String)
-    raw_data = Column(Text)
     order = relationship("LineMyShopOrder", back_populates="items")
+    __table_args__ = (Index("ix_line_myshop_order_items_order_id", "order_id"),)
+
+class LineMyShopOrderPayload(Base):
+    # Raw MyShop payloads, one per event, kept out of the order tables that reports scan
+    __tablename__ = "line_myshop_order_payloads"
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey('line_myshop_orders.id'), nullable=False)
+    event_name = Column(String)
+    event_timestamp = Column(String)
+    received_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    payload = deferred(Column(LargeBinary, nullable=False))  # zlib-compressed JSON, see decompress_payload()
+    order = relationship("LineMyShopOrder", back_populates="payloads")
+    __table_args__ = (Index("ix_line_myshop_order_payloads_order_event", "order_id", "event_name"),)
+
+class SalesDailyStatus(Base):
+    __tablename__ = "sales_daily_status"
+    day = Column(Date, primary_key=True)
+    order_status = Column(String, primary_key=True)  # "" when the payload had none
+    orders = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+
+class SalesDailySku(Base):
+    __tablename__ = "sales_daily_sku"
+    day = Column(Date, primary_key=True)
+    sku = Column(String, primary_key=True)  # "" when the item had none
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+
+class UserDailyActivity(Base):
+    __tablename__ = "user_daily_activity"
+    user_id = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    messages = Column(Integer, nullable=False, default=0)
+    __table_args__ = (Index("ix_user_daily_activity_day", "day"),)
+
+class AutoReplyRule(Base):
+    __tablename__ = "auto_reply_rules"
+    id = Column(Integer, primary_key=True)
+    keyword = Column(String, nullable=False)
+    reply = Column(Text, nullable=False)
+    priority = Column(Integer, nullable=False, default=100)  # lower wins
+    enabled = Column(Boolean, nullable=False, default=True)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class FaqEntry(Base):
+    __tablename__ = "faq_entries"
+    id = Column(Integer, primary_key=True)
+    question = Column(Text, nullable=False)
+    answer = Column(Text, nullable=False)
+    enabled = Column(Boolean, nullable=False, default=True)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Media(Base):
+    __tablename__ = "media"
+    id = Column(Integer, primary_key=True)
+    message_id = Column(Integer, nullable=False, index=True)  # messages.id
+    line_message_id = Column(String, nullable=False)
+    source_url = Column(Text)  # set for contentProvider.type == "external"
+    status = Column(String, nullable=False, default="pending")  # pending | stored | failed
+    sha256 = Column(String, index=True)  # file lives at MEDIA_DIR/ab/cd/<sha256>
+    size = Column(Integer)
+    content_type = Column(String)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    stored_at = Column(DateTime)
+
+class ScheduledJob(Base):
+    __tablename__ = "scheduled_jobs"
+    name = Column(String, primary_key=True)
+    last_started_at = Column(DateTime)
+    last_finished_at = Column(DateTime)
+    last_duration_s = Column(Float)
+    running_since = Column(DateTime)
+    owner = Column(String)  # host:pid of the last runner
+    runs = Column(Integer, nullable=False, default=0)
+    failures = Column(Integer, nullable=False, default=0)
+    overlaps = Column(Integer, nullable=False, default=0)  # due while the previous run still held the lock
+    last_error = Column(Text)
+
+class InboundEvent(Base):
+    __tablename__ = "inbound_events"
+    id = Column(Integer, primary_key=True)
+    source = Column(String, nullable=False)  # "line" (one event) or "myshop" (one payload)
+    payload = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending, processing, done, dead
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = Column(DateTime)
+    locked_by = Column(String)
+    last_error = Column(Text)
+    received_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = Column(DateTime)
+    __table_args__ = (Index("ix_inbound_events_status_available", "status", "available_at"),)
+
+class DeadLetterEvent(Base):
+    __tablename__ = "dead_letter_events"
+    id = Column(Integer, primary_key=True)
+    source = Column(String, nullable=False)  # same sources as InboundEvent
+    payload = Column(Text, nullable=False)
+    error = Column(Text)
+    attempts = Column(Integer, nullable=False, default=1)
+    status = Column(String, nullable=False, default="pending")  # pending, resolved, abandoned
+    first_failed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_failed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    next_attempt_at = Column(DateTime, nullable=False)
+    resolved_at = Column(DateTime)
+    __table_args__ = (Index("ix_dead_letter_events_status_next", "status", "next_attempt_at"),)
+
+# Append-only history tables: monthly partitions on PostgreSQL, month-by-month retention everywhere
+PARTITIONED_TABLES = [Message.__table__, AdminMessage.__table__, ChatGPTLog.__table__]
+
+MIGRATION_LOCK_KEY = zlib.crc32(b"schema:migrate")
+
+@contextmanager
+def migration_transaction():
+    # One transaction for every step, and one migrator at a time: concurrent runs wait, then find nothing left to do
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            # pysqlite leaves DDL outside any transaction unless one is opened explicitly; IMMEDIATE takes the write lock
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        elif engine.dialect.name == "postgresql":
+            conn.execute(select(func.pg_advisory_xact_lock(MIGRATION_LOCK_KEY)))
+        yield conn
+        conn.commit()
+
+def ensure_partitioned_tables(conn):
+    # New PostgreSQL databases get these tables partitioned; existing ones need 'flask partitions migrate'
+    if engine.dialect.name != "postgresql":
+        return
+    for table in PARTITIONED_TABLES:
+        if not inspect(conn).has_table(table.name):
+            partitions.create_partitioned(conn, table, PARTITION_MONTHS_AHEAD)
+
+def create_tables():
+    # Every worker runs this at import: under the migration lock so they don't race to create the same table
+    with migration_transaction() as conn:
+        ensure_partitioned_tables(conn)
+        Base.metadata.create_all(conn)
+
+create_tables()
+
+def server_default_sql(column):
+    arg = column.server_default.arg
+    return f"'{arg}'" if isinstance(arg, str) else str(arg.compile(dialect=engine.dialect))
+
+def ensure_columns(conn, apply=True):
+    # create_all never alters existing tables; add columns declared later. Returns what was (or would be) done
+    changes = []
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {server_default_sql(column)}"
+                # Only with a default: existing rows need a value before NOT NULL can hold
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            changes.append(f"add column {table.name}.{column.name}")
+            if apply:
+                print(f"🛠️ Adding column {table.name}.{column.name}")
+                conn.execute(sql_text(ddl))
+    return changes
+
+def rebuild_sqlite_table(conn, table):
+    # SQLite cannot change a column default in place: copy the rows into a new table and swap it in.
+    # Only inside migration_transaction(): a crash between DROP and RENAME must roll back, not lose the table
+    if not conn.connection.dbapi_connection.in_transaction:
+        raise RuntimeError(f"Rebuilding {table.name} needs an open SQLite transaction")
+    legacy = Table(table.name, MetaData(), autoload_with=conn)
+    columns = [column._copy() for column in table.columns]
+    columns += [Column(column.name, column.type) for column in legacy.columns if column.name not in table.c]
+    rebuilt = Table(f"{table.name}_rebuild", MetaData(), *columns)
+    # Left behind by a rebuild that ran outside a transaction (before 'flask db migrate') and died
+    conn.execute(sql_text(f"DROP TABLE IF EXISTS {rebuilt.name}"))
+    rebuilt.create(conn)
+    names = ", ".join(column.name for column in legacy.columns)
+    conn.execute(sql_text(f"INSERT INTO {rebuilt.name} ({names}) SELECT {names} FROM {table.name}"))
+    conn.execute(sql_text(f"DROP TABLE {table.name}"))
+    conn.execute(sql_text(f"ALTER TABLE {rebuilt.name} RENAME TO {table.name}"))
+
+def ensure_server_defaults(conn, apply=True):
+    # Give existing columns the server defaults declared later; indexes dropped by a rebuild come back in ensure_indexes()
+    changes = []
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        defaults = {column["name"]: column["default"] for column in inspector.get_columns(table.name)}
+        missing = [
+            column for column in table.columns
+            if column.server_default is not None and defaults.get(column.name) is None
+        ]
+        if not missing:
+            continue
+        changes.append(f"set server defaults on {table.name}: {', '.join(column.name for column in missing)}")
+        if not apply:
+            continue
+        print(f"🛠️ Setting server defaults on {table.name}: {', '.join(column.name for column in missing)}")
+        if engine.dialect.name == "sqlite":
+            rebuild_sqlite_table(conn, table)
+            continue
+        for column in missing:
+            conn.execute(sql_text(
+                f"ALTER TABLE {table.name} ALTER COLUMN {column.name} SET DEFAULT {server_default_sql(column)}"
+            ))
+    return changes
+
+def ensure_indexes(conn, apply=True):
+    # create_all only indexes new tables; add indexes declared later to existing ones
+    changes = []
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if inspector.has_index(table.name, index.name):
+                continue
+            changes.append(f"create index {index.name}")
+            if apply:
+                print(f"🛠️ Creating index {index.name}")
+                index.create(conn)
+    return changes
+
+def dedupe_orders(conn, apply=True):
+    # Before order_number was unique every MyShop event appended a row. Keep the newest row of each order and move
+    # the older rows' payloads onto it; their items belong to superseded events and are dropped
+    orders = LineMyShopOrder.__table__
+    items = LineMyShopOrderItem.__table__
+    payloads = LineMyShopOrderPayload.__table__
+    newer = orders.alias("newer")
+    newest_id = select(func.max(newer.c.id)).where(newer.c.order_number == orders.c.order_number).scalar_subquery()
+    superseded = select(orders.c.id).where(orders.c.id < newest_id)
+    count = conn.execute(select(func.count()).select_from(superseded.subquery())).scalar()
+    if not count:
+        return []
+    changes = [f"merge {count} superseded line_myshop_orders row(s) into the newest row of their order"]
+    if not apply:
+        return changes
+    if "raw_data" in {column["name"] for column in inspect(conn).get_columns(orders.name)}:
+        raise RuntimeError("line_myshop_orders still has raw_data; run 'flask orders move-raw-data' before migrating")
+    print(f"🛠️ Merging {count} superseded order row(s)")
+    owner = orders.alias("owner")
+    owner_newest_id = (
+        select(func.max(newer.c.id))
+        .select_from(owner.join(newer, newer.c.order_number == owner.c.order_number))
+        .where(owner.c.id == payloads.c.order_id)
+        .scalar_subquery()
+    )
+    conn.execute(payloads.update().where(payloads.c.order_id.in_(superseded)).values(order_id=owner_newest_id))
+    conn.execute(items.delete().where(items.c.order_id.in_(superseded)))
+    conn.execute(orders.delete().where(orders.c.id.in_(superseded)))
+    return changes
+
+def backfill_first_event_times(conn, apply=True):
+    # Orders stored before first_event_time existed: the earliest event time of any row with their order number,
+    # so this runs before dedupe_orders() drops the older rows
+    orders = LineMyShopOrder.__table__
+    columns = {column["name"] for column in inspect(conn).get_columns(orders.name)}
+    if "event_time" not in columns:
+        return []  # added empty, nothing to copy (only seen when listing pending changes)
+    missing = orders.c.event_time.isnot(None)
+    if "first_event_time" in columns:
+        missing &= orders.c.first_event_time.is_(None)
+    count = conn.execute(select(func.count()).select_from(orders).where(missing)).scalar()
+    if not count:
+        return []
+    changes = [f"set first_event_time on {count} line_myshop_orders row(s)"]
+    if not apply:
+        return changes
+    print(f"🛠️ Setting first_event_time on {count} order row(s)")
+    same_order = orders.alias("same_order")
+    earliest = select(func.min(same_order.c.event_time)).where(same_order.c.order_number == orders.c.order_number)
+    conn.execute(orders.update().where(missing).values(first_event_time=earliest.scalar_subquery()))
+    return changes
+
+# Indexes a later model declaration replaced: table -> index names
+REPLACED_INDEXES = {
+    "line_myshop_orders": ["ix_line_myshop_orders_order_number"],
+    "admin_messages": ["ix_admin_messages_user_date_id"],
+}
+
+def drop_replaced_indexes(conn, apply=True):
+    changes = []
+    inspector = inspect(conn)
+    for table_name, index_names in REPLACED_INDEXES.items():
+        for index_name in index_names:
+            if not inspector.has_index(table_name, index_name):
+                continue
+            changes.append(f"drop index {index_name}")
+            if apply:
+                print(f"🛠️ Dropping index {index_name}")
+                conn.execute(sql_text(f"DROP INDEX {index_name}"))
+    return changes
+
+# Schema changes for tables that already exist, in order; each takes (conn, apply) and returns what it changes.
+# dedupe_orders comes before ensure_indexes, which creates the unique order_number index
+MIGRATIONS = [
+    ensure_columns, ensure_server_defaults, backfill_first_event_times, dedupe_orders, ensure_indexes,
+    drop_replaced_indexes,
+]
+# Steps that change which day or row an order is counted on; the rollups are rebuilt after them
+ROLLUP_MIGRATIONS = {backfill_first_event_times, dedupe_orders}
+def migrate_schema():
+    changes = []
+    rebuild = False
+    with migration_transaction() as conn:
+        for step in MIGRATIONS:
+            applied = step(conn)
+            changes += applied
+            rebuild = rebuild or bool(applied and step in ROLLUP_MIGRATIONS)
+    if rebuild:
+        print("📊 Rebuilding sales rollups")
+        rebuild_rollups()
+    return changes
+
+def pending_migrations():
+    with engine.connect() as conn:
+        return [change for step in MIGRATIONS for change in step(conn, apply=False)]
+
+def ensure_search_index():
+    # Thai has no word spaces, so search works on character trigrams rather than words
+    global SEARCH_BACKEND
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            try:
+                with conn.begin_nested():
+                    conn.execute(sql_text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(sql_text(
+                    "CREATE INDEX IF NOT EXISTS ix_messages_text_trgm ON messages USING gin (text gin_trgm_ops)"
+                ))
+                SEARCH_BACKEND = "pg_trgm"
+            except Exception as e:
+                print("⚠️ pg_trgm unavailable, /search falls back to a LIKE scan:", e)
+        elif engine.dialect.name == "sqlite":
+            try:
+                present = {row[0] for row in conn.execute(sql_text(
+                    "SELECT name FROM sqlite_master WHERE name IN ('messages_fts', 'messages_fts_insert')"
+                ))}
+                if len(present) < 2:
+                    conn.execute(sql_text(
+                        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+                        "text, content='messages', content_rowid='id', tokenize='trigram')"
+                    ))
+                    conn.execute(sql_text("""
+                        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                            INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text);
+                        END"""))
+                    conn.execute(sql_text("""
+                        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                            INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                        END"""))
+                    conn.execute(sql_text("""
+                        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF text ON messages BEGIN
+                            INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                            INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text);
+                        END"""))
+                    conn.execute(sql_text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+                SEARCH_BACKEND = "fts5"
+            except Exception as e:
+                print("⚠️ SQLite FTS5 trigram tokenizer unavailable, /search falls back to a LIKE scan:", e)
 
-Base.metadata.create_all(engine)
+SEARCH_BACKEND = "like"
+# Every worker imports this module, so existing tables are only checked here; 'flask db migrate' changes them
+pending_schema_changes = pending_migrations()
+if pending_schema_changes:
+    print(f"⚠️ Database schema is behind the models ({'; '.join(pending_schema_changes)}); run 'flask db migrate'")
+ensure_search_index()
 Session = sessionmaker(bind=engine)
-session = Session()
+# One session per thread: events are handled on the event lanes as well as the request thread
+session = scoped_session(Session)
+
+# Events from the same user run in order on one lane; different users run in parallel
+event_executor = KeyedExecutor(lanes=EVENT_LANES, name="event-lane")
+
+def load_auto_reply_rules():
+    rules = [
+        (rule.keyword, rule.reply, rule.priority)
+        for rule in session.query(AutoReplyRule).filter(AutoReplyRule.enabled.is_(True)).order_by(AutoReplyRule.id)
+    ]
+    session.rollback()
+    return rules
+
+def auto_reply_rules_version():
+    version = tuple(session.query(func.count(AutoReplyRule.id), func.max(AutoReplyRule.updated_at)).one())
+    session.rollback()
+    return version
+
+auto_reply_engine = AutoReplyEngine(load_auto_reply_rules, auto_reply_rules_version, AUTO_REPLY_RELOAD_SECONDS)
+
+def faq_versions():
+    versions = dict(session.query(FaqEntry.id, FaqEntry.updated_at).filter(FaqEntry.enabled.is_(True)).all())
+    session.rollback()
+    return versions
+
+def load_faq_entries(ids):
+    rows = session.query(FaqEntry.id, FaqEntry.question, FaqEntry.answer).filter(FaqEntry.id.in_(ids)).all()
+    session.rollback()
+    return [tuple(row) for row in rows]
+
+faq_retriever = FaqRetriever(faq_versions, load_faq_entries, FAQ_RELOAD_SECONDS)
+faq_stats = {"answered": 0, "chatgpt": 0, "unanswered": 0}
+faq_stats_lock = threading.Lock()  # bumped from every event lane
+
+def faq_context(hits):
+    lines = ["Answer using these FAQ entries from the shop when they are relevant:"]
+    for hit in hits:
+        lines.append(f"Q: {hit['question']}\nA: {hit['answer']}")
+    return "\n\n".join(lines)
+
+def answer_from_knowledge_base(user_id, text, date):
+    # FAQ hit above FAQ_MIN_SCORE answers directly; otherwise ChatGPT (if enabled) gets the top hits as context
+    hits = faq_retriever.search(text, FAQ_TOP_K) if FAQ_ENABLED else []
+    if hits and hits[0]["score"] >= FAQ_MIN_SCORE:
+        count_stat(faq_stats, faq_stats_lock, "answered")
+        log_bot_reply(user_id, date, text, hits[0]["answer"], "faq", faq_entry_id=hits[0]["id"])
+        return hits[0]["answer"]
+    if not CHATGPT_REPLY_ENABLED:
+        count_stat(faq_stats, faq_stats_lock, "unanswered")
+        return None
+    count_stat(faq_stats, faq_stats_lock, "chatgpt")
+    reply = call_chatgpt(text, context=faq_context(hits) if hits else None)
+    log_bot_reply(user_id, date, text, reply, "chatgpt")
+    return reply
+
+def log_bot_reply(user_id, date, prompt, reply, source, faq_entry_id=None):
+    # Every answer the bot sends is kept with the question, whichever path produced it
+    session.add(ChatGPTLog(date=date, user_id=user_id, prompt=prompt, response=reply, source=source,
+                           faq_entry_id=faq_entry_id))
+    session.commit()
+
+def end_job_session():
+    session.rollback()
+    session.remove()
+
+# Periodic jobs; each runs once per interval across all workers (see scheduler.py)
+job_scheduler = JobScheduler(engine, ScheduledJob.__table__, lock_dir=JOB_LOCK_DIR, after_run=end_job_session)
+
+def count_stat(stats, lock, key, amount=1):
+    # Counters shared by worker threads: += on a dict entry is not atomic
+    with lock:
+        stats[key] += amount
+
+def stats_snapshot(stats, lock, **extra):
+    with lock:
+        return dict(stats, **extra)
+
+# name -> callable returning a JSON-able dict, served by /metrics
+METRIC_SOURCES = {
+    "event_lanes": event_executor.metrics,
+    "auto_reply": auto_reply_engine.metrics,
+    "event_handlers": lambda: event_handler_metrics(),
+    "profile_fetch": lambda: stats_snapshot(profile_fetch_stats, profile_fetch_lock, pending=len(profile_fetches_pending)),
+    "profile_refresh": lambda: stats_snapshot(profile_refresh_stats, profile_refresh_lock),
+    "media": lambda: stats_snapshot(media_stats, media_stats_lock),
+    "jobs": job_scheduler.metrics,
+    "faq": lambda: stats_snapshot(faq_stats, faq_stats_lock, entries=len(faq_retriever.index)),
+    "queries": query_stats.metrics,
+}
+
+webhook_archive = None
+
+def archive_raw_body(source, body):
+    global webhook_archive
+    if not WEBHOOK_ARCHIVE_DIR:
+        return
+    try:
+        if webhook_archive is None or webhook_archive.pid != os.getpid():
+            # One writer per process; segment names carry the pid
+            webhook_archive = SegmentArchive(
+                WEBHOOK_ARCHIVE_DIR,
+                compression=WEBHOOK_ARCHIVE_COMPRESSION,
+                max_segment_bytes=WEBHOOK_ARCHIVE_SEGMENT_MB * 1024 * 1024,
+                max_segment_age=WEBHOOK_ARCHIVE_SEGMENT_SECONDS,
+                fsync_interval=WEBHOOK_ARCHIVE_FSYNC_SECONDS,
+            )
+            atexit.register(webhook_archive.close)
+        webhook_archive.append(source, body)
+    except Exception as e:
+        print("⚠️ Exception in archive_raw_body:", e)
+
+def require_admin_token():
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not ADMIN_API_TOKEN or not hmac.compare_digest(token, ADMIN_API_TOKEN):
+        abort(403)
 
 def forward_message_to_user(user_id, text):
     print("🛫 Entered forward_message_to_user()")
+    if not LINE_OUTBOUND_ENABLED:
+        return
     headers = {
         "Authorization": f"Bearer {LINE_ACCESS_TOKEN}",
         "Content-Type": "application/json"
@@ -114,14 +733,17 @@ def forward_message_to_user(user_id, text):
         ]
     }
     response = requests.post(
-        "https://api.line.me/v2/bot/message/push",
+        f"{LINE_API_BASE_URL}/v2/bot/message/push",
         headers=headers,
-        json=payload
+        json=payload,
+        timeout=10
     )
     print(f"Forward status: {response.status_code} {response.text}")
 
 def reply_to_line_user(user_id, text):
     print("🤖 Replying to user via LINE")
+    if not LINE_OUTBOUND_ENABLED:
+        return
     headers = {
         "Authorization": f"Bearer {LINE_ACCESS_TOKEN}",
         "Content-Type": "application/json"
@@ -136,28 +758,67 @@ def reply_to_line_user(user_id, text):
         ]
     }
     response = requests.post(
-        "https://api.line.me/v2/bot/message/push",
+        f"{LINE_API_BASE_URL}/v2/bot/message/push",
         headers=headers,
-        json=payload
+        json=payload,
+        timeout=10
     )
     print(f"Reply status: {response.status_code} {response.text}")
 
+def reply_with_token(reply_token, user_id, text):
+    # Reply messages are free but the token is single-use and short-lived; push otherwise
+    if not reply_token:
+        reply_to_line_user(user_id, text)
+        return
+    print("🤖 Replying to event via LINE reply token")
+    if not LINE_OUTBOUND_ENABLED:
+        return
+    headers = {
+        "Authorization": f"Bearer {LINE_ACCESS_TOKEN}",
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "replyToken": reply_token,
+        "messages": [
+            {
+                "type": "text",
+                "text": text
+            }
+        ]
+    }
+    response = requests.post(
+        f"{LINE_API_BASE_URL}/v2/bot/message/reply",
+        headers=headers,
+        json=payload,
+        timeout=10
+    )
+    print(f"Reply status: {response.status_code} {response.text}")
+    if response.status_code == 400:
+        reply_to_line_user(user_id, text)
+
+def fetch_line_profile(user_id):
+    # None when LINE has no profile for us (not a friend / blocked); raises on other errors
+    headers = {
+        "Authorization": f"Bearer {LINE_ACCESS_TOKEN}"
+    }
+    response = requests.get(f"{LINE_API_BASE_URL}/v2/bot/profile/{user_id}", headers=headers, timeout=10)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
 def get_user_name(user_id):
+    if not LINE_OUTBOUND_ENABLED:
+        return None
     try:
-        headers = {
-            "Authorization": f"Bearer {LINE_ACCESS_TOKEN}"
-        }
-        response = requests.get(f"https://api.line.me/v2/bot/profile/{user_id}", headers=headers)
-        if response.status_code == 200:
-            profile = response.json()
+        profile = fetch_line_profile(user_id)
+        if profile:
             return profile.get("displayName")
-        else:
-            print(f"⚠️ Failed to fetch user profile: {response.status_code} {response.text}")
     except Exception as e:
         print("⚠️ Exception in get_user_name:", e)
     return None
 
-def call_chatgpt(prompt):
+def call_chatgpt(prompt, context=None):
     print("🤖 Calling ChatGPT API")
     headers = {
         "Authorization": f"Bearer {OPENAI_API_KEY}",
@@ -172,12 +833,14 @@ def call_chatgpt(prompt):
             {"role": "user", "content": prompt}
         ]
     }
+    if context:
+        payload["messages"].insert(1, {"role": "system", "content": context})
     retries = 3
     backoff = 1
 
     for attempt in range(retries):
         try:
-            response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+            response = requests.post(f"{OPENAI_API_BASE_URL}/v1/chat/completions", headers=headers, json=payload, timeout=60)
             if response.status_code == 200:
                 reply = response.json()["choices"][0]["message"]["content"].strip()
                 return reply
@@ -202,58 +865,538 @@ def is_valid_signature(request):
     computed_signature = base64.b64encode(hash).decode()
     return hmac.compare_digest(computed_signature, signature)
 
+def event_key(event):
+    source = event.get("source", {})
+    return source.get("userId") or source.get("groupId") or source.get("roomId") or ""
+
+def parse_text_event(event):
+    if event["type"] == "message" and event["message"]["type"] == "text":
+        user_id = event["source"]["userId"]
+        text = event["message"]["text"]
+        timestamp = int(event["timestamp"]) // 1000
+        date = datetime.fromtimestamp(timestamp)
+        return user_id, text, date
+    return None
+
+# (event type, message type) -> handler; message type is None for non-message events
+EVENT_HANDLERS = {}
+handler_stats = {}
+handler_stats_lock = threading.Lock()
+
+def event_handler(event_type, message_type=None):
+    def register(fn):
+        EVENT_HANDLERS[(event_type, message_type)] = fn
+        return fn
+    return register
+
+def record_handler_timing(name, elapsed, failed):
+    with handler_stats_lock:
+        stats = handler_stats.get(name)
+        if stats is None:
+            stats = handler_stats[name] = {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+        stats["count"] += 1
+        stats["errors"] += failed
+        stats["total_ms"] += elapsed * 1000
+        stats["max_ms"] = max(stats["max_ms"], elapsed * 1000)
+
+def event_handler_metrics():
+    with handler_stats_lock:
+        return {
+            name: dict(stats, mean_ms=stats["total_ms"] / stats["count"])
+            for name, stats in handler_stats.items()
+        }
+
+def handle_event(event):
+    event_type = event.get("type")
+    message_type = event["message"].get("type") if event_type == "message" else None
+    handler = EVENT_HANDLERS.get((event_type, message_type))
+    if handler is None:
+        print(f"🤷 No handler for {event_type}/{message_type}, ignoring")
+        record_handler_timing(f"unhandled:{event_type}/{message_type}", 0.0, False)
+        return
+    source = event.get("source") or {}
+    if not source.get("userId"):
+        # Group/room events from members who haven't consented carry no userId; everything is keyed per user
+        source_type = source.get("type", "unknown")
+        print(f"🤷 {event_type}/{message_type} from a {source_type} without a userId, ignoring")
+        record_handler_timing(f"unsupported_source:{source_type}", 0.0, False)
+        return
+    started = time.perf_counter()
+    failed = True
+    try:
+        handler(event)
+        failed = False
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        record_handler_timing(handler.__name__, time.perf_counter() - started, failed)
+
+# Profiles are never deleted, so once a user has a named one there is no need to look it up per message
+known_profiles = set()
+
+def run_after_commit(fn, *args):
+    # Replies, forwards and downloads run once the event is stored. Failures are logged and counted
+    # (handler metrics, after_commit:<name>) instead of raised: dead-lettering an event that is already
+    # committed would store it a second time on retry and send the other side effects again
+    started = time.perf_counter()
+    failed = True
+    try:
+        fn(*args)
+        failed = False
+    except Exception as e:
+        session.rollback()
+        print(f"⚠️ {fn.__name__} failed after the event was stored:", e)
+    finally:
+        record_handler_timing(f"after_commit:{fn.__name__}", time.perf_counter() - started, failed)
+
+def ensure_user_profile(user_id):
+    if user_id in known_profiles:
+        return
+    # A row without a name (follow stored before the fetch, or a fetch that failed) still needs one
+    existing_user = session.query(UserProfile.display_name, UserProfile.status).filter_by(user_id=user_id).first()
+    if existing_user and (existing_user.display_name is not None or existing_user.status == "unreachable"):
+        if len(known_profiles) >= KNOWN_PROFILES_MAX:
+            known_profiles.clear()
+        known_profiles.add(user_id)
+    else:
+        print(f"🔍 No profile name for {user_id}, fetching in the background")
+        schedule_profile_fetch(user_id)
+
+def store_customer_message(event, message_type, text, media=False):
+    # Shared by the non-text message handlers: stored alongside text so history stays complete
+    user_id = event["source"]["userId"]
+    date = datetime.fromtimestamp(int(event["timestamp"]) // 1000)
+    print(f"💬 Received {message_type} from {user_id}")
+    event_id = event.get("webhookEventId")
+    if user_id == ADMIN_ID:
+        session.add(AdminMessage(date=date, text=text, user_id=user_id, webhook_event_id=event_id))
+        session.commit()
+        return
+    message = Message(date=date, text=text, user_id=user_id, message_type=message_type, webhook_event_id=event_id)
+    session.add(message)
+    media_row = None
+    if media:
+        session.flush()
+        provider = event["message"].get("contentProvider") or {}
+        media_row = Media(
+            message_id=message.id,
+            line_message_id=event["message"]["id"],
+            source_url=provider.get("originalContentUrl") if provider.get("type") == "external" else None,
+        )
+        session.add(media_row)
+    count_user_activity({(user_id, date.date()): 1})
+    ensure_user_profile(user_id)
+    session.commit()
+    activity_leaderboard.record(user_id)
+    run_after_commit(notify_customer_message, media_row.id if media_row is not None else None, message_type, text)
+
+def notify_customer_message(media_id, message_type, text):
+    if media_id is not None:
+        schedule_media_download(media_id)
+    if FORWARD_USER_ID:
+        forward_message_to_user(FORWARD_USER_ID, f"[{message_type}] {text}")
+
+@event_handler("message", "text")
+def handle_text_message(event):
+    user_id, text, date = parse_text_event(event)
+
+    print(f"💬 Received from {user_id}: {text}")
+
+    event_id = event.get("webhookEventId")
+    if user_id == ADMIN_ID:
+        admin_message = AdminMessage(date=date, text=text, user_id=user_id, webhook_event_id=event_id)
+        session.add(admin_message)
+        session.commit()
+        run_after_commit(handle_admin_command, text)
+        return
+
+    message = Message(date=date, text=text, user_id=user_id, webhook_event_id=event_id)
+    session.add(message)
+    count_user_activity({(user_id, date.date()): 1})
+    ensure_user_profile(user_id)
+
+    session.commit()
+    activity_leaderboard.record(user_id)
+    run_after_commit(respond_to_text, event, user_id, text, date)
+
+def respond_to_text(event, user_id, text, date):
+    reply = auto_reply_engine.match(text) if AUTO_REPLY_ENABLED else None
+    if reply:
+        print(f"⚡ Auto-reply rule matched for {user_id}")
+        log_bot_reply(user_id, date, text, reply, "auto_reply")
+    else:
+        reply = answer_from_knowledge_base(user_id, text, date)
+    if reply:
+        reply_with_token(event.get("replyToken"), user_id, reply)
+
+    if FORWARD_USER_ID:
+        print(f"🟢 FORWARD_USER_ID found: {FORWARD_USER_ID}")
+        forward_message_to_user(FORWARD_USER_ID, text)
+
+@event_handler("message", "image")
+@event_handler("message", "video")
+@event_handler("message", "audio")
+@event_handler("message", "file")
+def handle_media_message(event):
+    message = event["message"]
+    label = f"{message['type']} {message['id']}"
+    if message.get("fileName"):
+        label += f" {message['fileName']}"
+    store_customer_message(event, message["type"], f"[{label}]", media=True)
+
+@event_handler("message", "sticker")
+def handle_sticker_message(event):
+    message = event["message"]
+    keywords = ", ".join(message.get("keywords") or [])
+    text = f"[sticker {message.get('packageId')}/{message.get('stickerId')}]"
+    store_customer_message(event, "sticker", f"{text} {keywords}" if keywords else text)
+
+@event_handler("message", "location")
+def handle_location_message(event):
+    message = event["message"]
+    place = " ".join(filter(None, [message.get("title"), message.get("address")]))
+    text = f"[location {message.get('latitude')},{message.get('longitude')}]"
+    store_customer_message(event, "location", f"{text} {place}" if place else text)
+
+@event_handler("postback")
+def handle_postback(event):
+    store_customer_message(event, "postback", event["postback"].get("data", ""))
+
+@event_handler("follow")
+def handle_follow(event):
+    user_id = event["source"]["userId"]
+    print(f"👋 {user_id} followed")
+    profile = session.query(UserProfile).filter_by(user_id=user_id).first()
+    if profile is None:
+        profile = UserProfile(user_id=user_id)
+        session.add(profile)
+    profile.status = "active"
+    profile.status_changed_at = datetime.fromtimestamp(int(event["timestamp"]) // 1000)
+    session.commit()
+    if profile.display_name is None:
+        # Until the fetch lands, messages from the user keep looking the name up and scheduling it again
+        known_profiles.discard(user_id)
+    # The name is fetched off the event lane so the follow is acknowledged immediately
+    run_after_commit(schedule_profile_fetch, user_id)
+
+@event_handler("unfollow")
+def handle_unfollow(event):
+    user_id = event["source"]["userId"]
+    print(f"🚪 {user_id} unfollowed")
+    # Keep the profile for history; unfollowed users can no longer be pushed to
+    session.query(UserProfile).filter_by(user_id=user_id).update({
+        "status": "unfollowed",
+        "status_changed_at": datetime.fromtimestamp(int(event["timestamp"]) // 1000),
+    })
+    session.commit()
+
+def upsert_profiles(rows):
+    # rows: [{"user_id", "display_name", "fetched_at"}]; one statement per batch, caller commits
+    if not rows:
+        return
+    dialect = {"postgresql": postgresql, "sqlite": sqlite}.get(engine.dialect.name)
+    if dialect:
+        stmt = dialect.insert(UserProfile)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id"],
+            set_={"display_name": stmt.excluded.display_name, "fetched_at": stmt.excluded.fetched_at},
+        )
+        session.execute(stmt, rows)
+        return
+    for row in rows:
+        profile = session.query(UserProfile).filter_by(user_id=row["user_id"]).first()
+        if profile:
+            profile.display_name = row["display_name"]
+            profile.fetched_at = row["fetched_at"]
+        else:
+            session.add(UserProfile(**row))
+
+def mark_profiles_unreachable(user_ids):
+    # LINE answers 404 for users who blocked the account or never added it; stop refreshing them
+    if user_ids:
+        session.query(UserProfile).filter(UserProfile.user_id.in_(user_ids)).update(
+            {"status": "unreachable", "status_changed_at": datetime.utcnow()}, synchronize_session=False
+        )
+
+line_profile_limiter = RateLimiter(PROFILE_RATE_LIMIT)
+
+profile_fetch_pool = None
+profile_fetch_pid = None
+profile_fetches_pending = set()
+profile_fetch_lock = threading.Lock()
+profile_fetch_stats = {"scheduled": 0, "fetched": 0, "missing": 0, "failed": 0}
+
+def schedule_profile_fetch(user_id):
+    global profile_fetch_pool, profile_fetch_pid
+    if not LINE_OUTBOUND_ENABLED:
+        return
+    with profile_fetch_lock:
+        if profile_fetch_pid != os.getpid():
+            # Created lazily so forked gunicorn workers each get their own threads
+            profile_fetch_pool = ThreadPoolExecutor(PROFILE_FETCH_WORKERS, thread_name_prefix="profile-fetch")
+            profile_fetch_pid = os.getpid()
+            profile_fetches_pending.clear()
+        if user_id in profile_fetches_pending:
+            return
+        profile_fetches_pending.add(user_id)
+        profile_fetch_stats["scheduled"] += 1
+    profile_fetch_pool.submit(fetch_and_store_profile, user_id)
+
+def fetch_and_store_profile(user_id):
+    outcome = "failed"
+    try:
+        profile = call_with_retry(fetch_line_profile, user_id, limiter=line_profile_limiter)
+        if profile:
+            upsert_profiles([{"user_id": user_id, "display_name": profile.get("displayName"), "fetched_at": datetime.utcnow()}])
+            session.commit()
+            print(f"👤 Saved profile for {user_id}: {profile.get('displayName')}")
+            outcome = "fetched"
+        else:
+            # Only an existing row is marked; without one the next message simply asks again
+            mark_profiles_unreachable([user_id])
+            session.commit()
+            outcome = "missing"
+    except Exception as e:
+        session.rollback()
+        # The row keeps display_name NULL, so the user's next message schedules another fetch
+        print(f"⚠️ Background profile fetch failed for {user_id}:", e)
+    finally:
+        with profile_fetch_lock:
+            profile_fetches_pending.discard(user_id)
+            profile_fetch_stats[outcome] += 1
+
+def call_with_retry(fn, *args, limiter=None, attempts=4):
+    # Retries 429s, 5xx and connection errors with exponential backoff; other errors raise
+    for attempt in range(attempts):
+        if limiter:
+            limiter.acquire()
+        try:
+            return fn(*args)
+        except requests.HTTPError as e:
+            status = e.response.status_code if e.response is not None else 500
+            if attempt == attempts - 1 or (status != 429 and status < 500):
+                raise
+        except requests.RequestException:
+            if attempt == attempts - 1:
+                raise
+        time.sleep(0.5 * 2 ** attempt)
+
+def fetch_follower_ids_page(start, page_size=1000):
+    params = {"limit": page_size}
+    if start:
+        params["start"] = start
+    response = requests.get(f"{LINE_API_BASE_URL}/v2/bot/followers/ids",
+                            headers={"Authorization": f"Bearer {LINE_ACCESS_TOKEN}"}, params=params, timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+def iter_follower_ids(limiter=None):
+    start = None
+    while True:
+        page = call_with_retry(fetch_follower_ids_page, start, limiter=limiter)
+        yield page.get("userIds", [])
+        start = page.get("next")
+        if not start:
+            return
+
+def backfill_profiles(rate=50, workers=8, batch_size=500, only_missing=True):
+    limiter = RateLimiter(rate)
+    totals = {"followers": 0, "fetched": 0, "skipped": 0, "missing": 0, "failed": 0}
+    rows = []
+    unreachable = []
+
+    def flush():
+        upsert_profiles(rows)
+        mark_profiles_unreachable(unreachable)
+        session.commit()
+        rows.clear()
+        unreachable.clear()
+
+    with ThreadPoolExecutor(workers, thread_name_prefix="profile-backfill") as pool:
+        for user_ids in iter_follower_ids(limiter):
+            totals["followers"] += len(user_ids)
+            if only_missing:
+                known = {
+                    row[0] for row in session.query(UserProfile.user_id).filter(
+                        UserProfile.user_id.in_(user_ids), UserProfile.display_name.isnot(None)
+                    )
+                }
+                session.rollback()
+                totals["skipped"] += len(known)
+                user_ids = [user_id for user_id in user_ids if user_id not in known]
+            futures = {user_id: pool.submit(call_with_retry, fetch_line_profile, user_id, limiter=limiter) for user_id in user_ids}
+            for user_id, future in futures.items():
+                try:
+                    profile = future.result()
+                except Exception as e:
+                    print(f"⚠️ Could not fetch profile for {user_id}:", e)
+                    totals["failed"] += 1
+                    continue
+                if not profile:
+                    unreachable.append(user_id)
+                    totals["missing"] += 1
+                    continue
+                rows.append({"user_id": user_id, "display_name": profile.get("displayName"), "fetched_at": datetime.utcnow()})
+                totals["fetched"] += 1
+                if len(rows) >= batch_size:
+                    flush()
+            print(f"👥 {totals['followers']} followers seen, {totals['fetched']} profiles saved")
+    flush()
+    return totals
+
+profile_refresh_stats = {"cycles": 0, "refreshed": 0, "unreachable": 0, "failed": 0, "last_cycle_s": None}
+profile_refresh_lock = threading.Lock()
+
+def claim_stale_profiles(limit):
+    # Never-fetched profiles first, then the oldest. Claiming only takes a lease (refresh_claimed_at) so
+    # other workers skip the rows; fetched_at moves on success alone, and a failed fetch is retried once
+    # the lease runs out
+    now = datetime.utcnow()
+    cutoff = now - timedelta(days=PROFILE_REFRESH_MAX_AGE_DAYS)
+    lease_cutoff = now - timedelta(seconds=PROFILE_REFRESH_CLAIM_SECONDS)
+    active = session.query(UserProfile).filter(
+        UserProfile.status == "active",
+        or_(UserProfile.refresh_claimed_at.is_(None), UserProfile.refresh_claimed_at < lease_cutoff),
+    )
+    user_ids = []
+    for condition, order in (
+        (UserProfile.fetched_at.is_(None), UserProfile.id),
+        (UserProfile.fetched_at < cutoff, UserProfile.fetched_at),
+    ):
+        if len(user_ids) >= limit:
+            break
+        rows = (
+            active.filter(condition)
+            .order_by(order)
+            .limit(limit - len(user_ids))
+            .with_for_update(skip_locked=True)
+            .with_entities(UserProfile.user_id)
+            .all()
+        )
+        user_ids.extend(row[0] for row in rows)
+    if user_ids:
+        session.query(UserProfile).filter(UserProfile.user_id.in_(user_ids)).update(
+            {"refresh_claimed_at": now}, synchronize_session=False
+        )
+    session.commit()
+    return user_ids
+
+def release_profile_claims(user_ids):
+    if user_ids:
+        session.query(UserProfile).filter(UserProfile.user_id.in_(user_ids)).update(
+            {"refresh_claimed_at": None}, synchronize_session=False
+        )
+
+def refresh_stale_profiles(limit=None, limiter=None):
+    limiter = limiter or line_profile_limiter
+    started = time.monotonic()
+    user_ids = claim_stale_profiles(limit or PROFILE_REFRESH_BATCH)
+    rows = []
+    unreachable = []
+    failed = 0
+    for user_id in user_ids:
+        try:
+            profile = call_with_retry(fetch_line_profile, user_id, limiter=limiter)
+        except Exception as e:
+            print(f"⚠️ Profile refresh failed for {user_id}:", e)
+            failed += 1
+            continue
+        if profile:
+            rows.append({"user_id": user_id, "display_name": profile.get("displayName"), "fetched_at": datetime.utcnow()})
+        else:
+            unreachable.append(user_id)
+    upsert_profiles(rows)
+    mark_profiles_unreachable(unreachable)
+    # Failed ones keep their lease, so they wait it out instead of heading the next batch again
+    release_profile_claims([row["user_id"] for row in rows] + unreachable)
+    session.commit()
+    with profile_refresh_lock:
+        profile_refresh_stats["cycles"] += 1
+        profile_refresh_stats["refreshed"] += len(rows)
+        profile_refresh_stats["unreachable"] += len(unreachable)
+        profile_refresh_stats["failed"] += failed
+        profile_refresh_stats["last_cycle_s"] = round(time.monotonic() - started, 3)
+    return len(rows), len(unreachable), failed
+
+media_store = ContentStore(MEDIA_DIR) if MEDIA_DIR else None
+media_download_pool = None
+media_download_pid = None
+media_download_slots = None
+media_stats = {"stored": 0, "deduplicated": 0, "failed": 0, "deferred": 0, "bytes": 0}
+media_stats_lock = threading.Lock()  # bumped from the event lanes and the download pool
+
+def schedule_media_download(media_id):
+    global media_download_pool, media_download_pid, media_download_slots
+    if media_store is None or not LINE_OUTBOUND_ENABLED:
+        return
+    if media_download_pid != os.getpid():
+        # Created lazily so forked gunicorn workers each get their own threads
+        media_download_pool = ThreadPoolExecutor(MEDIA_DOWNLOAD_WORKERS, thread_name_prefix="media-download")
+        media_download_slots = threading.BoundedSemaphore(MEDIA_DOWNLOAD_WORKERS + MEDIA_DOWNLOAD_QUEUE)
+        media_download_pid = os.getpid()
+    if not media_download_slots.acquire(blocking=False):
+        # Queue full: the row stays pending for 'flask media retry'
+        count_stat(media_stats, media_stats_lock, "deferred")
+        return
+    media_download_pool.submit(run_media_download, media_id)
+
+def run_media_download(media_id):
+    try:
+        download_media(media_id)
+    except Exception as e:
+        print(f"⚠️ Media download failed for media {media_id}:", e)
+    finally:
+        media_download_slots.release()
+
+def download_media(media_id):
+    media = session.get(Media, media_id)
+    if media is None or media.status == "stored":
+        session.rollback()
+        return
+    url = media.source_url or f"{LINE_DATA_API_BASE_URL}/v2/bot/message/{media.line_message_id}/content"
+    headers = {} if media.source_url else {"Authorization": f"Bearer {LINE_ACCESS_TOKEN}"}
+    media.attempts += 1
+    try:
+        # stream=True keeps one chunk in memory at a time, whatever the file size
+        with requests.get(url, headers=headers, stream=True, timeout=(10, 60)) as response:
+            if response.status_code != 200:
+                raise RuntimeError(f"content endpoint returned {response.status_code}")
+            sha, size, created = media_store.save(response.iter_content(64 * 1024), MEDIA_MAX_MB * 1024 * 1024)
+            media.content_type = response.headers.get("Content-Type")
+        media.sha256 = sha
+        media.size = size
+        media.status = "stored"
+        media.stored_at = datetime.utcnow()
+        media.last_error = None
+        session.commit()
+        with media_stats_lock:
+            media_stats["stored" if created else "deduplicated"] += 1
+            media_stats["bytes"] += size if created else 0
+        print(f"🖼️ Stored media {media_id} ({size} bytes{'' if created else ', duplicate'})")
+    except Exception as e:
+        media.status = "failed"
+        media.last_error = str(e)
+        session.commit()
+        count_stat(media_stats, media_stats_lock, "failed")
+        raise
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
     if not is_valid_signature(request):
         print("❌ Invalid signature: possible spoofed request")
         abort(403)
+    archive_raw_body("line", request.get_data(as_text=True))
 
     try:
         data = request.get_json()
         print("📩 Raw Payload:", data)
 
         if "events" in data:
-            for event in data["events"]:
-                if event["type"] == "message" and event["message"]["type"] == "text":
-                    user_id = event["source"]["userId"]
-                    text = event["message"]["text"]
-                    timestamp = int(event["timestamp"]) // 1000
-                    date = datetime.fromtimestamp(timestamp)
-
-                    print(f"💬 Received from {user_id}: {text}")
-
-                    if user_id == ADMIN_ID:
-                        admin_message = AdminMessage(date=date, text=text, user_id=user_id)
-                        session.add(admin_message)
-                        session.commit()
-                        continue
-
-                    # if user_id == FORWARD_USER_ID:
-#     reply = call_chatgpt(text)
-#     reply_to_line_user(user_id, reply)
-#     chat_log = ChatGPTLog(date=date, user_id=user_id, prompt=text, response=reply)
-#     session.add(chat_log)
-#     session.commit()
-                        continue
-
-                    message = Message(date=date, text=text, user_id=user_id)
-                    session.add(message)
-
-                    existing_user = session.query(UserProfile).filter_by(user_id=user_id).first()
-                    if not existing_user:
-                        print(f"🔍 No profile found for {user_id}, trying to fetch...")
-                        display_name = get_user_name(user_id)
-                        print(f"📛 Fetched display name: {display_name}")
-                        if display_name:
-                            print(f"👤 Saving user profile: {display_name}")
-                            new_user = UserProfile(user_id=user_id, display_name=display_name)
-                            session.add(new_user)
-
-                    session.commit()
-
-                    if FORWARD_USER_ID:
-                        print(f"🟢 FORWARD_USER_ID found: {FORWARD_USER_ID}")
-                        forward_message_to_user(FORWARD_USER_ID, text)
+            if INBOUND_QUEUE_ENABLED:
+                enqueue_inbound("line", data["events"])
+            else:
+                event_executor.map_ordered(data["events"], event_key, handle_event_or_dead_letter)
 
         return jsonify({"status": "ok"}), 200
     except Exception as e:
@@ -271,63 +1414,1429 @@ def is_valid_myshop_signature(req):
     ).hexdigest()
     return hmac.compare_digest(signature, expected_signature)
 
+def order_contribution(day, status, total_price, items):
+    # What one order adds to the rollups; items are (sku, quantity, unit price) tuples
+    by_status = {(day, status or ""): (1, total_price or 0)}
+    by_sku = {}
+    if status not in ROLLUP_EXCLUDED_STATUSES:
+        for sku, quantity, price in items:
+            units, revenue = by_sku.get((day, sku or ""), (0, 0))
+            by_sku[(day, sku or "")] = (units + (quantity or 0), revenue + (quantity or 0) * (price or 0))
+    return by_status, by_sku
+
+@lru_cache(maxsize=None)
+def upsert_increment_statement(model, key_columns, value_columns):
+    # SQLAlchemy never caches the dialect upsert constructs (inherit_cache = False) and would recompile
+    # them on every call; render once to text, which caches and runs as a plain executemany
+    dialect = {"postgresql": postgresql, "sqlite": sqlite}.get(engine.dialect.name)
+    if dialect is None:
+        return None
+    table = model.__table__
+    columns = key_columns + value_columns
+    stmt = dialect.insert(table).values({c: bindparam(c) for c in columns})
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(key_columns),
+        set_={c: table.c[c] + stmt.excluded[c] for c in value_columns},
+    )
+    sql = str(stmt.compile(dialect=type(engine.dialect)(paramstyle="named")))
+    return sql_text(sql).bindparams(*(bindparam(c, type_=table.c[c].type) for c in columns))
+
+def increment_rows(model, key_columns, value_columns, rows):
+    # rows: {key tuple: value tuple}; INSERT ... ON CONFLICT DO UPDATE adds the values
+    rows = {k: v for k, v in rows.items() if any(v)}
+    if not rows:
+        return
+    values = [dict(zip(key_columns, k), **dict(zip(value_columns, v))) for k, v in rows.items()]
+    stmt = upsert_increment_statement(model, tuple(key_columns), tuple(value_columns))
+    if stmt is not None:
+        session.execute(stmt, values)
+        return
+    for row in values:
+        existing = session.get(model, tuple(row[c] for c in key_columns))
+        if existing:
+            for c in value_columns:
+                setattr(existing, c, getattr(existing, c) + row[c])
+        else:
+            session.add(model(**row))
+
+def apply_rollup_delta(previous, current):
+    for index, (model, key_columns, value_columns) in enumerate((
+        (SalesDailyStatus, ["day", "order_status"], ["orders", "revenue"]),
+        (SalesDailySku, ["day", "sku"], ["units", "revenue"]),
+    )):
+        delta = {}
+        for sign, contribution in ((-1, previous), (1, current)):
+            if contribution is None:
+                continue
+            for key, values in contribution[index].items():
+                totals = delta.get(key, (0,) * len(values))
+                delta[key] = tuple(t + sign * v for t, v in zip(totals, values))
+        increment_rows(model, key_columns, value_columns, delta)
+
+def order_rollup_day(order):
+    # The day the order was placed, not the day of its latest event or of its arrival: a status change only moves
+    # the order between status buckets of that day. Orders without a parsable event time fall back to date
+    return to_utc(order.first_event_time).date() if order.first_event_time else order.date.date()
+
+def order_item_rollup_values(item):
+    price = item.get("discountedPrice") or item.get("price") or 0
+    return item.get("sku"), item.get("quantity", 0), price
+
+def compress_payload(data):
+    return zlib.compress(json.dumps(data, ensure_ascii=False).encode("utf-8"), 6)
+
+def decompress_payload(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+def parse_event_time(value):
+    # MyShop sends ISO 8601 with a Z suffix; epoch milliseconds are accepted too. Returns aware UTC or None
+    if value is None or value == "":
+        return None
+    try:
+        if isinstance(value, (int, float)) or str(value).isdigit():
+            return datetime.fromtimestamp(int(value) / 1000, tz=timezone.utc)
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except (ValueError, OverflowError, OSError):
+        return None
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed.astimezone(timezone.utc)
+
+# Order column -> path to it in a MyShop payload; what a payload leaves out is stored as NULL until an event carries it
+MYSHOP_ORDER_FIELDS = {
+    "order_number": ("orderNumber",),
+    "order_status": ("orderStatus",),
+    "event_name": ("event", "name"),
+    "event_timestamp": ("event", "timestamp"),
+    "payment_method": ("paymentMethod",),
+    "payment_status": ("paymentStatus",),
+    "recipient_name": ("shippingAddress", "recipientName"),
+    "phone_number": ("shippingAddress", "phoneNumber"),
+    "address": ("shippingAddress", "address"),
+    "shipment_company_name": ("shipmentDetail", "shipmentCompanyNameTh"),
+    "tracking_number": ("shipmentDetail", "trackingNumber"),
+    "subtotal_price": ("subtotalPrice",),
+    "total_price": ("totalPrice",),
+    "shipment_price": ("shipmentPrice",),
+    "is_cod": ("shipmentDetail", "isCod"),
+    "is_gift": ("isGift",),
+}
+# Describe the newest event applied to the order, so a late event never writes them
+LATEST_EVENT_FIELDS = {"event_name", "event_timestamp", "event_time"}
+
+def myshop_order_fields(data, present_only=False):
+    # present_only leaves out what the payload doesn't carry, so a status-only event can't blank the rest of the order
+    fields = {}
+    for name, path in MYSHOP_ORDER_FIELDS.items():
+        parent = data
+        for key in path[:-1]:
+            parent = parent.get(key) or {}
+        value = parent.get(path[-1])
+        if value is not None or not present_only:
+            fields[name] = value
+    if "event_timestamp" in fields:
+        fields["event_time"] = parse_event_time(fields["event_timestamp"])
+    return fields
+
+def is_older_event(order, event_time):
+    return event_time is not None and order.event_time is not None and event_time < to_utc(order.event_time)
+
+# Built once: a reused statement keeps its cache key, which SQLAlchemy would otherwise regenerate on every event
+LOCK_ORDER = select(LineMyShopOrder).where(LineMyShopOrder.order_number == bindparam("order_number")).with_for_update()
+ORDER_ITEM_ROLLUP_VALUES = select(
+    LineMyShopOrderItem.sku, LineMyShopOrderItem.quantity,
+    func.coalesce(func.nullif(LineMyShopOrderItem.discounted_price, 0), LineMyShopOrderItem.price),
+).where(LineMyShopOrderItem.order_id == bindparam("order_id"))
+DELETE_ORDER_ITEMS = LineMyShopOrderItem.__table__.delete().where(LineMyShopOrderItem.order_id == bindparam("order_id"))
+INSERT_ORDER_ITEMS = LineMyShopOrderItem.__table__.insert()
+INSERT_ORDER_PAYLOAD = LineMyShopOrderPayload.__table__.insert()
+
+def lock_order(order_number):
+    return session.execute(LOCK_ORDER, {"order_number": order_number}).scalars().first()
+
+def ingest_myshop_order(data, commit=True):
+    try:
+        return upsert_myshop_order(data, commit)
+    except IntegrityError:
+        if not commit:
+            raise
+        # Lost the race to insert a new order number (FOR UPDATE can't lock a row that doesn't exist yet):
+        # the unique index rejected our row, and this time the update path finds the winner's
+        session.rollback()
+        return upsert_myshop_order(data, commit)
+
+def upsert_myshop_order(data, commit=True):
+    # One row per order number: later events update it and move its rollup contribution
+    order_number = data.get("orderNumber")
+    order = lock_order(order_number) if order_number else None
+    previous = None
+    old_items = []
+    if order is None:
+        order = LineMyShopOrder()
+        session.add(order)
+    else:
+        old_items = session.execute(ORDER_ITEM_ROLLUP_VALUES, {"order_id": order.id}).all()
+        previous = order_contribution(order_rollup_day(order), order.order_status, order.total_price, old_items)
+
+    fields = myshop_order_fields(data, present_only=previous is not None)
+    event_time = fields.get("event_time")
+    if event_time is not None and (order.first_event_time is None or event_time < to_utc(order.first_event_time)):
+        order.first_event_time = event_time
+    items_payload = data.get("orderItems")
+    if previous is not None and is_older_event(order, fields.get("event_time")):
+        # Late delivery, DLQ retry or replay: the payload is kept, and it may fill in what the order still lacks,
+        # but status, totals and items stay as the newer event left them
+        print(f"⏪ Event for order {order_number} is older than the one applied; only filling in missing fields")
+        fields = {
+            name: value for name, value in fields.items()
+            if name not in LATEST_EVENT_FIELDS and getattr(order, name) is None
+        }
+        if old_items:
+            items_payload = None
+    for name, value in fields.items():
+        current = getattr(order, name)
+        if isinstance(value, datetime) and current is not None:
+            current = to_utc(current)
+        if current != value:
+            setattr(order, name, value)
+    if order.id is None:
+        session.flush()  # get order.id for item linkage
+    # Plain executemany inserts: the ORM unit of work costs more than the statements themselves here
+    session.execute(INSERT_ORDER_PAYLOAD, [{
+        "order_id": order.id,
+        "event_name": data.get("event", {}).get("name"),
+        "event_timestamp": data.get("event", {}).get("timestamp"),
+        "payload": compress_payload(data),
+    }])
+
+    # Status-only events carry no items; keep what the order already has
+    if previous is not None and items_payload is not None:
+        session.execute(DELETE_ORDER_ITEMS, {"order_id": order.id})
+    if items_payload:
+        session.execute(INSERT_ORDER_ITEMS, [{
+            "order_id": order.id,
+            "name": item.get("name"),
+            "sku": item.get("sku"),
+            "quantity": item.get("quantity", 0),
+            "price": item.get("price", 0),
+            "discounted_price": item.get("discountedPrice", 0),
+            "barcode": item.get("barcode"),
+            "weight": item.get("weight", 0),
+            "image_url": item.get("imageURL"),
+        } for item in items_payload])
+    session.expire(order, ["items", "payloads"])
+
+    if items_payload is None:
+        current_items = old_items
+    else:
+        current_items = [order_item_rollup_values(item) for item in items_payload]
+    current = order_contribution(order_rollup_day(order), order.order_status, order.total_price, current_items)
+    apply_rollup_delta(previous, current)
+
+    if commit:
+        session.commit()
+    return order
+
 @app.route('/sassy-line-myshop-webhook', methods=['POST'])
 def sassy_line_myshop_webhook():
     if not is_valid_myshop_signature(request):
         print("❌ Invalid LINE MyShop signature")
         abort(403)
+    archive_raw_body("myshop", request.get_data(as_text=True))
 
     try:
         data = request.get_json()
         print("📦 LINE MyShop Payload:", data)
 
-        order = LineMyShopOrder(
-            order_number = data.get("orderNumber"),
-            order_status = data.get("orderStatus"),
-            event_name = data.get("event", {}).get("name"),
-            event_timestamp = data.get("event", {}).get("timestamp"),
-            payment_method = data.get("paymentMethod"),
-            payment_status = data.get("paymentStatus"),
-            recipient_name = data.get("shippingAddress", {}).get("recipientName"),
-            phone_number = data.get("shippingAddress", {}).get("phoneNumber"),
-            address = data.get("shippingAddress", {}).get("address"),
-            shipment_company_name = data.get("shipmentDetail", {}).get("shipmentCompanyNameTh"),
-            tracking_number = data.get("shipmentDetail", {}).get("trackingNumber"),
-            subtotal_price = data.get("subtotalPrice", 0),
-            total_price = data.get("totalPrice", 0),
-            shipment_price = data.get("shipmentPrice", 0),
-            is_cod = data.get("shipmentDetail", {}).get("isCod", False),
-            is_gift = data.get("isGift", False),
-            raw_data = str(data)
+        if INBOUND_QUEUE_ENABLED:
+            enqueue_inbound("myshop", [data])
+        else:
+            try:
+                ingest_myshop_order(data)
+            except Exception as e:
+                session.rollback()
+                dead_letter("myshop", data, e)
+        return jsonify({"status": "received"}), 200
+
+    except Exception as e:
+        print("❌ Error in LINE MyShop webhook:", e)
+        session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+def enqueue_inbound(source, items):
+    now = datetime.utcnow()
+    rows = [{"source": source, "payload": json.dumps(item, ensure_ascii=False), "status": "pending",
+             "attempts": 0, "available_at": now, "received_at": now} for item in items]
+    if rows:
+        session.execute(insert(InboundEvent), rows)
+        session.commit()
+    print(f"📥 Queued {len(rows)} {source} event(s)")
+
+def claim_inbound_events(worker_id, batch_size):
+    # SKIP LOCKED lets any number of workers on any node claim disjoint batches
+    now = datetime.utcnow()
+    with Session() as claim_session, claim_session.begin():
+        rows = (
+            claim_session.query(InboundEvent)
+            .filter(or_(
+                and_(InboundEvent.status == "pending", InboundEvent.available_at <= now),
+                and_(InboundEvent.status == "processing", InboundEvent.locked_until < now),
+            ))
+            .order_by(InboundEvent.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .all()
         )
+        claimed = []
+        for row in rows:
+            if row.attempts >= INBOUND_MAX_ATTEMPTS:
+                # Visibility timeout expired too often: the worker keeps dying on it
+                row.status = "dead"
+                row.last_error = row.last_error or "visibility timeout expired"
+                continue
+            row.status = "processing"
+            row.attempts += 1
+            row.locked_until = now + timedelta(seconds=INBOUND_VISIBILITY_TIMEOUT)
+            row.locked_by = worker_id
+            claimed.append((row.id, row.source, row.payload, row.attempts))
+    return claimed
 
-        session.add(order)
-        session.flush()  # get order.id for item linkage
+def finish_inbound_event(event_id, worker_id, attempts, error=None):
+    with Session() as finish_session, finish_session.begin():
+        row = finish_session.get(InboundEvent, event_id)
+        if row is None or row.locked_by != worker_id:
+            return  # lease expired and another worker took it over
+        row.locked_until = None
+        if error is None:
+            row.status = "done"
+            row.processed_at = datetime.utcnow()
+        elif attempts >= INBOUND_MAX_ATTEMPTS:
+            row.status = "dead"
+            row.last_error = error
+        else:
+            row.status = "pending"
+            row.last_error = error
+            row.available_at = datetime.utcnow() + timedelta(seconds=2 ** attempts)
 
-        for item in data.get("orderItems", []):
-            order_item = LineMyShopOrderItem(
-                order_id = order.id,
-                name = item.get("name"),
-                sku = item.get("sku"),
-                quantity = item.get("quantity", 0),
-                price = item.get("price", 0),
-                discounted_price = item.get("discountedPrice", 0),
-                barcode = item.get("barcode"),
-                weight = item.get("weight", 0),
-                image_url = item.get("imageURL"),
-                raw_data = str(item)
-            )
-            session.add(order_item)
+def process_inbound_event(source, payload):
+    data = json.loads(payload)
+    if source == "line":
+        handle_event(data)
+    elif source == "myshop":
+        try:
+            ingest_myshop_order(data)
+        except Exception:
+            session.rollback()
+            raise
+    else:
+        raise ValueError(f"Unknown inbound event source: {source}")
 
-        session.commit()
-        return jsonify({"status": "received"}), 200
+def inbound_queue_key(claimed):
+    event_id, source, payload, attempts = claimed
+    if source == "line":
+        return event_key(json.loads(payload))
+    order_number = json.loads(payload).get("orderNumber")
+    return f"myshop:{order_number or event_id}"
+
+def run_inbound_batch(worker_id, batch_size):
+    claimed = claim_inbound_events(worker_id, batch_size)
+    futures = [
+        (item, event_executor.submit(inbound_queue_key(item), process_inbound_event, item[1], item[2]))
+        for item in claimed
+    ]
+    failed = 0
+    for (event_id, source, payload, attempts), future in futures:
+        error = None
+        try:
+            future.result()
+        except Exception as e:
+            print(f"❌ Inbound event {event_id} failed (attempt {attempts}):", e)
+            error = str(e)
+            failed += 1
+        finish_inbound_event(event_id, worker_id, attempts, error)
+    return len(claimed), failed
+
+def inbound_queue_stats():
+    counts = dict(session.query(InboundEvent.status, func.count(InboundEvent.id)).group_by(InboundEvent.status).all())
+    session.rollback()
+    return counts
+
+METRIC_SOURCES["inbound_queue"] = inbound_queue_stats
+
+queue_cli = AppGroup("queue", help="Inbound event queue workers.")
+
+@queue_cli.command("work")
+@click.option("--batch-size", default=100, show_default=True)
+@click.option("--poll-interval", default=1.0, show_default=True, help="Seconds to sleep when the queue is empty.")
+def queue_work(batch_size, poll_interval):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    print(f"👷 Inbound queue worker {worker_id} started")
+    while not stopping:
+        processed, failed = run_inbound_batch(worker_id, batch_size)
+        if processed:
+            print(f"✅ Processed {processed - failed}/{processed} inbound event(s)")
+        else:
+            time.sleep(poll_interval)
+    print(f"👋 Inbound queue worker {worker_id} stopped")
 
+@queue_cli.command("stats")
+def queue_stats():
+    click.echo(json.dumps(inbound_queue_stats()))
+
+@queue_cli.command("requeue-dead")
+def queue_requeue_dead():
+    count = (
+        session.query(InboundEvent)
+        .filter(InboundEvent.status == "dead")
+        .update({"status": "pending", "attempts": 0, "available_at": datetime.utcnow()})
+    )
+    session.commit()
+    click.echo(f"♻️ Requeued {count} dead event(s)")
+
+@queue_cli.command("purge")
+@click.option("--older-than-days", default=7, show_default=True)
+def queue_purge(older_than_days):
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    count = (
+        session.query(InboundEvent)
+        .filter(InboundEvent.status == "done", InboundEvent.processed_at < cutoff)
+        .delete()
+    )
+    session.commit()
+    click.echo(f"🧹 Purged {count} processed event(s)")
+
+app.cli.add_command(queue_cli)
+
+def dlq_backoff(attempts):
+    return timedelta(seconds=min(DLQ_BASE_DELAY * 2 ** (attempts - 1), DLQ_MAX_DELAY))
+
+def dead_letter(source, item, error):
+    print(f"🪦 Dead-lettering {source} event:", error)
+    now = datetime.utcnow()
+    # Separate session: the caller's session is rolled back and may be unusable
+    with Session() as dlq_session, dlq_session.begin():
+        dlq_session.add(DeadLetterEvent(
+            source=source,
+            payload=json.dumps(item, ensure_ascii=False),
+            error=str(error),
+            attempts=1,
+            first_failed_at=now,
+            last_failed_at=now,
+            next_attempt_at=now + dlq_backoff(1),
+        ))
+
+def handle_event_or_dead_letter(event):
+    # One bad event must not fail the whole payload
+    try:
+        handle_event(event)
     except Exception as e:
-        print("❌ Error in LINE MyShop webhook:", e)
+        dead_letter("line", event, e)
+
+def retry_dead_letters(limit=100, rate=None, due_only=True, include_abandoned=False, after_id=0):
+    statuses = ["pending", "abandoned"] if include_abandoned else ["pending"]
+    query = session.query(DeadLetterEvent).filter(
+        DeadLetterEvent.status.in_(statuses), DeadLetterEvent.id > after_id
+    )
+    if due_only:
+        query = query.filter(DeadLetterEvent.next_attempt_at <= datetime.utcnow())
+    entries = [(e.id, e.source, e.payload) for e in query.order_by(DeadLetterEvent.id).limit(limit)]
+    session.rollback()
+
+    resolved = failed = 0
+    for entry_id, source, payload in entries:
+        started = time.monotonic()
+        error = None
+        try:
+            process_inbound_event(source, payload)
+        except Exception as e:
+            error = e
+        with Session() as dlq_session, dlq_session.begin():
+            entry = dlq_session.get(DeadLetterEvent, entry_id)
+            now = datetime.utcnow()
+            if error is None:
+                entry.status = "resolved"
+                entry.resolved_at = now
+                resolved += 1
+            else:
+                entry.attempts += 1
+                entry.error = str(error)
+                entry.last_failed_at = now
+                entry.next_attempt_at = now + dlq_backoff(entry.attempts)
+                entry.status = "abandoned" if entry.attempts >= DLQ_MAX_ATTEMPTS else "pending"
+                failed += 1
+        if rate:
+            time.sleep(max(0.0, 1.0 / rate - (time.monotonic() - started)))
+    if entries:
+        print(f"🔁 Dead-letter retry: {resolved} resolved, {failed} failed")
+    return resolved, failed, (entries[-1][0] if entries else None)
+
+def dead_letter_stats():
+    counts = dict(session.query(DeadLetterEvent.status, func.count(DeadLetterEvent.id)).group_by(DeadLetterEvent.status).all())
+    session.rollback()
+    return counts
+
+METRIC_SOURCES["dead_letters"] = dead_letter_stats
+
+@app.before_request
+def start_background_jobs():
+    # Normally started from gunicorn's post_fork hook; this covers other servers
+    job_scheduler.start()
+
+dlq_cli = AppGroup("dlq", help="Dead-lettered webhook events.")
+
+@dlq_cli.command("stats")
+def dlq_stats():
+    click.echo(json.dumps(dead_letter_stats()))
+
+@dlq_cli.command("list")
+@click.option("--status", default="pending", show_default=True)
+@click.option("--limit", default=20, show_default=True)
+def dlq_list(status, limit):
+    entries = (
+        session.query(DeadLetterEvent)
+        .filter(DeadLetterEvent.status == status)
+        .order_by(DeadLetterEvent.id)
+        .limit(limit)
+    )
+    for e in entries:
+        click.echo(f"{e.id}\t{e.source}\tattempts={e.attempts}\tnext={e.next_attempt_at}\t{e.error}")
+
+@dlq_cli.command("retry")
+@click.option("--limit", default=100, show_default=True)
+def dlq_retry(limit):
+    """Retry entries whose backoff has elapsed."""
+    resolved, failed, _ = retry_dead_letters(limit=limit)
+    click.echo(f"resolved={resolved} failed={failed}")
+
+@dlq_cli.command("replay")
+@click.option("--rate", default=10.0, show_default=True, help="Events per second.")
+@click.option("--limit", default=1000, show_default=True)
+@click.option("--batch-size", default=100, show_default=True)
+@click.option("--include-abandoned", is_flag=True, help="Also replay entries that ran out of attempts.")
+def dlq_replay(rate, limit, batch_size, include_abandoned):
+    """Replay dead-lettered events now, ignoring their backoff."""
+    total_resolved = total_failed = 0
+    last_id = 0
+    while total_resolved + total_failed < limit:
+        resolved, failed, last_id = retry_dead_letters(
+            limit=min(batch_size, limit - total_resolved - total_failed), rate=rate,
+            due_only=False, include_abandoned=include_abandoned, after_id=last_id,
+        )
+        total_resolved += resolved
+        total_failed += failed
+        if last_id is None:
+            break
+    click.echo(f"resolved={total_resolved} failed={total_failed}")
+
+app.cli.add_command(dlq_cli)
+
+def encode_cursor(date, row_id):
+    return base64.urlsafe_b64encode(f"{date.isoformat()}|{row_id}".encode()).decode()
+
+def decode_cursor(cursor):
+    date, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(date), int(row_id)
+
+def parse_iso_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, description=f"Invalid {name}: expected an ISO date/time")
+
+def escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def search_messages(q, user_id=None, since=None, until=None, limit=50, cursor=None):
+    query = session.query(Message)
+    fts_terms = []
+    for term in q.split():
+        # Trigram indexes can only serve terms of three or more characters
+        if SEARCH_BACKEND == "fts5" and len(term) >= 3:
+            fts_terms.append('"' + term.replace('"', '""') + '"')
+        else:
+            query = query.filter(Message.text.ilike(f"%{escape_like(term)}%", escape="\\"))
+    if fts_terms:
+        match = sql_text("SELECT rowid FROM messages_fts WHERE messages_fts MATCH :match")
+        match = match.bindparams(match=" AND ".join(fts_terms)).columns(rowid=Integer)
+        query = query.filter(Message.id.in_(match))
+    if user_id:
+        query = query.filter(Message.user_id == user_id)
+    if since:
+        query = query.filter(Message.date >= since)
+    if until:
+        query = query.filter(Message.date < until)
+    if cursor:
+        cursor_date, cursor_id = cursor
+        query = query.filter(tuple_(Message.date, Message.id) < tuple_(cursor_date, cursor_id))
+    rows = query.order_by(Message.date.desc(), Message.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1].date, rows[limit - 1].id) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+@app.route('/search', methods=['GET'])
+def search():
+    require_admin_token()
+    q = request.args.get("q", "").strip()
+    if not q:
+        abort(400, description="q is required")
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 200)
+    cursor = request.args.get("cursor")
+    try:
+        cursor = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        abort(400, description="Invalid cursor")
+    rows, next_cursor = search_messages(
+        q,
+        user_id=request.args.get("user_id"),
+        since=parse_iso_arg("since"),
+        until=parse_iso_arg("until"),
+        limit=limit,
+        cursor=cursor,
+    )
+    session.rollback()
+    return jsonify({
+        "results": [
+            {"id": m.id, "date": m.date.isoformat(), "user_id": m.user_id, "text": m.text}
+            for m in rows
+        ],
+        "next_cursor": next_cursor,
+    })
+
+# kind, model, rank: rank breaks ties between sources with the same timestamp. admin_messages is not a
+# source: it holds the admin's commands to the bot, and which customer (if any) they concern isn't recorded
+CONVERSATION_SOURCES = [
+    ("inbound", Message, 0),
+    ("bot", ChatGPTLog, 1),
+]
+
+def encode_conversation_cursor(date, rank, row_id):
+    return base64.urlsafe_b64encode(f"{date.isoformat()}|{rank}|{row_id}".encode()).decode()
+
+def decode_conversation_cursor(cursor):
+    date, rank, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(date), int(rank), int(row_id)
+
+def conversation_page_keys(user_id, limit, cursor=None):
+    # Index-only seek on (user_id, date, id) per source, merged newest first
+    streams = []
+    for kind, model, rank in CONVERSATION_SOURCES:
+        query = session.query(model.date, model.id).filter(model.user_id == user_id)
+        if cursor:
+            cursor_date, cursor_rank, cursor_id = cursor
+            if rank < cursor_rank:
+                query = query.filter(model.date <= cursor_date)
+            elif rank > cursor_rank:
+                query = query.filter(model.date < cursor_date)
+            else:
+                query = query.filter(tuple_(model.date, model.id) < tuple_(cursor_date, cursor_id))
+        rows = query.order_by(model.date.desc(), model.id.desc()).limit(limit + 1).all()
+        streams.append([(date, rank, row_id, kind) for date, row_id in rows])
+    merged = list(heapq.merge(*streams, reverse=True))
+    return merged[:limit], len(merged) > limit
+
+def conversation_item(kind, row):
+    item = {"kind": kind, "id": row.id, "date": row.date.isoformat()}
+    if kind == "bot":
+        item["prompt"] = row.prompt
+        item["text"] = row.response
+        item["source"] = row.source
+        if row.faq_entry_id is not None:
+            item["faq_entry_id"] = row.faq_entry_id
+    else:
+        item["text"] = row.text
+    if kind == "inbound":
+        item["message_type"] = row.message_type
+    return item
+
+@app.route('/users/<user_id>/conversation', methods=['GET'])
+def conversation(user_id):
+    require_admin_token()
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 200)
+    cursor = request.args.get("before")
+    try:
+        cursor = decode_conversation_cursor(cursor) if cursor else None
+    except ValueError:
+        abort(400, description="Invalid cursor")
+
+    keys, has_more = conversation_page_keys(user_id, limit, cursor)
+    next_cursor = encode_conversation_cursor(*keys[-1][:3]) if has_more else None
+    etag = hashlib.sha1(repr([(k[3], k[2]) for k in keys] + [next_cursor]).encode()).hexdigest()
+    if etag in request.if_none_match:
         session.rollback()
-        return jsonify({"status": "error", "message": str(e)}), 500
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+
+    rows = {}
+    for kind, model, rank in CONVERSATION_SOURCES:
+        ids = [k[2] for k in keys if k[3] == kind]
+        if ids:
+            rows.update({(kind, r.id): r for r in session.query(model).filter(model.id.in_(ids))})
+    items = [conversation_item(kind, rows[(kind, row_id)]) for _, _, row_id, kind in keys]
+    session.rollback()
+
+    def generate():
+        yield '{"user_id": %s, "items": [' % json.dumps(user_id)
+        for n, item in enumerate(items):
+            yield ("," if n else "") + json.dumps(item, ensure_ascii=False)
+        yield '], "next_cursor": %s}' % json.dumps(next_cursor)
+
+    return Response(generate(), mimetype="application/json", headers={"ETag": f'"{etag}"'})
+
+EXPORT_MESSAGE_COLUMNS = ["id", "date", "user_id", "message_type", "text"]
+EXPORT_ORDER_COLUMNS = [
+    "id", "order_number", "order_status", "event_name", "event_timestamp", "payment_method",
+    "payment_status", "recipient_name", "phone_number", "address", "shipment_company_name",
+    "tracking_number", "subtotal_price", "total_price", "shipment_price", "is_cod", "is_gift", "date",
+]
+EXPORT_ITEM_COLUMNS = ["id", "name", "sku", "quantity", "price", "discounted_price", "barcode", "weight", "image_url"]
+EXPORT_YIELD_PER = 2000
+
+def export_message_records(stream_session, since, until):
+    columns = [getattr(Message, c) for c in EXPORT_MESSAGE_COLUMNS]
+    query = select(*columns).order_by(Message.id)
+    if since:
+        query = query.where(Message.date >= since)
+    if until:
+        query = query.where(Message.date < until)
+    # yield_per streams through a server-side cursor on PostgreSQL
+    result = stream_session.execute(query.execution_options(yield_per=EXPORT_YIELD_PER))
+    for row in result:
+        yield dict(zip(EXPORT_MESSAGE_COLUMNS, row))
+
+def export_order_records(stream_session, since, until):
+    # One ordered outer join instead of a query per order; rows are regrouped as they stream
+    order_columns = [getattr(LineMyShopOrder, c) for c in EXPORT_ORDER_COLUMNS]
+    item_columns = [getattr(LineMyShopOrderItem, c) for c in EXPORT_ITEM_COLUMNS]
+    query = (
+        select(*order_columns, *item_columns)
+        .outerjoin(LineMyShopOrderItem, LineMyShopOrderItem.order_id == LineMyShopOrder.id)
+        .order_by(LineMyShopOrder.id, LineMyShopOrderItem.id)
+    )
+    if since:
+        query = query.where(LineMyShopOrder.date >= since)
+    if until:
+        query = query.where(LineMyShopOrder.date < until)
+    result = stream_session.execute(query.execution_options(yield_per=EXPORT_YIELD_PER))
+    current = None
+    split = len(EXPORT_ORDER_COLUMNS)
+    for row in result:
+        if current is None or current["id"] != row[0]:
+            if current is not None:
+                yield current
+            current = dict(zip(EXPORT_ORDER_COLUMNS, row[:split]))
+            current["items"] = []
+        if row[split] is not None:
+            current["items"].append(dict(zip(EXPORT_ITEM_COLUMNS, row[split:])))
+    if current is not None:
+        yield current
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def export_lines(kind, records, fmt):
+    if fmt == "ndjson":
+        for record in records:
+            if kind == "orders":
+                record["items"] = [{k: export_value(v) for k, v in item.items()} for item in record["items"]]
+            yield json.dumps({k: export_value(v) for k, v in record.items()}, ensure_ascii=False) + "\n"
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if kind == "orders":
+        # CSV is flat: one line per item, order columns repeated
+        writer.writerow(EXPORT_ORDER_COLUMNS + ["item_" + c for c in EXPORT_ITEM_COLUMNS])
+    else:
+        writer.writerow(EXPORT_MESSAGE_COLUMNS)
+    for record in records:
+        if kind == "orders":
+            head = [export_value(record[c]) for c in EXPORT_ORDER_COLUMNS]
+            for item in record["items"] or [dict.fromkeys(EXPORT_ITEM_COLUMNS)]:
+                writer.writerow(head + [item[c] for c in EXPORT_ITEM_COLUMNS])
+        else:
+            writer.writerow([export_value(record[c]) for c in EXPORT_MESSAGE_COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def export_chunks(kind, fmt, since=None, until=None, compress=False, chunk_size=64 * 1024):
+    stream_session = Session()
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31 = gzip framing
+    try:
+        records = export_order_records if kind == "orders" else export_message_records
+        pending = []
+        size = 0
+        for line in export_lines(kind, records(stream_session, since, until), fmt):
+            data = line.encode("utf-8")
+            pending.append(data)
+            size += len(data)
+            if size >= chunk_size:
+                chunk = b"".join(pending)
+                pending, size = [], 0
+                chunk = compressor.compress(chunk) if compressor else chunk
+                if chunk:
+                    yield chunk
+        chunk = b"".join(pending)
+        if compressor:
+            chunk = compressor.compress(chunk) + compressor.flush()
+        if chunk:
+            yield chunk
+    finally:
+        stream_session.close()
+
+def export_args(kind):
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in ("csv", "ndjson"):
+        abort(400, description="format must be csv or ndjson")
+    compress = request.args.get("gzip", "false").lower() in ("1", "true", "yes")
+    since, until = parse_iso_arg("since"), parse_iso_arg("until")
+    filename = f"{kind}.{fmt}" + (".gz" if compress else "")
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    mimetype = "application/gzip" if compress else ("text/csv" if fmt == "csv" else "application/x-ndjson")
+    return Response(export_chunks(kind, fmt, since, until, compress), mimetype=mimetype, headers=headers)
+
+@app.route('/export/messages', methods=['GET'])
+def export_messages():
+    require_admin_token()
+    return export_args("messages")
+
+@app.route('/export/orders', methods=['GET'])
+def export_orders():
+    require_admin_token()
+    return export_args("orders")
+
+export_cli = AppGroup("export", help="Stream messages or orders to CSV/NDJSON.")
+
+def run_export_command(kind, fmt, since, until, compress, output):
+    since = datetime.fromisoformat(since) if since else None
+    until = datetime.fromisoformat(until) if until else None
+    target = open(output, "wb") if output else click.get_binary_stream("stdout")
+    try:
+        for chunk in export_chunks(kind, fmt, since, until, compress):
+            target.write(chunk)
+    finally:
+        if output:
+            target.close()
+
+def export_options(fn):
+    fn = click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), default="ndjson", show_default=True)(fn)
+    fn = click.option("--since", help="ISO date/time, inclusive.")(fn)
+    fn = click.option("--until", help="ISO date/time, exclusive.")(fn)
+    fn = click.option("--gzip", "compress", is_flag=True)(fn)
+    fn = click.option("-o", "--output", help="File to write; stdout by default.")(fn)
+    return fn
+
+@export_cli.command("messages")
+@export_options
+def export_messages_command(fmt, since, until, compress, output):
+    run_export_command("messages", fmt, since, until, compress, output)
+
+@export_cli.command("orders")
+@export_options
+def export_orders_command(fmt, since, until, compress, output):
+    run_export_command("orders", fmt, since, until, compress, output)
+
+app.cli.add_command(export_cli)
+
+def rebuild_rollups():
+    # Recompute both rollups in bulk from the latest row of every order number
+    latest = (
+        select(func.max(LineMyShopOrder.id))
+        .group_by(func.coalesce(LineMyShopOrder.order_number, func.cast(LineMyShopOrder.id, String)))
+    )
+    # Same day as order_rollup_day(); first_event_time is timestamptz on PostgreSQL, so pin it to UTC first
+    first_event_time = LineMyShopOrder.first_event_time
+    if engine.dialect.name == "postgresql":
+        first_event_time = func.timezone("UTC", first_event_time)
+    day = func.date(func.coalesce(first_event_time, LineMyShopOrder.date))
+    status_rows = (
+        select(
+            day,
+            func.coalesce(LineMyShopOrder.order_status, ""),
+            func.count(LineMyShopOrder.id),
+            func.coalesce(func.sum(LineMyShopOrder.total_price), 0),
+        )
+        .where(LineMyShopOrder.id.in_(latest))
+        .group_by(day, func.coalesce(LineMyShopOrder.order_status, ""))
+    )
+    unit_price = func.coalesce(func.nullif(LineMyShopOrderItem.discounted_price, 0), LineMyShopOrderItem.price, 0)
+    quantity = func.coalesce(LineMyShopOrderItem.quantity, 0)
+    sku_rows = (
+        select(
+            day,
+            func.coalesce(LineMyShopOrderItem.sku, ""),
+            func.sum(quantity),
+            func.sum(quantity * unit_price),
+        )
+        .join(LineMyShopOrder, LineMyShopOrderItem.order_id == LineMyShopOrder.id)
+        .where(LineMyShopOrder.id.in_(latest))
+        .where(func.coalesce(LineMyShopOrder.order_status, "").not_in(ROLLUP_EXCLUDED_STATUSES))
+        .group_by(day, func.coalesce(LineMyShopOrderItem.sku, ""))
+    )
+    session.query(SalesDailyStatus).delete()
+    session.query(SalesDailySku).delete()
+    session.execute(
+        insert(SalesDailyStatus).from_select(["day", "order_status", "orders", "revenue"], status_rows)
+    )
+    session.execute(insert(SalesDailySku).from_select(["day", "sku", "units", "revenue"], sku_rows))
+    session.commit()
+
+def parse_day_arg(name, default):
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        return date_type.fromisoformat(value)
+    except ValueError:
+        abort(400, description=f"Invalid {name}: expected YYYY-MM-DD")
+
+@app.route('/reports/sales', methods=['GET'])
+def sales_report():
+    require_admin_token()
+    until = parse_day_arg("to", datetime.utcnow().date())
+    since = parse_day_arg("from", until - timedelta(days=29))
+    days = {}
+    status_rows = (
+        session.query(SalesDailyStatus)
+        .filter(SalesDailyStatus.day >= since, SalesDailyStatus.day <= until)
+        .order_by(SalesDailyStatus.day)
+    )
+    for row in status_rows:
+        if not row.orders and not row.revenue:
+            continue
+        day = days.setdefault(row.day.isoformat(), {"orders": 0, "revenue": 0.0, "by_status": {}})
+        day["orders"] += row.orders
+        day["revenue"] += row.revenue
+        day["by_status"][row.order_status] = {"orders": row.orders, "revenue": row.revenue}
+    sku_rows = (
+        session.query(SalesDailySku.sku, func.sum(SalesDailySku.units), func.sum(SalesDailySku.revenue))
+        .filter(SalesDailySku.day >= since, SalesDailySku.day <= until)
+        .group_by(SalesDailySku.sku)
+        .order_by(func.sum(SalesDailySku.units).desc())
+        .limit(request.args.get("top_skus", 20, type=int))
+        .all()
+    )
+    session.rollback()
+    return jsonify({
+        "from": since.isoformat(),
+        "to": until.isoformat(),
+        "days": days,
+        "skus": [{"sku": sku, "units": units, "revenue": revenue} for sku, units, revenue in sku_rows if units],
+    })
+
+def count_user_activity(counts):
+    # counts: {(user_id, day): messages}; goes into the caller's transaction
+    increment_rows(UserDailyActivity, ["user_id", "day"], ["messages"], {k: (v,) for k, v in counts.items()})
+
+def activity_window_start():
+    return datetime.now().date() - timedelta(days=ACTIVITY_WINDOW_DAYS - 1)
+
+def load_activity_counts():
+    rows = (
+        session.query(UserDailyActivity.user_id, func.sum(UserDailyActivity.messages))
+        .filter(UserDailyActivity.day >= activity_window_start())
+        .group_by(UserDailyActivity.user_id)
+        .all()
+    )
+    session.rollback()
+    return {user_id: int(count) for user_id, count in rows}
+
+activity_leaderboard = Leaderboard(ACTIVITY_TOP_N, load_activity_counts, window_key=activity_window_start)
+
+def top_active_users(n):
+    top = activity_leaderboard.top(n)
+    names = dict(
+        session.query(UserProfile.user_id, UserProfile.display_name)
+        .filter(UserProfile.user_id.in_([user_id for user_id, _ in top]))
+        .all()
+    ) if top else {}
+    session.rollback()
+    return [{"user_id": user_id, "display_name": names.get(user_id), "messages": count} for user_id, count in top]
+
+def handle_admin_command(text):
+    # "/top" or "/top 20" from the admin replies with the most active customers
+    parts = text.strip().split()
+    if not parts or parts[0].lower() != "/top":
+        return
+    n = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 10
+    rows = top_active_users(min(n, ACTIVITY_TOP_N))
+    lines = [f"🏆 Top {len(rows)} customers, last {ACTIVITY_WINDOW_DAYS} days"]
+    for rank, row in enumerate(rows, 1):
+        lines.append(f"{rank}. {row['display_name'] or row['user_id']} — {row['messages']}")
+    reply_to_line_user(ADMIN_ID, "\n".join(lines))
+
+@app.route('/reports/top-users', methods=['GET'])
+def top_users_report():
+    require_admin_token()
+    n = min(max(request.args.get("n", 10, type=int), 1), ACTIVITY_TOP_N)
+    return jsonify({"window_days": ACTIVITY_WINDOW_DAYS, "users": top_active_users(n)})
+
+rollups_cli = AppGroup("rollups", help="Sales rollup tables.")
+
+@rollups_cli.command("rebuild")
+def rollups_rebuild():
+    started = time.monotonic()
+    rebuild_rollups()
+    click.echo(f"📊 Rollups rebuilt in {time.monotonic() - started:.1f}s")
+
+app.cli.add_command(rollups_cli)
+
+autoreply_cli = AppGroup("autoreply", help="Manage keyword auto-reply rules.")
+
+@autoreply_cli.command("add")
+@click.argument("keyword")
+@click.argument("reply")
+@click.option("--priority", default=100, show_default=True, help="Lower numbers win when several keywords match.")
+def autoreply_add(keyword, reply, priority):
+    rule = AutoReplyRule(keyword=keyword, reply=reply, priority=priority)
+    session.add(rule)
+    session.commit()
+    click.echo(f"✅ Added rule {rule.id}")
+
+@autoreply_cli.command("list")
+def autoreply_list():
+    for rule in session.query(AutoReplyRule).order_by(AutoReplyRule.priority, AutoReplyRule.id):
+        state = "on " if rule.enabled else "off"
+        click.echo(f"{rule.id}\t{state}\t{rule.priority}\t{rule.keyword}\t{rule.reply}")
+
+@autoreply_cli.command("set-enabled")
+@click.argument("rule_id", type=int)
+@click.argument("enabled", type=bool)
+def autoreply_set_enabled(rule_id, enabled):
+    rule = session.get(AutoReplyRule, rule_id)
+    if rule is None:
+        raise click.ClickException(f"No rule {rule_id}")
+    rule.enabled = enabled
+    session.commit()
+    click.echo(f"✅ Rule {rule_id} {'enabled' if enabled else 'disabled'}")
+
+@autoreply_cli.command("remove")
+@click.argument("rule_id", type=int)
+def autoreply_remove(rule_id):
+    deleted = session.query(AutoReplyRule).filter_by(id=rule_id).delete()
+    session.commit()
+    click.echo(f"🗑️ Removed {deleted} rule(s)")
+
+@autoreply_cli.command("test")
+@click.argument("text")
+def autoreply_test(text):
+    auto_reply_engine.reload(force=True)
+    click.echo(auto_reply_engine.match(text) or "(no match)")
+
+app.cli.add_command(autoreply_cli)
+
+faq_cli = AppGroup("faq", help="Manage the FAQ knowledge base.")
+
+@faq_cli.command("add")
+@click.argument("question")
+@click.argument("answer")
+def faq_add(question, answer):
+    entry = FaqEntry(question=question, answer=answer)
+    session.add(entry)
+    session.commit()
+    click.echo(f"✅ Added FAQ entry {entry.id}")
+
+@faq_cli.command("list")
+def faq_list():
+    for entry in session.query(FaqEntry).order_by(FaqEntry.id):
+        state = "on " if entry.enabled else "off"
+        click.echo(f"{entry.id}\t{state}\t{entry.question}\t{entry.answer}")
+
+@faq_cli.command("edit")
+@click.argument("entry_id", type=int)
+@click.option("--question")
+@click.option("--answer")
+@click.option("--enabled", type=bool)
+def faq_edit(entry_id, question, answer, enabled):
+    entry = session.get(FaqEntry, entry_id)
+    if entry is None:
+        raise click.ClickException(f"No FAQ entry {entry_id}")
+    if question is not None:
+        entry.question = question
+    if answer is not None:
+        entry.answer = answer
+    if enabled is not None:
+        entry.enabled = enabled
+    session.commit()
+    click.echo(f"✅ Updated FAQ entry {entry_id}")
+
+@faq_cli.command("remove")
+@click.argument("entry_id", type=int)
+def faq_remove(entry_id):
+    deleted = session.query(FaqEntry).filter_by(id=entry_id).delete()
+    session.commit()
+    click.echo(f"🗑️ Removed {deleted} entry(s)")
+
+@faq_cli.command("search")
+@click.argument("text")
+def faq_search(text):
+    for hit in faq_retriever.search(text, FAQ_TOP_K):
+        click.echo(f"{hit['score']:.3f}\t{hit['id']}\t{hit['question']}")
+
+app.cli.add_command(faq_cli)
+
+profiles_cli = AppGroup("profiles", help="Maintain LINE user profiles.")
+
+@profiles_cli.command("backfill")
+@click.option("--rate", default=50.0, show_default=True, help="Profile requests per second.")
+@click.option("--workers", default=8, show_default=True, help="Concurrent profile requests.")
+@click.option("--batch-size", default=500, show_default=True, help="Profiles per upsert.")
+@click.option("--all", "refresh_all", is_flag=True, help="Refetch profiles that already have a name.")
+def profiles_backfill(rate, workers, batch_size, refresh_all):
+    started = time.monotonic()
+    totals = backfill_profiles(rate, workers, batch_size, only_missing=not refresh_all)
+    elapsed = time.monotonic() - started
+    click.echo(json.dumps(dict(totals, elapsed_s=round(elapsed, 1))))
+
+@profiles_cli.command("refresh")
+@click.option("--limit", default=PROFILE_REFRESH_BATCH, show_default=True, help="Profiles to refresh.")
+@click.option("--rate", default=PROFILE_RATE_LIMIT, show_default=True, help="Profile requests per second.")
+def profiles_refresh(limit, rate):
+    refreshed, unreachable, failed = refresh_stale_profiles(limit, RateLimiter(rate))
+    click.echo(f"✅ Refreshed {refreshed}, {unreachable} unreachable, {failed} failed")
+
+app.cli.add_command(profiles_cli)
+
+@app.route('/media/<int:media_id>', methods=['GET'])
+def media_content(media_id):
+    require_admin_token()
+    media = session.get(Media, media_id)
+    session.rollback()
+    if media is None or media.status != "stored" or media_store is None:
+        abort(404)
+    return send_file(media_store.path_for(media.sha256), mimetype=media.content_type or "application/octet-stream",
+                     etag=media.sha256, max_age=86400)
+
+media_cli = AppGroup("media", help="Downloaded message content.")
+
+@media_cli.command("retry")
+@click.option("--limit", default=500, show_default=True)
+@click.option("--max-attempts", default=5, show_default=True)
+def media_retry(limit, max_attempts):
+    if media_store is None:
+        raise click.ClickException("MEDIA_DIR is not set")
+    ids = [row[0] for row in session.query(Media.id).filter(
+        Media.status.in_(["pending", "failed"]), Media.attempts < max_attempts
+    ).order_by(Media.id).limit(limit)]
+    session.rollback()
+    stored = 0
+    for media_id in ids:
+        try:
+            download_media(media_id)
+            stored += 1
+        except Exception as e:
+            click.echo(f"⚠️ media {media_id}: {e}")
+    click.echo(f"✅ Stored {stored} of {len(ids)}")
+
+app.cli.add_command(media_cli)
+
+def refresh_profiles_job():
+    if LINE_OUTBOUND_ENABLED:
+        refresh_stale_profiles()
+
+job_scheduler.add("dlq_retry", DLQ_RETRY_INTERVAL, retry_dead_letters)
+job_scheduler.add("profile_refresh", PROFILE_REFRESH_INTERVAL, refresh_profiles_job)
+job_scheduler.add("rollup_rebuild", ROLLUP_REBUILD_INTERVAL, rebuild_rollups)
+
+def maintain_partitions():
+    if engine.dialect.name != "postgresql":
+        return []
+    created = []
+    this_month = partitions.month_start(datetime.utcnow())
+    with engine.begin() as conn:
+        for table in PARTITIONED_TABLES:
+            if partitions.is_partitioned(conn, table.name):
+                created += partitions.create_month_partitions(
+                    conn, table.name, this_month, partitions.add_months(this_month, PARTITION_MONTHS_AHEAD)
+                )
+    for name in created:
+        print(f"🗂️ Created partition {name}")
+    return created
+
+def run_retention(months=None, dry_run=False):
+    months = months or RETENTION_MONTHS
+    if months <= 0:
+        return []
+    if not RETENTION_EXPORT_DIR:
+        raise RuntimeError("RETENTION_EXPORT_DIR must be set: rows are exported before they are dropped")
+    cutoff = partitions.add_months(partitions.month_start(datetime.utcnow()), -months)
+    retired = []
+    for table in PARTITIONED_TABLES:
+        with engine.connect() as conn:
+            partitioned = engine.dialect.name == "postgresql" and partitions.is_partitioned(conn, table.name)
+            expired = partitions.expired_months(conn, table, cutoff, partitioned)
+        for month in expired:
+            if dry_run:
+                retired.append({"table": table.name, "month": month.isoformat()[:7]})
+                continue
+            result = partitions.retire_month(engine, table, month, RETENTION_EXPORT_DIR)
+            print(f"🧊 Retired {result['table']} {result['month']}: {result['rows']} rows -> {result['export'] or 'nothing to export'}")
+            retired.append(result)
+    return retired
+
+job_scheduler.add("partition_maintenance", PARTITION_MAINTENANCE_INTERVAL if engine.dialect.name == "postgresql" else 0,
+                  maintain_partitions)
+job_scheduler.add("retention", RETENTION_INTERVAL if RETENTION_MONTHS > 0 else 0, run_retention)
+
+partitions_cli = AppGroup("partitions", help="Monthly partitions of the message history tables (PostgreSQL).")
+
+@partitions_cli.command("status")
+def partitions_status():
+    if engine.dialect.name != "postgresql":
+        raise click.ClickException("Partitioning is only used on PostgreSQL")
+    with engine.connect() as conn:
+        for table in PARTITIONED_TABLES:
+            if not partitions.is_partitioned(conn, table.name):
+                click.echo(f"{table.name}: not partitioned")
+                continue
+            for name, bound in partitions.list_partitions(conn, table.name).items():
+                click.echo(f"{table.name}\t{name}\t{bound}")
+
+@partitions_cli.command("maintain")
+def partitions_maintain():
+    created = maintain_partitions()
+    click.echo(f"✅ Created {len(created)} partition(s)")
+
+@partitions_cli.command("migrate")
+@click.option("--table", "table_names", multiple=True, help="Only these tables (default: all history tables).")
+def partitions_migrate(table_names):
+    if engine.dialect.name != "postgresql":
+        raise click.ClickException("Partitioning is only used on PostgreSQL")
+    for table in PARTITIONED_TABLES:
+        if table_names and table.name not in table_names:
+            continue
+        with engine.begin() as conn:
+            if partitions.is_partitioned(conn, table.name):
+                click.echo(f"⏭️ {table.name} is already partitioned")
+                continue
+            click.echo(f"🔧 Migrating {table.name} (locks the table until done)")
+            extra = ["ix_messages_text_trgm"] if table.name == "messages" else []
+            copied = partitions.migrate_to_partitioned(conn, table, PARTITION_MONTHS_AHEAD, extra)
+        click.echo(f"✅ {table.name}: {copied} rows copied")
+    with engine.begin() as conn:
+        ensure_indexes(conn)
+    ensure_search_index()
+
+retention_cli = AppGroup("retention", help="Export and drop old message history.")
+
+@retention_cli.command("run")
+@click.option("--months", type=int, help="Keep this many months (default RETENTION_MONTHS).")
+@click.option("--dry-run", is_flag=True, help="Only list the months that would be retired.")
+def retention_run(months, dry_run):
+    try:
+        retired = run_retention(months, dry_run)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(json.dumps(retired, indent=2))
+
+app.cli.add_command(partitions_cli)
+app.cli.add_command(retention_cli)
+
+def move_raw_data(batch_size=5000):
+    # One-off: copy legacy raw_data columns into line_myshop_order_payloads, then drop them
+    columns = {column["name"] for column in inspect(engine).get_columns("line_myshop_orders")}
+    if "raw_data" not in columns:
+        return 0
+    moved = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(sql_text("""
+                SELECT o.id, o.event_name, o.event_timestamp, o.date, o.raw_data
+                FROM line_myshop_orders o
+                WHERE o.id > :last_id AND o.raw_data IS NOT NULL
+                  AND NOT EXISTS (SELECT 1 FROM line_myshop_order_payloads p WHERE p.order_id = o.id)
+                ORDER BY o.id
+                LIMIT :limit
+            """).columns(date=DateTime), {"last_id": last_id, "limit": batch_size}).all()
+            if not rows:
+                break
+            payloads = []
+            for order_id, event_name, event_timestamp, received_at, raw_data in rows:
+                try:
+                    # Old rows hold str(dict), not JSON
+                    data = ast.literal_eval(raw_data)
+                except (ValueError, SyntaxError):
+                    data = {"raw_data": raw_data}
+                payloads.append({"order_id": order_id, "event_name": event_name, "event_timestamp": event_timestamp,
+                                 "received_at": received_at or datetime.utcnow(), "payload": compress_payload(data)})
+            conn.execute(insert(LineMyShopOrderPayload), payloads)
+        moved += len(rows)
+        last_id = rows[-1][0]
+        print(f"📦 Moved raw_data for {moved} orders")
+    with engine.begin() as conn:
+        conn.execute(sql_text("ALTER TABLE line_myshop_orders DROP COLUMN raw_data"))
+        item_columns = {column["name"] for column in inspect(conn).get_columns("line_myshop_order_items")}
+        # Item payloads are part of the order payload, so they are dropped rather than copied
+        if "raw_data" in item_columns:
+            conn.execute(sql_text("ALTER TABLE line_myshop_order_items DROP COLUMN raw_data"))
+    return moved
+
+def backfill_event_times(batch_size=5000):
+    # Parse event_timestamp into event_time for rows ingested before the column existed
+    filled = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(LineMyShopOrder.id, LineMyShopOrder.event_timestamp)
+                .where(LineMyShopOrder.id > last_id, LineMyShopOrder.event_time.is_(None),
+                       LineMyShopOrder.event_timestamp.isnot(None))
+                .order_by(LineMyShopOrder.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            updates = [
+                {"row_id": row_id, "event_time": parse_event_time(timestamp)}
+                for row_id, timestamp in rows
+            ]
+            updates = [u for u in updates if u["event_time"] is not None]
+            if updates:
+                table = LineMyShopOrder.__table__
+                conn.execute(
+                    table.update().where(table.c.id == bindparam("row_id")).values(
+                        event_time=bindparam("event_time"),
+                        first_event_time=func.coalesce(table.c.first_event_time, bindparam("event_time")),
+                    ),
+                    updates,
+                )
+        filled += len(updates)
+        last_id = rows[-1][0]
+        print(f"🕒 Parsed event_time for {filled} orders")
+    return filled
+
+ORDER_RANGE_COLUMNS = [
+    "id", "order_number", "order_status", "event_name", "event_time", "payment_method", "payment_status",
+    "subtotal_price", "total_price", "shipment_price", "is_cod", "is_gift", "date",
+]
+
+def to_utc(value):
+    # Naive datetimes are taken as UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+def orders_between(since, until, status=None, limit=100, cursor=None):
+    # Range scan on (event_time, id), oldest first; the cursor is the last (event_time, id) returned
+    columns = [getattr(LineMyShopOrder, c) for c in ORDER_RANGE_COLUMNS]
+    query = select(*columns).where(LineMyShopOrder.event_time >= to_utc(since), LineMyShopOrder.event_time < to_utc(until))
+    if status:
+        query = query.where(LineMyShopOrder.order_status == status)
+    if cursor:
+        cursor_time, cursor_id = cursor
+        query = query.where(tuple_(LineMyShopOrder.event_time, LineMyShopOrder.id) > tuple_(to_utc(cursor_time), cursor_id))
+    rows = session.execute(query.order_by(LineMyShopOrder.event_time, LineMyShopOrder.id).limit(limit + 1)).all()
+    orders = []
+    for row in rows[:limit]:
+        order = dict(zip(ORDER_RANGE_COLUMNS, row))
+        order["event_time"] = to_utc(order["event_time"]).isoformat()
+        order["date"] = order["date"].isoformat()
+        orders.append(order)
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(to_utc(rows[limit - 1].event_time), rows[limit - 1].id)
+    return orders, next_cursor
+
+@app.route('/orders', methods=['GET'])
+def orders_in_range():
+    require_admin_token()
+    since, until = parse_iso_arg("from"), parse_iso_arg("to")
+    if not since or not until:
+        abort(400, description="from and to are required")
+    limit = min(max(request.args.get("limit", 100, type=int), 1), 1000)
+    cursor = request.args.get("cursor")
+    try:
+        cursor = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        abort(400, description="Invalid cursor")
+    orders, next_cursor = orders_between(since, until, request.args.get("status"), limit, cursor)
+    session.rollback()
+    return jsonify({"orders": orders, "next_cursor": next_cursor})
+
+orders_cli = AppGroup("orders", help="LINE MyShop order storage.")
+
+@orders_cli.command("backfill-event-time")
+@click.option("--batch-size", default=5000, show_default=True)
+def orders_backfill_event_time(batch_size):
+    filled = backfill_event_times(batch_size)
+    click.echo(f"✅ Parsed event_time for {filled} order(s)")
+    if filled:
+        # Their rollup day moves from the arrival date to the first event time
+        rebuild_rollups()
+        click.echo("📊 Rollups rebuilt")
+
+@orders_cli.command("move-raw-data")
+@click.option("--batch-size", default=5000, show_default=True)
+def orders_move_raw_data(batch_size):
+    moved = move_raw_data(batch_size)
+    click.echo(f"✅ Moved {moved} payload(s); raw_data columns dropped")
+    if engine.dialect.name == "sqlite":
+        click.echo("ℹ️ Run VACUUM to return the freed pages to the filesystem")
+
+@orders_cli.command("payloads")
+@click.argument("order_number")
+def orders_payloads(order_number):
+    for order in session.query(LineMyShopOrder).filter_by(order_number=order_number).order_by(LineMyShopOrder.id):
+        for payload in order.payloads:
+            click.echo(json.dumps({"event": payload.event_name, "timestamp": payload.event_timestamp,
+                                   "payload": decompress_payload(payload.payload)}, ensure_ascii=False))
+
+app.cli.add_command(orders_cli)
+
+db_cli = AppGroup("db", help="Schema migrations for existing databases.")
+
+@db_cli.command("migrate")
+def db_migrate():
+    """Bring existing tables up to the models; run once per deploy, before the workers start."""
+    changes = migrate_schema()
+    click.echo(f"✅ Applied {len(changes)} schema change(s)" if changes else "✅ Schema is up to date")
+
+@db_cli.command("status")
+def db_status():
+    for change in pending_migrations():
+        click.echo(change)
+
+app.cli.add_command(db_cli)
+
+jobs_cli = AppGroup("jobs", help="Periodic background jobs.")
+
+@jobs_cli.command("list")
+def jobs_list():
+    click.echo(json.dumps(job_scheduler.metrics(), indent=2))
+
+@jobs_cli.command("run")
+@click.argument("name")
+def jobs_run(name):
+    if name not in job_scheduler.jobs:
+        raise click.ClickException(f"Unknown or disabled job {name}; enabled: {', '.join(job_scheduler.jobs) or 'none'}")
+    click.echo(f"{name}: {job_scheduler.run_once(name, force=True)}")
+
+app.cli.add_command(jobs_cli)
+
+@app.route('/debug/queries', methods=['GET'])
+def query_report():
+    # Per worker process: each gunicorn worker keeps its own statistics
+    require_admin_token()
+    top = request.args.get("top", 50, type=int)
+    order = request.args.get("order", "total_ms")
+    if order not in ("total_ms", "count", "max_ms", "mean_ms", "slow"):
+        abort(400, description="order must be one of total_ms, count, max_ms, mean_ms, slow")
+    return jsonify(query_stats.report(top, order))
+
+@app.route('/debug/queries/<fingerprint>/explain', methods=['POST'])
+def explain_query(fingerprint):
+    require_admin_token()
+    try:
+        plan = query_stats.explain(engine, fingerprint)
+    except KeyError:
+        abort(404, description="No slow sample for this fingerprint in this worker")
+    except ValueError as e:
+        abort(400, description=str(e))
+    return jsonify({"fingerprint": fingerprint, "plan": plan})
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    require_admin_token()
+    return jsonify({name: source() for name, source in METRIC_SOURCES.items()})
 
-    
 if __name__ == '__main__':
     app.run(debug=True)